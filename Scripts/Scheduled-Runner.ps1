@@ -47,6 +47,9 @@ $PythonExe = "C:\Users\kapl\AppData\Local\Programs\Python\Python313\python.exe"
 # Optional knobs for the email script (leave empty if you don’t want them)
 $EmailMaxParallel = $null      # e.g. 6
 $EmailForceResend = $false     # $true to force resend regardless of DB
+$EmailUseDaemon   = $false     # $true to hand the job to a resident sender (send_reports_configured.py --serve); runs in-process if none is listening
+                               # Run --serve and this task as the same Windows user: the generated STATE_DIR\daemon.token is ACL'd to that user only
+$EmailCombined    = $false     # $true to mail all batches in one sender run after the last refresh (shared SMTP sessions, caches, prefetch)
 
 # ---- Parse BatchNumbers into array of ints ----
 $BatchArray = @()
@@ -160,12 +163,55 @@ function Get-RunId {
     return "run-log_{0}_Batch-{1}" -f $dateStr, $BatchNumber
 }
 
+# ---- Run send_reports_configured.py for one or more (batch, Email_List) pairs ----
+function Invoke-EmailSender {
+    param([array]$Pairs)
+    $label = ($Pairs | ForEach-Object { $_[0] }) -join ","
+    Write-Log "Launching email sender for batch $label …"
+    $scriptPath   = Join-Path $ScriptsDir "send_reports_configured.py"
+    $quotedScript = '"' + $scriptPath  + '"'
+
+    $pyArgs = @("-u", $quotedScript)
+    foreach ($pair in $Pairs) {
+        $pyArgs += @("--batch", $pair[0], "--email-list", ('"' + $pair[1] + '"'))
+    }
+    if ($EmailMaxParallel) { $pyArgs += @("--max-parallel", $EmailMaxParallel) }
+    if ($EmailForceResend) { $pyArgs += "--force-resend" }
+    if ($EmailUseDaemon)   { $pyArgs += "--daemon" }
+
+    $psi = New-Object System.Diagnostics.ProcessStartInfo
+    $psi.FileName = $PythonExe
+    $psi.Arguments = ($pyArgs -join " ")
+    Write-Log "Email cmd: $($psi.FileName) $($psi.Arguments)"
+    $psi.WorkingDirectory = $ScriptsDir
+    $psi.RedirectStandardOutput = $true
+    $psi.RedirectStandardError  = $true
+    $psi.UseShellExecute = $false
+    $psi.CreateNoWindow = $true
+
+    $proc = [System.Diagnostics.Process]::Start($psi)
+    $stdOut = $proc.StandardOutput.ReadToEnd()
+    $stdErr = $proc.StandardError.ReadToEnd()
+    $proc.WaitForExit()
+
+    if ($stdOut) { Write-Log "[email stdout] $stdOut".Trim() }
+    if ($stdErr) { Write-Log "[email stderr] $stdErr".Trim() }
+
+    if ($proc.ExitCode -eq 0) {
+        Write-Log "Email step completed successfully for batch $label."
+    } else {
+        Write-Log "Email step FAILED for batch $label (exit $($proc.ExitCode))."
+    }
+    return $proc.ExitCode
+}
+
 # ================== MAIN ==================
 Write-Log "=== Scheduled-Runner started ==="
 Write-Log "User=$env:USERNAME  Computer=$env:COMPUTERNAME  FastMode=$($FastMode.IsPresent)"
 Write-Log "Batches: $BatchNumbers"
 
 $success = 0; $failed = 0
+$EmailPairs = @()
 
 foreach ($bn in $BatchArray) {
     if (-not $MasterFileMap.ContainsKey($bn)) {
@@ -227,43 +273,11 @@ foreach ($bn in $BatchArray) {
             if (-not (Test-Path $emailList)) {
                 Write-Log "WARNING: Email list not reachable: $emailList (skipping email step)."
             } else {
-                Write-Log "Launching email sender for batch $bn …"
-                $scriptPath   = Join-Path $ScriptsDir "send_reports_configured.py"
-                $quotedScript = '"' + $scriptPath  + '"'
-                $quotedEmail  = '"' + $emailList   + '"'
-                
-                
-              $pyArgs = @(
-                    "-u",
-                    $quotedScript,
-                    "--batch", $bn,
-                    "--email-list", $quotedEmail
-                )
-                if ($EmailMaxParallel) { $pyArgs += @("--max-parallel", $EmailMaxParallel) }
-                if ($EmailForceResend) { $pyArgs += "--force-resend" }
-
-                $psi = New-Object System.Diagnostics.ProcessStartInfo
-                $psi.FileName = $PythonExe
-                $psi.Arguments = ($pyArgs -join " ")
-                Write-Log "Email cmd: $($psi.FileName) $($psi.Arguments)"
-                $psi.WorkingDirectory = $ScriptsDir
-                $psi.RedirectStandardOutput = $true
-                $psi.RedirectStandardError  = $true
-                $psi.UseShellExecute = $false
-                $psi.CreateNoWindow = $true
-
-                $proc = [System.Diagnostics.Process]::Start($psi)
-                $stdOut = $proc.StandardOutput.ReadToEnd()
-                $stdErr = $proc.StandardError.ReadToEnd()
-                $proc.WaitForExit()
-
-                if ($stdOut) { Write-Log "[email stdout] $stdOut".Trim() }
-                if ($stdErr) { Write-Log "[email stderr] $stdErr".Trim() }
-
-                if ($proc.ExitCode -eq 0) {
-                    Write-Log "Email step completed successfully for batch $bn."
+                if ($EmailCombined) {
+                    $EmailPairs += ,@($bn, $emailList)
+                    Write-Log "Email for batch $bn deferred to the combined sender run."
                 } else {
-                    Write-Log "Email step FAILED for batch $bn (exit $($proc.ExitCode))."
+                    Invoke-EmailSender -Pairs @(,@($bn, $emailList)) | Out-Null
                 }
             }
         } else {
@@ -284,5 +298,9 @@ foreach ($bn in $BatchArray) {
     }
 }
 
+if ($EmailPairs.Count -gt 0) {
+    Invoke-EmailSender -Pairs $EmailPairs | Out-Null
+}
+
 Write-Log "=== Summary: OK=$success  FAIL=$failed  Total=$($BatchArray.Count) ==="
 if ($failed -gt 0) { exit 1 } else { exit 0 }
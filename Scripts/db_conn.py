@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+db_conn.py
+
+Connection to the reportlogs database, shared by send_reports_configured.py and
+migrate_events_schema.py (the migration does not import the whole sender).
+
+REPORTLOGS_CONN example:
+Server=127.0.0.1;Port=3306;Database=reportlogs;Uid=root;Pwd=****;AllowPublicKeyRetrieval=True;SslMode=None
+
+pymysql is imported on first connect.
+"""
+
+import functools
+import os
+
+
+def parse_conn_env() -> dict:
+    """PyMySQL connect() arguments from REPORTLOGS_CONN."""
+    return dict(_parse_conn_string(os.environ.get("REPORTLOGS_CONN", "")))
+
+
+@functools.lru_cache(maxsize=4)
+def _parse_conn_string(raw: str) -> dict:
+    parts = [p for p in raw.split(";") if p.strip()]
+    kv = {}
+    for p in parts:
+        if "=" in p:
+            k, v = p.split("=", 1)
+            kv[k.strip().lower()] = v.strip()
+    host = kv.get("server", "127.0.0.1")
+    port = int(kv.get("port", 3306) or 3306)
+    db   = kv.get("database", "reportlogs")
+    user = kv.get("uid") or kv.get("user") or "root"
+    pwd  = kv.get("pwd") or kv.get("password") or ""
+    # For PyMySQL: allow public key retrieval and SSL off if SslMode=None
+    ssl_mode = (kv.get("sslmode") or "").lower()
+    ssl = None
+    if ssl_mode and ssl_mode not in ("none", "disabled"):
+        ssl = {"ssl": {}}  # use default SSL; adjust if you actually want TLS
+    return dict(host=host, port=port, user=user, password=pwd, database=db, charset="utf8mb4", autocommit=True, **({} if ssl is None else ssl))
+
+
+def db_connect():
+    import pymysql
+    params = parse_conn_env()
+    return pymysql.connect(**params)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+migrate_events_schema.py
+- Applies numbered schema migrations to the reportlogs database (REPORTLOGS_CONN)
+- Records applied versions in schema_migrations; safe to run again
+- Migration 1: normalized key columns on events (path_key, to_key, subject_key),
+  a BEFORE INSERT trigger that fills them for writers that don't (PowerShell),
+  a chunked backfill and composite indexes so lookups use plain equality
+- Migration 2: email_claims, one row per email idempotency key; the sender
+  claims a key (PENDING) before SMTP and finalizes it to OK / FAIL, and deletes
+  claims of rundates older than CLAIM_KEEP_DAYS at run start
+- Migration 3: events.sender, the account an Email event was sent from
+  (per-account daily quotas); older rows stay NULL
+
+USAGE (examples):
+  python migrate_events_schema.py
+  python migrate_events_schema.py --chunk-size 2000
+  python migrate_events_schema.py --status
+
+NOTE:
+- Creating the trigger needs the TRIGGER privilege (and SUPER or
+  log_bin_trust_function_creators=1 when binary logging is on).
+- Keys are built by path_keys.py; keep it in sync with the trigger expressions.
+- The migration 1 indexes are prefix indexes (path_key(255), to_key(191),
+  subject_key(191)): full 700-character utf8mb4 keys would exceed InnoDB's
+  3072-byte index limit. They are therefore not covering. MySQL narrows on the
+  prefix, then reads each candidate row to compare the full key. Keys that share
+  a long prefix (deep folders, long subjects) cost extra row reads, but results
+  are still exact.
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import path_keys
+from db_conn import db_connect
+
+DEFAULT_CHUNK = 5000
+
+# =========================
+# Helpers
+# =========================
+def column_exists(conn, table: str, column: str) -> bool:
+    sql = """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql, (table, column))
+        return cur.fetchone() is not None
+
+def index_exists(conn, table: str, index: str) -> bool:
+    sql = """
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql, (table, index))
+        return cur.fetchone() is not None
+
+def trigger_exists(conn, name: str) -> bool:
+    sql = """
+        SELECT 1 FROM information_schema.triggers
+        WHERE trigger_schema = DATABASE() AND trigger_name = %s
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql, (name,))
+        return cur.fetchone() is not None
+
+def execute(conn, sql: str, dry_run: bool):
+    logging.info(("DRYRUN: " if dry_run else "") + " ".join(sql.split()))
+    if not dry_run:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+
+def ensure_migrations_table(conn, dry_run: bool):
+    execute(conn, """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version     INT          NOT NULL PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_utc DATETIME     NOT NULL
+        )
+    """, dry_run)
+
+def applied_versions(conn) -> set[int]:
+    with conn.cursor() as cur:
+        cur.execute("SHOW TABLES LIKE 'schema_migrations'")
+        if cur.fetchone() is None:
+            return set()
+        cur.execute("SELECT version FROM schema_migrations")
+        return {int(r[0]) for r in cur.fetchall()}
+
+def record_version(conn, version: int, description: str, dry_run: bool):
+    if dry_run:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO schema_migrations (version, description, applied_utc) VALUES (%s, %s, UTC_TIMESTAMP())",
+            (version, description),
+        )
+
+# =========================
+# Migration 1: normalized keys on events
+# =========================
+def backfill_event_keys(conn, chunk_size: int, dry_run: bool) -> int:
+    """
+    Fill path_key/to_key/subject_key for existing rows, walking the primary key
+    in chunks so no single UPDATE locks the whole table.
+    """
+    last_id = 0
+    updated = 0
+    select_sql = """
+        SELECT id, file_path, recipients_to, subject
+        FROM events
+        WHERE id > %s
+        ORDER BY id
+        LIMIT %s
+    """
+    update_sql = "UPDATE events SET path_key=%s, to_key=%s, subject_key=%s WHERE id=%s"
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(select_sql, (last_id, chunk_size))
+            rows = cur.fetchall()
+        if not rows:
+            break
+        params = [
+            (path_keys.path_key(fp), path_keys.to_key(to), path_keys.subject_key(subj), rid)
+            for rid, fp, to, subj in rows
+        ]
+        if not dry_run:
+            conn.begin()
+            with conn.cursor() as cur:
+                cur.executemany(update_sql, params)
+            conn.commit()
+        last_id = rows[-1][0]
+        updated += len(rows)
+        logging.info(f"Backfilled {updated} rows (id <= {last_id})")
+    return updated
+
+def migration_1(conn, chunk_size: int, dry_run: bool):
+    columns = [
+        ("path_key", f"VARCHAR({path_keys.PATH_KEY_LEN}) NULL"),
+        ("to_key", f"VARCHAR({path_keys.TO_KEY_LEN}) NULL"),
+        ("subject_key", f"VARCHAR({path_keys.SUBJECT_KEY_LEN}) NULL"),
+    ]
+    for name, ddl in columns:
+        if not column_exists(conn, "events", name):
+            execute(conn, f"ALTER TABLE events ADD COLUMN {name} {ddl}", dry_run)
+
+    # Trigger first, so rows inserted while the backfill runs already carry keys
+    if not trigger_exists(conn, "events_fill_keys"):
+        path_expr = path_keys.PATH_KEY_SQL.format(col="NEW.file_path")
+        to_expr = path_keys.TO_KEY_SQL.format(col="NEW.recipients_to")
+        subject_expr = path_keys.SUBJECT_KEY_SQL.format(col="NEW.subject")
+        execute(conn, f"""
+            CREATE TRIGGER events_fill_keys BEFORE INSERT ON events
+            FOR EACH ROW
+            BEGIN
+                IF NEW.path_key IS NULL THEN SET NEW.path_key = {path_expr}; END IF;
+                IF NEW.to_key IS NULL THEN SET NEW.to_key = {to_expr}; END IF;
+                IF NEW.subject_key IS NULL THEN SET NEW.subject_key = {subject_expr}; END IF;
+            END
+        """, dry_run)
+
+    t0 = time.perf_counter()
+    rows = backfill_event_keys(conn, chunk_size, dry_run)
+    logging.info(f"Backfill done: {rows} rows in {time.perf_counter() - t0:.1f}s")
+
+    # Prefix indexes (see NOTE above): not covering, the row is read to compare the full key
+    indexes = [
+        ("ix_events_stage_path", "(stage, status, path_key(255), rundate)"),
+        ("ix_events_stage_email", "(stage, status, rundate, batch, to_key(191), subject_key(191))"),
+    ]
+    for name, cols in indexes:
+        if not index_exists(conn, "events", name):
+            execute(conn, f"CREATE INDEX {name} ON events {cols}", dry_run)
+
+# =========================
+# Migration 2: email claims
+# =========================
+def migration_2(conn, chunk_size: int, dry_run: bool):
+    execute(conn, """
+        CREATE TABLE IF NOT EXISTS email_claims (
+            claim_key   CHAR(40)    NOT NULL PRIMARY KEY,
+            rundate     DATE        NOT NULL,
+            batch       VARCHAR(64) NOT NULL,
+            status      VARCHAR(10) NOT NULL,
+            owner       VARCHAR(64) NOT NULL,
+            claimed_utc DATETIME    NOT NULL,
+            updated_utc DATETIME    NOT NULL,
+            KEY ix_email_claims_rundate (rundate, batch)
+        )
+    """, dry_run)
+
+# =========================
+# Migration 3: sender account on events
+# =========================
+def migration_3(conn, chunk_size: int, dry_run: bool):
+    if not column_exists(conn, "events", "sender"):
+        execute(conn, "ALTER TABLE events ADD COLUMN sender VARCHAR(255) NULL", dry_run)
+    if not index_exists(conn, "events", "ix_events_stage_sender"):
+        execute(conn, "CREATE INDEX ix_events_stage_sender ON events (stage, status, sender(191), timestamp_utc)", dry_run)
+
+MIGRATIONS = [
+    (1, "events: normalized path/recipient/subject keys + composite indexes", migration_1),
+    (2, "email_claims: claim-before-send idempotency keys", migration_2),
+    (3, "events: sender account column", migration_3),
+]
+
+# =========================
+# Main
+# =========================
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations to the reportlogs database.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK, help=f"Rows per backfill chunk (default: {DEFAULT_CHUNK})")
+    parser.add_argument("--status", action="store_true", help="Only list applied / pending migrations")
+    parser.add_argument("--dry-run", action="store_true", help="Log statements only; change nothing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", stream=sys.stdout)
+
+    try:
+        conn = db_connect()
+    except Exception as e:
+        logging.error(f"DB connection failed (check REPORTLOGS_CONN): {e}")
+        return 2
+
+    try:
+        done = applied_versions(conn)
+        for version, description, _ in MIGRATIONS:
+            logging.info(f"[{'applied' if version in done else 'pending'}] {version}: {description}")
+        if args.status:
+            return 0
+
+        ensure_migrations_table(conn, args.dry_run)
+        for version, description, fn in MIGRATIONS:
+            if version in done:
+                continue
+            logging.info(f"=== Migration {version}: {description} ===")
+            try:
+                fn(conn, max(1, args.chunk_size), args.dry_run)
+                record_version(conn, version, description, args.dry_run)
+            except Exception as e:
+                logging.exception(f"Migration {version} failed: {e}")
+                return 3
+        logging.info("=== Schema up to date ===")
+        return 0
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+path_keys.py
+
+Canonical lookup keys stored on the events table:
+- path_key    : file path, trimmed, '\\' -> '/', lowercase
+- to_key      : recipient list, spaces removed, ';' -> ',', lowercase
+- subject_key : subject, trimmed, lowercase
+
+Python (send_reports_configured.py, migrate_events_schema.py backfill) and MySQL
+(the BEFORE INSERT trigger used for rows written by the PowerShell scripts) must
+build identical keys. The SQL expressions below mirror the Python functions one
+to one - change both together and re-run the backfill.
+
+email_claim_key() is Python only: the idempotency key of one email (email_claims).
+"""
+
+import hashlib
+
+PATH_KEY_LEN = 700
+TO_KEY_LEN = 700
+SUBJECT_KEY_LEN = 255
+
+
+def path_key(file_path) -> str:
+    return str(file_path or "").strip(" ").replace("\\", "/").lower()[:PATH_KEY_LEN]
+
+
+def to_key(recipients: str) -> str:
+    return (recipients or "").replace(" ", "").replace(";", ",").lower()[:TO_KEY_LEN]
+
+
+def subject_key(subject: str) -> str:
+    return (subject or "").strip(" ").lower()[:SUBJECT_KEY_LEN]
+
+
+def email_claim_key(rundate, batch: str, recipients: str, subject: str, file_paths) -> str:
+    """
+    rundate + batch + recipients + subject + attachment set (order-insensitive),
+    hashed to 40 hex chars.
+    """
+    paths = ";".join(sorted({path_key(p) for p in file_paths}))
+    raw = "\x1f".join([str(rundate), str(batch), to_key(recipients), subject_key(subject), paths])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+# SQL equivalents; {col} is a column reference such as NEW.file_path
+PATH_KEY_SQL = "LEFT(LOWER(REPLACE(TRIM(COALESCE({col}, '')), '\\\\', '/')), %d)" % PATH_KEY_LEN
+TO_KEY_SQL = "LEFT(LOWER(REPLACE(REPLACE(COALESCE({col}, ''), ' ', ''), ';', ',')), %d)" % TO_KEY_LEN
+SUBJECT_KEY_SQL = "LEFT(LOWER(TRIM(COALESCE({col}, ''))), %d)" % SUBJECT_KEY_LEN
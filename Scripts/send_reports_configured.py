@@ -8,14 +8,56 @@ Same behavior as your previous version, but:
 - Exports a per-run email CSV from DB at the end
 - Added parallel execution to reduce processing time
 - Added force resend option to bypass all validations
+- Reuses authenticated SMTP sessions across messages (per-worker session pool)
+- Token-bucket rate limiter shared by all workers; only real SMTP sends are throttled
+- Refresh status for every attachment is prefetched in bulk before dispatch
+- "Already emailed" keys for the run are loaded once into a set (optional mid-run refresh)
+- Email events are journaled locally and written to the DB in batches (write-behind)
+- Long-lived, pinged MySQL connections from a small per-process pool
+- Uses the normalized key columns (migrate_events_schema.py) for equality lookups when present
+- Each attachment is read and base64-encoded once per worker and reused by later rows
+- Optional streaming send for large attachments (spooled MIME, chunked base64, streamed DATA)
+- Attachment size policy: attach as-is, zip, or replace with a share link (optional "Attach Mode" column)
+- Parsed Email_List is cached locally and only re-parsed when the workbook changed
+- pandas/pymysql are imported on first use; optional streaming List reader (openpyxl, no DataFrame)
+- Resident sender (--serve) keeps workers, sessions and parsed lists warm; --daemon hands a job to it
+- Follow mode (--follow): tails Refresh OK events and mails each row as soon as its files are fresh
+- Local SQLite outbox: transient SMTP failures are retried with backoff; a rerun resumes the run
+- Claim-before-send (email_claims, schema 2): an email is claimed atomically before SMTP, so
+  parallel workers and overlapping runs cannot both send it; claims older than CLAIM_KEEP_DAYS are pruned
+- Selectable fan-out engine (--engine process|thread|pipeline)
+- Adaptive concurrency (--adaptive): AIMD on rows in flight, driven by send latency and 4xx throttling
+- Multiple sender accounts (SENDER_ACCOUNTS), each with its own rate bucket and daily quota;
+  failover on throttling / exhausted quota; the account used is stored on each Email event (schema 3)
+- Several batches per run (repeated --batch/--email-list, or --batch-map) share workers, SMTP
+  sessions, caches and one refresh-status prefetch; each keeps its own run_id and CSV
+- Pre-flight: the whole List is validated / normalized column by column before dispatch
+  (addresses, attachments, greeting, duplicate rows); rejected rows are logged in bulk
+- Attachment stats come from one os.scandir per folder (folders in parallel), cached for the run
+  and reused by the existence check, size policy and attachment cache
+- Content dedupe (--content-dedupe skip|notice): unchanged attachments already delivered to the
+  same recipients + subject are skipped or replaced by a short "no change" mail
+- Coalescing (--coalesce): rows to the same recipients share one message (merged subject, size
+  cap); one Email event per row is still written
+- Pipeline engine (--engine pipeline): build threads encode messages into a bounded queue that
+  separately sized SMTP sender threads drain; queue depth and per-stage utilization are logged
 """
 
+from __future__ import annotations
+
+import time
+_T_START = time.perf_counter()
+
 # ============================== CONFIG ===============================
 CONFIG = {
+    # LOG_DIR / STATE_DIR: environment variables REPORTLOGS_LOG_DIR / REPORTLOGS_STATE_DIR, when set, win
     "LOG_DIR": r"C:\Users\kapl\Desktop\Project-Reporting-Automation\Logginfo",
 
     # Will be overridden by --batch at runtime (only used for log rows)
     "BATCH": "EmailRun",
+
+    # Local state (event journal etc.) - keep outside LOG_DIR so the sync job doesn't copy it
+    "STATE_DIR": r"C:\Users\kapl\Desktop\Project-Reporting-Automation\State",
     "MASTER_PATH": r"C:\Users\kapl\Desktop\Project-Reporting-Automation\Master-sheet\03.00 PM Udyam Stock Report.xlsb",
 
     # Gmail
@@ -31,10 +73,127 @@ CONFIG = {
     "SMTP_SERVER": "smtp.gmail.com",
     "SMTP_PORT_SSL": 465,
     "SMTP_PORT_STARTTLS": 587,
+    "SMTP_TIMEOUT_S": 60,             # Socket timeout for SMTP connect/commands
+    "SMTP_MAX_MESSAGES_PER_SESSION": 50,  # Recycle (QUIT + reconnect) a session after this many sends
+    "SMTP_IDLE_TIMEOUT_S": 60,        # Recycle a session that sat idle for longer than this
+
+    # Email_List parse cache under STATE_DIR (--no-list-cache to bypass)
+    "LIST_CACHE": True,
+    "LIST_READER": "pandas",          # pandas | stream (openpyxl read-only rows, no DataFrame; --list-reader)
+
+    # Send rate (shared by all workers, only applies to real SMTP sends)
+    "SEND_RATE_PER_SEC": 1.0,         # Sustained messages per second
+    "SEND_BURST": 1,                  # Messages that may go out back-to-back before throttling
+    "DAILY_SEND_QUOTA": 2000,         # Gmail (Workspace) daily recipient-message budget
+
+    # Sender accounts (empty = FROM_USER / APP_PASSWORD alone). Each account has its own token
+    # bucket and daily quota; optional per-account "rate_per_sec" / "burst" / "daily_quota"
+    # override the values above. Rows are spread round-robin, or pinned to one account per
+    # recipient list with ACCOUNT_STICKY; a throttled (4xx) or exhausted account hands the
+    # message to the next one. e.g.
+    # [{"user": "report@kotharigroupindia.com", "password": "..."},
+    #  {"user": "report2@kotharigroupindia.com", "password": "...", "daily_quota": 500}]
+    "SENDER_ACCOUNTS": [],
+    "ACCOUNT_STICKY": False,
+    "ACCOUNT_THROTTLE_PAUSE_S": 300,  # A throttled account goes to the back of the line this long
+
+    # MySQL connection pool (per process: main and each worker)
+    "DB_POOL_SIZE": 2,                # Max open connections per process
+    "DB_PING_IDLE_S": 10,             # Ping a pooled connection before reuse if idle this long
+
+    # Encoded attachment cache (per worker): parts are reused while path+size+mtime match
+    "ATTACHMENT_CACHE_MAX_BYTES": 200 * 1024 * 1024,
+
+    # Attachment stats: each attachment folder is listed once per run (os.scandir), this many
+    # folders at a time; existence checks, size policy and the attachment cache reuse the result
+    "STAT_WORKERS": 8,
+
+    # Streaming send: messages whose attachments total at least the threshold are built
+    # into a spooled temp file chunk by chunk and streamed to DATA (bounded memory)
+    "STREAM_LARGE_ATTACHMENTS": False,
+    "STREAM_THRESHOLD_BYTES": 5 * 1024 * 1024,
+    "STREAM_SPOOL_MAX_BYTES": 1024 * 1024,  # spool stays in RAM below this, then goes to disk
+
+    # Attachment size policy (raw bytes on disk). Per row override: "Attach Mode" column
+    # (auto | attach | zip | link); auto picks by size
+    "ATTACH_MODE": "auto",
+    "ATTACH_ZIP_OVER_BYTES": 8 * 1024 * 1024,       # auto: deflate into a .zip above this
+    "ATTACH_LINK_OVER_BYTES": 18 * 1024 * 1024,     # auto: send the share path instead above this
+    "ATTACH_MAX_MESSAGE_BYTES": 18 * 1024 * 1024,   # Gmail's 25 MB limit applies after base64 (+33%)
+    "ZIP_WORKERS": 2,                               # Compression threads per worker process
+    # Optional UNC prefix -> URL prefix rewrites for linked files, e.g.
+    # {r"\\192.168.1.237\Accounts": "https://files.example.local/Accounts"}
+    "SHARE_LINK_PREFIXES": {},
 
     # Parallel execution
-    "MAX_PARALLEL": 1,  # Default max parallel processes
+    "MAX_PARALLEL": 1,  # Default max parallel processes (>1 is duplicate-safe once migration 2 is applied)
+    # process: worker processes (isolated, pays spawn + imports per worker)
+    # thread : threads in this process sharing one SMTP/DB/attachment pool (rows are network-bound)
+    # 60 rows, 150 ms SMTP latency, 8 parallel: process/spawn 3.8s, thread 1.9s
+    # ("async", an asyncio front over the thread engine, was removed; it now runs as thread)
+    # pipeline: build threads (checks, content hash, MIME / base64) fill a bounded queue of
+    # ready messages that MAX_PARALLEL (--max-parallel) SMTP sender threads drain
+    "ENGINE": "thread",
+    "PIPELINE_BUILD_WORKERS": 2,      # --build-workers
+    "PIPELINE_QUEUE_SIZE": 8,         # Built messages waiting for a sender, at most
+
+    # Adaptive concurrency (--adaptive): rows in flight start at ADAPTIVE_MIN, grow by one per
+    # round of clean sends up to ADAPTIVE_MAX (or --max-parallel), halve on a throttle reply
+    # (4xx such as 421/454) and shrink by one when send latency exceeds FACTOR x its baseline
+    "ADAPTIVE_CONCURRENCY": False,
+    "ADAPTIVE_MIN": 1,
+    "ADAPTIVE_MAX": 8,
+    "ADAPTIVE_LATENCY_FACTOR": 2.0,
+
+    # Content dedupe (--content-dedupe): a sha256 per attachment (chunked, cached by path + size +
+    # mtime in STATE_DIR/content_hashes.sqlite) and per delivered attachment set, keyed by recipients
+    # + subject. Same bytes delivered within the window: skip = SKIP the row, notice = send a short
+    # "no change" mail without attachments
+    "CONTENT_DEDUPE": "off",          # off | skip | notice
+    "CONTENT_DEDUPE_WINDOW_H": 24,
+
+    # Coalescing (--coalesce): rows of a batch to the same Receiver / CC / BCC that are ready
+    # together go out as one message (merged subject, all attachments) within these caps;
+    # every row still gets its own Email event
+    "COALESCE_ROWS": False,
+    "COALESCE_MAX_ROWS": 10,
+    "COALESCE_MAX_BYTES": 15 * 1024 * 1024,   # raw attachment bytes per message
+
+    # Claim-before-send (email_claims): a PENDING claim older than this is taken over
+    # (its holder is assumed dead)
+    "CLAIM_STALE_S": 900,
+    # Claims of rundates older than this are deleted at run start (0 = keep forever)
+    "CLAIM_KEEP_DAYS": 30,
     
+    # Outbox (STATE_DIR/outbox.sqlite): per-row status of each run. Transient send errors
+    # (timeouts, resets, 4xx) are retried with exponential backoff + jitter; 5xx fail at once.
+    # A rerun of the same batch/date does not dispatch rows that already went out.
+    "OUTBOX": True,
+    "SEND_RETRY_MAX_ATTEMPTS": 4,     # Sends per row, first attempt included
+    "SEND_RETRY_BASE_S": 30,          # Delay before the 1st retry; doubles per attempt
+    "SEND_RETRY_MAX_S": 600,          # Cap per delay (an explicit retry-after hint may exceed it)
+    "OUTBOX_KEEP_DAYS": 7,
+
+    # Follow mode (--follow): poll new Refresh OK events every N seconds; rows still
+    # waiting after the deadline go through the normal checks and FAIL as not refreshed
+    "FOLLOW_POLL_S": 10,
+    "FOLLOW_DEADLINE_MIN": 90,
+
+    # Reload the "already emailed" set every N seconds during long batches (0 = load once)
+    "EMAILED_KEYS_REFRESH_S": 0,
+
+    # Resident sender: --serve listens here (loopback only); --daemon submits jobs to it.
+    # DAEMON_TOKEN must match on both sides. Left empty, --serve generates one into
+    # STATE_DIR/daemon.token (this user only: mode 0600, on Windows an owner-only ACL set with
+    # icacls) and --daemon, run as the same user, reads it from there;
+    # a non-loopback DAEMON_ADDR refuses to start without an explicit token.
+    "DAEMON_ADDR": "127.0.0.1:8765",
+    "DAEMON_TOKEN": "",
+
+    # Email event write-behind: flush to DB every N events or every N seconds
+    "EVENT_FLUSH_SIZE": 50,
+    "EVENT_FLUSH_INTERVAL_S": 5,
+
     # Fallback email timing (hours)
     "FALLBACK_HOURS": 18,  # Consider emails sent in last 18 hours as "already sent"
     
@@ -45,19 +204,58 @@ CONFIG = {
 
 import os
 import csv
+import json
 from datetime import datetime, date, timedelta, timezone
-from email.message import EmailMessage
+from email.message import EmailMessage, MIMEPart
+from email.utils import parseaddr
 import mimetypes
 import smtplib
 import ssl
 from pathlib import Path
 import argparse
 import sys
-import time
-
-import pandas as pd
-import pymysql
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import atexit
+import threading
+import functools
+from contextlib import contextmanager
+import multiprocessing
+from typing import NamedTuple, TYPE_CHECKING
+from collections import OrderedDict, deque
+
+import base64
+import tempfile
+import uuid
+import email.policy
+import io
+import zipfile
+import zlib
+import stat
+import hashlib
+import pickle
+import socket
+import socketserver
+import signal
+import sqlite3
+import random
+import heapq
+import secrets
+import subprocess
+import ipaddress
+import queue
+import re
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from path_keys import path_key, to_key, subject_key, email_claim_key
+from db_conn import db_connect
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# pandas / pymysql are imported where they are used: a worker that only sends
+# mail (and every spawned pool child) does not pay for them at start-up
+_T_IMPORTED = time.perf_counter()
 
 DEFAULT_BODY = """{GREETING},
 
@@ -76,9 +274,14 @@ If you are not the intended recipient, please notify us immediately and delete t
 🌱 Please consider the environment before printing this email.
 """
 
+for _key in ("LOG_DIR", "STATE_DIR"):
+    CONFIG[_key] = os.environ.get(f"REPORTLOGS_{_key}") or CONFIG[_key]
+
 #
 LOG_FILE_NAME = "email-runner.log"
 LOG_FILE_PATH = os.path.join(CONFIG["LOG_DIR"], LOG_FILE_NAME)
+# Extra sinks for log lines (the resident sender streams a job's lines to its client)
+_LOG_LISTENERS: list = []
 def write_log(message: str):
     """
     Writes a timestamped message to both the console and a log file, 
@@ -102,6 +305,8 @@ def write_log(message: str):
 
         # 4. Write the line to the console (Write-Host equivalent)
         print(log_line)
+        for listener in list(_LOG_LISTENERS):
+            listener(log_line)
 
         # 5. Append the line to the log file (Out-File -Append equivalent)
         # Using 'a' for append mode.
@@ -125,6 +330,24 @@ def normalize_addr_list(value: str) -> str:
     parts = [p.strip() for p in value.split(",") if p.strip()]
     return ", ".join(parts)
 
+def clean_addr_list(value: str) -> tuple[list[str], list[str]]:
+    """
+    Split a To/CC/BCC cell like normalize_addr_list and drop repeats (case-insensitive).
+    Returns (addresses, entries that are not an address).
+    """
+    good, bad, seen = [], [], set()
+    for part in (value or "").replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        addr = parseaddr(part)[1]
+        if "@" not in addr or any(c.isspace() for c in addr):
+            bad.append(part)
+        elif addr.lower() not in seen:
+            seen.add(addr.lower())
+            good.append(part)
+    return good, bad
+
 def split_attachments(value: str) -> list[Path]:
     raw = (value or "").strip()
     if not raw:
@@ -132,17 +355,144 @@ def split_attachments(value: str) -> list[Path]:
     parts = [p.strip() for p in raw.split(";")]
     return [Path(p) for p in parts if p]
 
-def load_email_list(xlsx_path: Path) -> pd.DataFrame:
+def load_email_list(xlsx_path) -> pd.DataFrame:
+    import pandas as pd
     xl = pd.ExcelFile(xlsx_path)
     df_list = pd.read_excel(xl, "List")
     df_list.columns = [str(c).strip() for c in df_list.columns]
     return df_list
 
+LIST_READERS = ("pandas", "stream")
+
+def _read_list_sheet(xlsx_path):
+    """
+    Rows of the "List" sheet as value tuples via openpyxl read-only mode, header
+    first. Blank rows between data rows are kept and trailing ones dropped, like
+    pandas.read_excel, so both readers yield the same row indexes.
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        rows = wb["List"].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c).strip() if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        yield tuple(columns)
+        width = len(columns)
+        blanks = 0
+        for values in rows:
+            values = tuple(values[:width]) + (None,) * (width - len(values))
+            if all(_is_blank(v) or (isinstance(v, str) and not v.strip()) for v in values):
+                blanks += 1
+                continue
+            for _ in range(blanks):
+                yield (None,) * width
+            blanks = 0
+            yield values
+    finally:
+        wb.close()
+
+def read_email_list(xlsx_path, reader: str = "pandas") -> tuple[list[str], list[tuple]]:
+    """Parse the "List" sheet into (columns, row tuples) with the pandas or the streaming reader."""
+    if reader == "stream":
+        rows = _read_list_sheet(xlsx_path)
+        return list(next(rows, ())), list(rows)
+    df_list = load_email_list(xlsx_path)
+    return list(df_list.columns), list(df_list.itertuples(index=False, name=None))
+
+LIST_CACHE_VERSION = 1
+
+def load_email_list_cached(xlsx_path: Path, cache_dir: Path, reader: str = "pandas") -> tuple[list[str], list[tuple], str]:
+    """
+    read_email_list() behind a local cache of the parsed, column-normalized sheet
+    (pickled columns + row tuples). Returns (columns, rows, how) with how = hit | unchanged | parsed.
+    - source path, size and mtime match  -> cached rows, the workbook is not read
+    - otherwise the workbook is read once and hashed; same content hash -> cached rows
+    - else it is parsed from the bytes already read and the cache is rewritten
+    """
+    st = os.stat(xlsx_path)
+    source = str(xlsx_path)
+    cache_file = cache_dir / f"email-list_{hashlib.sha1(source.lower().encode('utf-8')).hexdigest()}.pkl"
+    cached = None
+    try:
+        with open(cache_file, "rb") as fh:
+            cached = pickle.load(fh)
+        if (cached.get("version") != LIST_CACHE_VERSION or cached.get("source") != source
+                or cached.get("reader", "pandas") != reader):
+            cached = None
+    except Exception:
+        cached = None
+
+    if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns:
+        return cached["columns"], cached["rows"], "hit"
+
+    with open(xlsx_path, "rb") as fh:
+        data = fh.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if cached and cached["sha256"] == digest:
+        entry, how = cached, "unchanged"
+    else:
+        columns, rows = read_email_list(io.BytesIO(data), reader)
+        entry = {
+            "version": LIST_CACHE_VERSION,
+            "source": source,
+            "reader": reader,
+            "sha256": digest,
+            "columns": columns,
+            "rows": rows,
+        }
+        how = "parsed"
+    entry["size"] = st.st_size
+    entry["mtime_ns"] = st.st_mtime_ns
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as fh:
+            pickle.dump(entry, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except OSError as e:
+        write_log(f"WARNING: Could not write Email_List cache {cache_file}: {e}")
+    return entry["columns"], entry["rows"], how
+
+def load_email_list_for_run(xlsx_path: Path, reader: str, use_cache: bool, memo: dict | None = None) -> tuple[list[str], list[tuple], str]:
+    """
+    Email_List for one run: the on-disk parse cache (unless use_cache is off) and,
+    in the resident sender, an in-memory copy (memo) kept while size and mtime match.
+    """
+    if memo is None or not use_cache:
+        if use_cache:
+            return load_email_list_cached(xlsx_path, Path(CONFIG["STATE_DIR"]) / "list-cache", reader)
+        columns, rows = read_email_list(xlsx_path, reader)
+        return columns, rows, "cache off"
+    st = os.stat(xlsx_path)
+    key = (str(xlsx_path), reader)
+    stamp = (st.st_size, st.st_mtime_ns)
+    held = memo.get(key)
+    if held and held[0] == stamp:
+        return held[1], held[2], "memory"
+    columns, rows, how = load_email_list_cached(xlsx_path, Path(CONFIG["STATE_DIR"]) / "list-cache", reader)
+    memo[key] = (stamp, columns, rows)
+    return columns, rows, how
+
+def _is_blank(value) -> bool:
+    """None, float NaN, pandas NA/NaT - without importing pandas."""
+    if value is None:
+        return True
+    if isinstance(value, float):
+        return value != value
+    return type(value).__name__ in ("NAType", "NaTType")
+
 def cell_str(row, col_name: str) -> str:
-    if col_name not in row or pd.isna(row[col_name]):
+    if col_name not in row or _is_blank(row[col_name]):
         return ""
     return str(row[col_name]).strip()
 
+def row_from_values(columns, values) -> dict[str, str]:
+    """One List row as a plain {column: stripped text} dict (cheap to pickle to workers)."""
+    row = dict(zip(columns, values))
+    return {col: cell_str(row, col) for col in columns}
+
 def get_greeting(to_addrs: str) -> str:
     recipients = [addr.strip() for addr in to_addrs.split(",") if addr.strip()]
     return "Dear Sir" if len(recipients) == 1 else "Dear Team"
@@ -154,63 +504,1046 @@ def infer_mime(path: Path) -> tuple[str, str]:
     major, minor = typ.split("/", 1)
     return (major, minor)
 
-def send_via_gmail(user, app_password, msg, use_ssl, server, port_ssl, port_starttls, all_recipients):
-    if use_ssl:
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL(server, port_ssl, context=context) as s:
-            s.login(user, app_password)
-            s.send_message(msg, from_addr=user, to_addrs=all_recipients or [user])
-    else:
-        with smtplib.SMTP(server, port_starttls) as s:
-            s.starttls()
-            s.login(user, app_password)
-            s.send_message(msg, from_addr=user, to_addrs=all_recipients or [user])
+# --------------------------- File stats -----------------------------
+
+class FileStat(NamedTuple):
+    size: int
+    mtime_ns: int
+
+def stat_file(path) -> FileStat | None:
+    """Size / mtime of a regular file, None when it is missing (or not a file)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return FileStat(st.st_size, st.st_mtime_ns) if stat.S_ISREG(st.st_mode) else None
+
+def _scan_dir(parent: str, names: set[str]) -> dict[str, FileStat]:
+    """Stats of the files in `parent` whose normcase'd name is in `names`, from one listing."""
+    found = {}
+    with os.scandir(parent) as it:
+        for entry in it:
+            name = os.path.normcase(entry.name)
+            if name not in names:
+                continue
+            try:
+                if entry.is_file():
+                    st = entry.stat()
+                    found[name] = FileStat(st.st_size, st.st_mtime_ns)
+            except OSError:
+                pass
+    return found
+
+class StatCache:
+    """
+    Size / mtime of attachment files for one run. Paths are grouped by parent
+    folder and each folder is listed once (os.scandir, several folders in
+    parallel), so a share folder costs one round trip instead of one per file
+    and row. Missing files are cached as None. Rows carry their files' stats to
+    the worker, where the existence check, size policy and attachment cache use
+    them instead of stat'ing again.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(1, int(workers))
+        self._stats: dict[str, FileStat | None] = {}
+        self.stats = {"dirs": 0, "files": 0, "missing": 0, "fallbacks": 0}
+
+    def prefetch(self, paths):
+        wanted: dict[str, dict[str, list[str]]] = {}
+        for p in dict.fromkeys(map(str, paths)):
+            if p not in self._stats:
+                parent, name = os.path.split(p)
+                wanted.setdefault(parent, {}).setdefault(os.path.normcase(name), []).append(p)
+        if not wanted:
+            return
+
+        def scan(parent):
+            names = wanted[parent]
+            try:
+                return parent, _scan_dir(parent or ".", set(names)), False
+            except FileNotFoundError:
+                return parent, {}, False
+            except OSError:
+                # Folder not listable (permissions): stat its files one by one
+                return parent, {name: stat_file(paths[0]) for name, paths in names.items()}, True
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(wanted)), thread_name_prefix="stat") as pool:
+            for parent, found, fell_back in pool.map(scan, wanted):
+                self.stats["dirs"] += 1
+                self.stats["fallbacks"] += int(fell_back)
+                for name, paths in wanted[parent].items():
+                    st = found.get(name)
+                    self.stats["files"] += len(paths)
+                    self.stats["missing"] += 0 if st is not None else len(paths)
+                    for p in paths:
+                        self._stats[p] = st
+
+    def get_many(self, paths) -> dict[str, FileStat | None]:
+        self.prefetch(paths)
+        return {str(p): self._stats[str(p)] for p in paths}
+
+    def forget(self, paths):
+        """Drop cached stats (files that may have been rewritten since, e.g. follow mode)."""
+        for p in paths:
+            self._stats.pop(str(p), None)
+
+# --------------------------- Attachment cache -----------------------
+
+class AttachmentCache:
+    """
+    Encoded MIME attachment parts keyed by (path, size, mtime).
+    A row that attaches a file already seen by this worker reuses the encoded
+    part: no second read from the share and no second base64 pass. Least
+    recently used parts are evicted once max_bytes of encoded data is held.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = int(max_bytes)
+        self._parts: OrderedDict[tuple, tuple[MIMEPart, int, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes_read": 0, "bytes_saved": 0}
+
+    @staticmethod
+    def build_part(path: Path, data: bytes) -> MIMEPart:
+        maintype, subtype = infer_mime(path)
+        part = MIMEPart()
+        part.set_content(data, maintype=maintype, subtype=subtype, filename=path.name)
+        return part
+
+    @staticmethod
+    def build_zip_part(path: Path) -> tuple[MIMEPart, int]:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+            with open(path, "rb") as src, zf.open(path.name, "w", force_zip64=True) as dst:
+                while True:
+                    chunk = src.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+        data = buf.getvalue()
+        part = MIMEPart()
+        part.set_content(data, maintype="application", subtype="zip", filename=path.name + ".zip")
+        return part, len(data)
+
+    def get_part(self, path: Path, st: FileStat | None = None) -> MIMEPart:
+        return self.get_part_sized(path, False, st)[0]
+
+    def get_part_sized(self, path: Path, zipped: bool = False, st: FileStat | None = None) -> tuple[MIMEPart, int]:
+        """
+        Part for `path` (deflated into a .zip if zipped) and its size in bytes before base64.
+        st: the file's prefetched stat (StatCache); stat'ed here when not given.
+        """
+        if st is None:
+            st = os.stat(path)
+            st = FileStat(st.st_size, st.st_mtime_ns)
+        key = (str(path), st.size, st.mtime_ns, zipped)
+        with self._lock:
+            hit = self._parts.get(key)
+            if hit is not None:
+                self._parts.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["bytes_saved"] += st.size
+                return hit[0], hit[2]
+        if zipped:
+            part, raw_size = self.build_zip_part(path)
+        else:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            part, raw_size = self.build_part(path, data), len(data)
+        encoded_size = len(part.get_payload())
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["bytes_read"] += st.size
+            if encoded_size <= self.max_bytes and key not in self._parts:
+                self._parts[key] = (part, encoded_size, raw_size)
+                self._bytes += encoded_size
+                while self._bytes > self.max_bytes:
+                    _, (_, size, _) = self._parts.popitem(last=False)
+                    self._bytes -= size
+                    self.stats["evictions"] += 1
+        return part, raw_size
+
+
+_ATTACHMENT_CACHE: AttachmentCache | None = None
+# Guards the lazily created per-process singletons when rows run on threads (--engine thread/pipeline)
+_SINGLETON_LOCK = threading.Lock()
+
+def get_attachment_cache(config) -> AttachmentCache:
+    global _ATTACHMENT_CACHE
+    with _SINGLETON_LOCK:
+        if _ATTACHMENT_CACHE is None:
+            _ATTACHMENT_CACHE = AttachmentCache(config.get("ATTACHMENT_CACHE_MAX_BYTES", 0))
+        return _ATTACHMENT_CACHE
+
+def attach_part(msg: EmailMessage, part: MIMEPart):
+    """Same result as msg.add_attachment(), but with a prebuilt (shared) part."""
+    if msg.get_content_type() != "multipart/mixed":
+        msg.make_mixed()
+    msg.attach(part)
+
+# --------------------------- Attachment size policy -----------------
+
+ATTACH_MODES = ("auto", "attach", "zip", "link")
+
+class AttachmentPlan(NamedTuple):
+    path: Path
+    action: str              # attach | zip | link
+    size: int                # bytes on disk
+    sent: int                # bytes that go into the message before base64 (0 for link)
+    part: MIMEPart | None    # prebuilt part for zip
+
+_ZIP_POOL: ThreadPoolExecutor | None = None
+_POLICY_STATS = {"attached": 0, "zipped": 0, "linked": 0, "bytes_avoided": 0}
+
+def _zip_pool(config) -> ThreadPoolExecutor:
+    global _ZIP_POOL
+    with _SINGLETON_LOCK:
+        if _ZIP_POOL is None:
+            _ZIP_POOL = ThreadPoolExecutor(max_workers=max(1, int(config.get("ZIP_WORKERS", 2))))
+        return _ZIP_POOL
+
+def _fmt_mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f}MB"
+
+def plan_attachments(config, atts: list[Path], mode: str = "auto", file_stats: dict | None = None) -> list[AttachmentPlan]:
+    """
+    Decide per file whether it is attached as-is, zipped or replaced by a link.
+    auto: link above ATTACH_LINK_OVER_BYTES, zip above ATTACH_ZIP_OVER_BYTES, else attach;
+    a zip that is still above the link limit becomes a link, and if the message
+    would exceed ATTACH_MAX_MESSAGE_BYTES the largest remaining files become links.
+    Compression runs on the per-worker zip thread pool and is cached like plain parts.
+    file_stats: prefetched FileStat per str(path) (StatCache); files not in it are stat'ed here.
+    """
+    file_stats = file_stats or {}
+    mode = mode if mode in ATTACH_MODES else "auto"
+    zip_over = int(config.get("ATTACH_ZIP_OVER_BYTES", 0))
+    link_over = int(config.get("ATTACH_LINK_OVER_BYTES", 0))
+    max_message = int(config.get("ATTACH_MAX_MESSAGE_BYTES", 0))
+
+    plan: list[AttachmentPlan] = []
+    for p in atts:
+        st = file_stats.get(str(p))
+        size = st.size if st is not None else os.path.getsize(p)
+        if mode != "auto":
+            action = mode
+        elif link_over and size > link_over:
+            action = "link"
+        elif zip_over and size > zip_over:
+            action = "zip"
+        else:
+            action = "attach"
+        plan.append(AttachmentPlan(p, action, size, 0 if action == "link" else size, None))
+
+    zip_idx = [i for i, item in enumerate(plan) if item.action == "zip"]
+    if zip_idx:
+        cache = get_attachment_cache(config)
+        futures = {
+            i: _zip_pool(config).submit(cache.get_part_sized, plan[i].path, True, file_stats.get(str(plan[i].path)))
+            for i in zip_idx
+        }
+        for i, fut in futures.items():
+            part, zipped_size = fut.result()
+            item = plan[i]
+            if mode == "auto" and link_over and zipped_size > link_over:
+                plan[i] = item._replace(action="link", sent=0)
+            else:
+                plan[i] = item._replace(sent=zipped_size, part=part)
+
+    if mode == "auto" and max_message:
+        while sum(item.sent for item in plan) > max_message:
+            i = max((j for j, item in enumerate(plan) if item.action != "link"), key=lambda j: plan[j].sent)
+            plan[i] = plan[i]._replace(action="link", sent=0, part=None)
+    return plan
+
+def count_sent_plan(plan: list[AttachmentPlan]):
+    """Size policy stats of a delivered message (plans rebuilt for retries or failover count once)."""
+    with _SINGLETON_LOCK:
+        for item in plan:
+            _POLICY_STATS[{"attach": "attached", "zip": "zipped", "link": "linked"}[item.action]] += 1
+            _POLICY_STATS["bytes_avoided"] += item.size - item.sent
+
+def describe_plan(plan: list[AttachmentPlan]) -> tuple[str, str]:
+    """(event method, note for error_text) - method stays 'Email' when everything was attached."""
+    actions = {item.action for item in plan}
+    method = "Email" + ("+Zip" if "zip" in actions else "") + ("+Link" if "link" in actions else "")
+    notes = []
+    for item in plan:
+        if item.action == "zip":
+            notes.append(f"zipped {item.path.name} {_fmt_mb(item.size)}->{_fmt_mb(item.sent)}")
+        elif item.action == "link":
+            notes.append(f"linked {item.path.name} {_fmt_mb(item.size)}")
+    avoided = sum(item.size - item.sent for item in plan)
+    if avoided > 0:
+        notes.append(f"avoided {_fmt_mb(avoided)}")
+    return method, "; ".join(notes)
+
+def share_link(path: Path, config) -> str:
+    text = str(path)
+    for prefix, url in (config.get("SHARE_LINK_PREFIXES") or {}).items():
+        if text.lower().startswith(prefix.lower()):
+            return url.rstrip("/") + "/" + text[len(prefix):].lstrip("\\/").replace("\\", "/")
+    return text
+
+def link_section(links: list[AttachmentPlan], config) -> str:
+    lines = ["", "The following report(s) are too large to attach and are available here:"]
+    lines += [f"  {item.path.name}: {share_link(item.path, config)}" for item in links]
+    return "\n".join(lines) + "\n"
+
+# --------------------------- SMTP session pool ----------------------
+
+class SmtpSession:
+    """One authenticated SMTP connection plus the counters used to recycle it."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.last_used = time.monotonic()
+        self.sent = 0
+
+
+class SmtpSessionPool:
+    """
+    Keeps authenticated SMTP connections open between messages.
+
+    - A session is reset with RSET before it is reused; a bad reply drops it
+    - Reconnects (once per message) when the server disconnects or answers 421
+    - Recycles a session after max_messages sends or idle_timeout seconds idle
+    """
+
+    def __init__(self, user, app_password, use_ssl, server, port_ssl, port_starttls,
+                 max_messages=50, idle_timeout=60, timeout=60):
+        self.user = user
+        self.app_password = app_password
+        self.use_ssl = use_ssl
+        self.server = server
+        self.port_ssl = port_ssl
+        self.port_starttls = port_starttls
+        self.max_messages = max(1, int(max_messages))
+        self.idle_timeout = float(idle_timeout)
+        self.timeout = timeout
+        self._idle: list[SmtpSession] = []
+        self._lock = threading.Lock()
+        self.stats = {"connects": 0, "logins": 0, "sends": 0, "reconnects": 0, "recycles": 0}
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _open(self) -> SmtpSession:
+        if self.use_ssl:
+            context = ssl.create_default_context()
+            conn = smtplib.SMTP_SSL(self.server, self.port_ssl, context=context, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(self.server, self.port_starttls, timeout=self.timeout)
+            conn.starttls()
+        self._count("connects")
+        try:
+            conn.login(self.user, self.app_password)
+        except Exception:
+            self._quit(conn)
+            raise
+        self._count("logins")
+        return SmtpSession(conn)
+
+    @staticmethod
+    def _quit(conn):
+        try:
+            conn.quit()
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def acquire(self) -> SmtpSession:
+        while True:
+            with self._lock:
+                sess = self._idle.pop() if self._idle else None
+            if sess is None:
+                return self._open()
+            idle_for = time.monotonic() - sess.last_used
+            if sess.sent >= self.max_messages or idle_for >= self.idle_timeout:
+                self._count("recycles")
+                self._quit(sess.conn)
+                continue
+            try:
+                code, _ = sess.conn.rset()
+            except (smtplib.SMTPException, OSError):
+                code = -1
+            if code == 250:
+                return sess
+            self._count("reconnects")
+            self._quit(sess.conn)
+
+    def release(self, sess: SmtpSession):
+        sess.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(sess)
+
+    def send_message(self, msg, from_addr: str, to_addrs: list[str]):
+        self._send(lambda conn: conn.send_message(msg, from_addr=from_addr, to_addrs=to_addrs))
+
+    def send_stream(self, spool, size: int, from_addr: str, to_addrs: list[str]):
+        """Send an already-encoded message (binary file, CRLF, dot-stuffed) without loading it."""
+        self._send(lambda conn: _smtp_send_stream(conn, spool, size, from_addr, to_addrs))
+
+    def _send(self, transaction):
+        for attempt in (1, 2):
+            sess = self.acquire()
+            try:
+                transaction(sess.conn)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._quit(sess.conn)
+                if attempt == 2:
+                    raise
+                self._count("reconnects")
+                continue
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code == 421:
+                    self._quit(sess.conn)
+                    if attempt == 2:
+                        raise
+                    self._count("reconnects")
+                    continue
+                self.release(sess)
+                raise
+            except Exception:
+                self.release(sess)
+                raise
+            sess.sent += 1
+            self._count("sends")
+            self.release(sess)
+            return
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sess in idle:
+            self._quit(sess.conn)
+
+
+# One pool per (account, server) in each worker process
+_SMTP_POOLS: dict[tuple, SmtpSessionPool] = {}
+_SMTP_POOLS_LOCK = threading.Lock()
+
+def get_smtp_pool(config, account=None) -> SmtpSessionPool:
+    use_ssl = bool(config["USE_SSL"])
+    user = account.user if account is not None else config["FROM_USER"]
+    password = account.password if account is not None else config["APP_PASSWORD"]
+    key = (user, config["SMTP_SERVER"], use_ssl)
+    with _SMTP_POOLS_LOCK:
+        pool = _SMTP_POOLS.get(key)
+        if pool is None:
+            pool = SmtpSessionPool(
+                user, password, use_ssl,
+                config["SMTP_SERVER"], int(config["SMTP_PORT_SSL"]), int(config["SMTP_PORT_STARTTLS"]),
+                max_messages=config.get("SMTP_MAX_MESSAGES_PER_SESSION", 50),
+                idle_timeout=config.get("SMTP_IDLE_TIMEOUT_S", 60),
+                timeout=config.get("SMTP_TIMEOUT_S", 60),
+            )
+            _SMTP_POOLS[key] = pool
+        return pool
+
+@atexit.register
+def _close_smtp_pools():
+    for pool in list(_SMTP_POOLS.values()):
+        pool.close_all()
+
+def send_via_gmail(config, msg, all_recipients, account=None):
+    pool = get_smtp_pool(config, account)
+    from_addr = account.user if account is not None else config["FROM_USER"]
+    pool.send_message(msg, from_addr=from_addr, to_addrs=all_recipients or [from_addr])
+
+# --------------------------- Streaming send -------------------------
+
+# Multiple of 57 bytes, so every chunk encodes to whole 76-char base64 lines
+STREAM_READ_CHUNK = 57 * 1024
+
+def _dot_stuff(data: bytes) -> bytes:
+    return data.replace(b"\r\n.", b"\r\n..")
+
+def _mixed_shell(msg: EmailMessage) -> EmailMessage:
+    """
+    A multipart/mixed message with msg's headers and content that shares msg's parts
+    (body, zipped attachments) instead of copying them; parts attached to it do not
+    touch msg, which is sent again as-is when the send fails over to another account.
+    """
+    shell = EmailMessage(policy=msg.policy)
+    if msg.get_content_type() == "multipart/mixed":
+        for name, value in msg.raw_items():
+            shell.set_raw(name, value)
+        shell.set_payload(list(msg.get_payload()))
+        return shell
+    # Same layout as make_mixed(): the current content becomes the first part
+    inner = MIMEPart(policy=msg.policy)
+    for name, value in msg.raw_items():
+        (inner if name.lower().startswith("content-") else shell).set_raw(name, value)
+    inner.set_payload(list(msg.get_payload()) if msg.is_multipart() else msg.get_payload())
+    shell["Content-Type"] = "multipart/mixed"
+    shell.set_payload([inner])
+    return shell
+
+def write_streamed_message(out, msg: EmailMessage, atts: list[Path]) -> int:
+    """
+    Write msg plus atts as one multipart/mixed message to the binary file `out`,
+    ready for the SMTP DATA phase (CRLF line endings, dot-stuffed). The email
+    package only renders a skeleton with a placeholder per attachment; each
+    file is then read and base64-encoded chunk by chunk in its place.
+    Returns the number of bytes written.
+    """
+    msg = _mixed_shell(msg)
+    tokens = []
+    for i, p in enumerate(atts):
+        maintype, subtype = infer_mime(p)
+        part = MIMEPart()
+        part.set_content(b"", maintype=maintype, subtype=subtype, filename=p.name)
+        token = f"@@ATTACHMENT-{i}-{uuid.uuid4().hex}@@"
+        part.set_payload(token)
+        attach_part(msg, part)
+        tokens.append((token.encode("ascii"), p))
+    skeleton = _dot_stuff(msg.as_bytes(policy=email.policy.SMTP))
+
+    written = 0
+    for token, p in tokens:
+        head, skeleton = skeleton.split(token, 1)
+        out.write(head)
+        written += len(head)
+        with open(p, "rb") as fh:
+            first = True
+            while True:
+                chunk = fh.read(STREAM_READ_CHUNK)
+                if not chunk:
+                    break
+                lines = base64.encodebytes(chunk).rstrip(b"\n").replace(b"\n", b"\r\n")
+                if not first:
+                    lines = b"\r\n" + lines
+                out.write(lines)
+                written += len(lines)
+                first = False
+    out.write(skeleton)
+    written += len(skeleton)
+    return written
+
+def _smtp_send_stream(conn, spool, size: int, from_addr: str, to_addrs: list[str]):
+    """MAIL/RCPT/DATA on an open smtplib connection, streaming the DATA body from `spool`."""
+    conn.ehlo_or_helo_if_needed()
+    options = [f"SIZE={size}"] if conn.does_esmtp and conn.has_extn("size") else []
+    code, resp = conn.mail(from_addr, options)
+    if code != 250:
+        conn.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = {}
+    for rcpt in to_addrs:
+        code, resp = conn.rcpt(rcpt)
+        if code not in (250, 251):
+            refused[rcpt] = (code, resp)
+    if len(refused) == len(to_addrs):
+        conn.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, resp = conn.docmd("data")
+    if code != 354:
+        conn.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    spool.seek(0)
+    tail = b""
+    while True:
+        chunk = spool.read(64 * 1024)
+        if not chunk:
+            break
+        conn.send(chunk)
+        tail = (tail + chunk)[-2:]
+    conn.send((b"" if tail == b"\r\n" else b"\r\n") + b".\r\n")
+    code, resp = conn.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+
+def send_via_gmail_streamed(config, msg, atts, all_recipients, account=None):
+    """
+    Like send_via_gmail, but attachments are never held in memory: the message is
+    spooled to a temp file (RAM up to STREAM_SPOOL_MAX_BYTES) and streamed to DATA.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=config.get("STREAM_SPOOL_MAX_BYTES", 1024 * 1024)) as spool:
+        size = write_streamed_message(spool, msg, atts)
+        pool = get_smtp_pool(config, account)
+        from_addr = account.user if account is not None else config["FROM_USER"]
+        pool.send_stream(spool, size, from_addr=from_addr, to_addrs=all_recipients or [from_addr])
+
+# --------------------------- Send rate limiter ---------------------
+
+class SendRateLimiter:
+    """
+    Token bucket + daily budget shared by every worker process.
+    State lives in multiprocessing Values so the pool initializer can hand the
+    same limiter to all workers; the limit holds whatever --max-parallel is.
+    The daily budget is a rolling 24 hours in hourly buckets, the same window the
+    DB seed counts; a send that did not go out is given back with refund().
+    """
+
+    def __init__(self, per_second: float, burst: int, per_day: int, sent_by_hours_ago: dict[int, int] | None = None):
+        self.per_second = float(per_second)
+        self.burst = max(1, int(burst))
+        self.per_day = int(per_day)
+        self._lock = multiprocessing.Lock()
+        self._tokens = multiprocessing.Value("d", float(self.burst), lock=False)
+        self._stamp = multiprocessing.Value("d", time.time(), lock=False)
+        # Bucket h % 24 counts the sends of hour h (hours since the epoch)
+        self._bucket_hour = multiprocessing.Array("q", 24, lock=False)
+        self._bucket_sent = multiprocessing.Array("i", 24, lock=False)
+        now_h = self._hour()
+        for ago, n in (sent_by_hours_ago or {}).items():
+            if 0 <= int(ago) < 24:
+                self._add(now_h - int(ago), int(n))
+
+    @staticmethod
+    def _hour() -> int:
+        return int(time.time() // 3600)
+
+    def _add(self, hour: int, n: int):
+        b = hour % 24
+        if self._bucket_hour[b] != hour:
+            self._bucket_hour[b] = hour
+            self._bucket_sent[b] = 0
+        self._bucket_sent[b] += n
+
+    def _sent_24h(self) -> int:
+        oldest = self._hour() - 23
+        return sum(n for h, n in zip(self._bucket_hour, self._bucket_sent) if h >= oldest)
+
+    def acquire(self) -> bool:
+        """
+        Block until a send token is available, and reserve one send of the daily
+        budget. Returns False (without waiting) once the budget is used up.
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                if self.per_day > 0 and self._sent_24h() >= self.per_day:
+                    return False
+                if self.per_second <= 0:
+                    self._add(self._hour(), 1)
+                    return True
+                elapsed = max(0.0, now - self._stamp.value)
+                self._tokens.value = min(float(self.burst), self._tokens.value + elapsed * self.per_second)
+                self._stamp.value = now
+                if self._tokens.value >= 1.0:
+                    self._tokens.value -= 1.0
+                    self._add(self._hour(), 1)
+                    return True
+                wait_s = (1.0 - self._tokens.value) / self.per_second
+            time.sleep(wait_s)
+
+    def refund(self):
+        """Give back the token and budget of an acquire() whose message was not delivered."""
+        with self._lock:
+            if self.per_second > 0:
+                self._tokens.value = min(float(self.burst), self._tokens.value + 1.0)
+            # The newest bucket that still holds a send (the hour may have turned since acquire)
+            oldest = self._hour() - 23
+            live = [b for b in range(24) if self._bucket_hour[b] >= oldest and self._bucket_sent[b] > 0]
+            if live:
+                b = max(live, key=lambda i: self._bucket_hour[i])
+                self._bucket_sent[b] -= 1
+
+    @property
+    def sent_24h(self) -> int:
+        with self._lock:
+            return self._sent_24h()
+
+
+# --------------------------- Sender accounts -----------------------
+
+class SenderAccount:
+    """One mailbox: credentials, its own SendRateLimiter and a shared 'throttled until' stamp."""
+
+    def __init__(self, user: str, password: str, limiter: SendRateLimiter):
+        self.user = user
+        self.password = password
+        self.limiter = limiter
+        self._paused_until = multiprocessing.Value("d", 0.0, lock=False)
+
+    def pause(self, seconds: float):
+        self._paused_until.value = max(self._paused_until.value, time.time() + float(seconds))
+
+    @property
+    def paused(self) -> bool:
+        return time.time() < self._paused_until.value
+
+
+class SenderAccounts:
+    """
+    The accounts a run sends from, handed to every worker like the single limiter
+    was. order() gives the accounts to try for one message: round-robin (or the
+    recipient list's own account when sticky), throttled accounts last.
+    """
+
+    def __init__(self, accounts: list[SenderAccount], sticky: bool):
+        self.accounts = accounts
+        self.sticky = bool(sticky)
+        self._next = multiprocessing.Value("i", 0)
+
+    def order(self, recipients: str) -> list[SenderAccount]:
+        n = len(self.accounts)
+        if n == 1:
+            return list(self.accounts)
+        if self.sticky:
+            start = zlib.crc32(to_key(recipients).encode("utf-8")) % n
+        else:
+            with self._next.get_lock():
+                start = self._next.value % n
+                self._next.value += 1
+        ordered = self.accounts[start:] + self.accounts[:start]
+        return sorted(ordered, key=lambda a: a.paused)
+
+    @property
+    def per_day(self) -> int:
+        return sum(a.limiter.per_day for a in self.accounts)
+
+    @property
+    def sent_24h(self) -> int:
+        return sum(a.limiter.sent_24h for a in self.accounts)
+
+    def describe(self) -> str:
+        return ", ".join(
+            f"{a.user} {a.limiter.sent_24h}/{a.limiter.per_day}{' (throttled)' if a.paused else ''}"
+            for a in self.accounts
+        )
+
+
+def sender_account_specs() -> list[dict]:
+    """SENDER_ACCOUNTS, or FROM_USER / APP_PASSWORD as the only account."""
+    return list(CONFIG.get("SENDER_ACCOUNTS") or []) or [
+        {"user": CONFIG["FROM_USER"], "password": CONFIG["APP_PASSWORD"]}
+    ]
+
+def build_sender_accounts(per_second: float, per_day: int, dry_run: bool) -> SenderAccounts:
+    """Sender accounts whose daily budgets start from what each sent in the last 24h."""
+    specs = sender_account_specs()
+    sent = {}
+    if not dry_run:
+        try:
+            with db_session() as conn:
+                for i, spec in enumerate(specs):
+                    # Events without a sender (schema < 3, older runs) count against the first account
+                    sent[spec["user"]] = db_emails_sent_by_hour(conn, spec["user"], unattributed=(i == 0))
+        except Exception as e:
+            write_log(f"WARNING: Could not read sent count for daily quota: {e}")
+    write_log("Sent in last 24h: " + ", ".join(f"{spec['user']}={sum(sent.get(spec['user'], {}).values())}" for spec in specs))
+    accounts = [
+        SenderAccount(spec["user"], spec["password"], SendRateLimiter(
+            spec.get("rate_per_sec", per_second), spec.get("burst", CONFIG["SEND_BURST"]),
+            spec.get("daily_quota", per_day), sent.get(spec["user"]),
+        ))
+        for spec in specs
+    ]
+    return SenderAccounts(accounts, CONFIG["ACCOUNT_STICKY"])
+
+# Set in each worker by init_worker()
+_SENDER_ACCOUNTS: SenderAccounts | None = None
+
+def init_worker(accounts, db_pool_size=None):
+    global _SENDER_ACCOUNTS, _DB_POOL
+    _SENDER_ACCOUNTS = accounts
+    _DB_POOL = DbPool(db_pool_size or CONFIG["DB_POOL_SIZE"], CONFIG["DB_PING_IDLE_S"])
+
+def init_in_process_workers(accounts, threads: int):
+    """
+    init_worker() for the thread / pipeline engines: rows run in this process, so
+    they share main's DB pool, grown to one connection per thread plus main.
+    """
+    global _SENDER_ACCOUNTS, _DB_POOL
+    _SENDER_ACCOUNTS = accounts
+    needed = max(int(CONFIG["DB_POOL_SIZE"]), int(threads) + 1)
+    if _DB_POOL is None or _DB_POOL.max_size < needed:
+        if _DB_POOL is not None:
+            _DB_POOL.close_all()
+        _DB_POOL = DbPool(needed, CONFIG["DB_PING_IDLE_S"])
+
+# --------------------------- Worker stats ---------------------------
+
+def worker_stats() -> dict:
+    """Snapshot of this process' resource counters; main keeps the latest snapshot per worker."""
+    smtp = {"connects": 0, "logins": 0, "sends": 0, "reconnects": 0, "recycles": 0}
+    for pool in list(_SMTP_POOLS.values()):
+        for k, v in pool.stats.items():
+            smtp[k] = smtp.get(k, 0) + v
+    db = _DB_POOL.snapshot() if _DB_POOL is not None else {}
+    attachments = dict(_ATTACHMENT_CACHE.stats) if _ATTACHMENT_CACHE is not None else {}
+    content = dict(_CONTENT_STORE.stats) if _CONTENT_STORE is not None else {}
+    startup = {"processes": 1, "import_ms": round((_T_IMPORTED - _T_START) * 1000)}
+    return {"smtp": smtp, "db": db, "attachments": attachments, "size_policy": dict(_POLICY_STATS),
+            "content": content, "startup": startup}
+
+def diff_worker_stats(after: dict, before: dict) -> dict:
+    """Counters in after minus those in before (per section)."""
+    return {
+        section: {k: v - before.get(section, {}).get(k, 0) for k, v in counters.items()}
+        for section, counters in after.items()
+    }
+
+def merge_worker_stats(snapshots) -> dict:
+    total: dict[str, dict] = {}
+    for snap in snapshots:
+        for section, counters in snap.items():
+            dst = total.setdefault(section, {})
+            for k, v in counters.items():
+                dst[k] = dst.get(k, 0) + v
+    return total
+
+def format_stats(counters: dict) -> str:
+    return " ".join(f"{k}={v}" for k, v in counters.items())
 
 # --------------------------- DB helpers -----------------------------
 
-def parse_conn_env():
-    """
-    REPORTLOGS_CONN example:
-    Server=127.0.0.1;Port=3306;Database=reportlogs;Uid=root;Pwd=****;AllowPublicKeyRetrieval=True;SslMode=None
-    """
-    raw = os.environ.get("REPORTLOGS_CONN", "")
-    parts = [p for p in raw.split(";") if p.strip()]
-    kv = {}
-    for p in parts:
-        if "=" in p:
-            k, v = p.split("=", 1)
-            kv[k.strip().lower()] = v.strip()
-    host = kv.get("server", "127.0.0.1")
-    port = int(kv.get("port", 3306) or 3306)
-    db   = kv.get("database", "reportlogs")
-    user = kv.get("uid") or kv.get("user") or "root"
-    pwd  = kv.get("pwd") or kv.get("password") or ""
-    # For PyMySQL: allow public key retrieval and SSL off if SslMode=None
-    ssl_mode = (kv.get("sslmode") or "").lower()
-    ssl = None
-    if ssl_mode and ssl_mode not in ("none", "disabled"):
-        ssl = {"ssl": {}}  # use default SSL; adjust if you actually want TLS
-    return dict(host=host, port=port, user=user, password=pwd, database=db, charset="utf8mb4", autocommit=True, **({} if ssl is None else ssl))
-
-def db_connect():
-    params = parse_conn_env()
-    return pymysql.connect(**params)
+class DbPool:
+    """
+    Bounded pool of long-lived PyMySQL connections for one process.
+    A connection idle for ping_idle_s or longer is pinged before reuse and
+    replaced if the ping fails; a connection that raised is closed, not returned.
+    """
+
+    def __init__(self, max_size: int = 2, ping_idle_s: float = 10):
+        self.max_size = max(1, int(max_size))
+        self.ping_idle_s = float(ping_idle_s)
+        self._idle: list[tuple] = []  # (conn, last_used)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self.stats = {"opened": 0, "reused": 0, "pings": 0, "dropped": 0}
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                conn = db_connect()
+                self._count("opened")
+                return conn
+            conn, last_used = item
+            if time.monotonic() - last_used >= self.ping_idle_s:
+                self._count("pings")
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    self._count("dropped")
+                    self._close(conn)
+                    continue
+            self._count("reused")
+            return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except Exception:
+            if conn is not None:
+                self._count("dropped")
+                self._close(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            self._slots.release()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+
+# One pool per process (created by init_worker in workers, lazily in main)
+_DB_POOL: DbPool | None = None
+
+def get_db_pool() -> DbPool:
+    global _DB_POOL
+    if _DB_POOL is None:
+        _DB_POOL = DbPool(CONFIG["DB_POOL_SIZE"], CONFIG["DB_PING_IDLE_S"])
+    return _DB_POOL
+
+def db_session():
+    """Context manager yielding a pooled connection: `with db_session() as conn: ...`"""
+    return get_db_pool().connection()
+
+@atexit.register
+def _close_db_pool():
+    if _DB_POOL is not None:
+        _DB_POOL.close_all()
+
+# Set once per process by event_schema_version()
+_EVENT_SCHEMA_VERSION: int | None = None
+
+def event_schema_version(conn) -> int:
+    """
+    Highest migration applied by migrate_events_schema.py (0 = original schema).
+    """
+    global _EVENT_SCHEMA_VERSION
+    if _EVENT_SCHEMA_VERSION is None:
+        import pymysql
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+                _EVENT_SCHEMA_VERSION = int(cur.fetchone()[0])
+        except pymysql.err.ProgrammingError:
+            _EVENT_SCHEMA_VERSION = 0  # table missing: not migrated yet
+    return _EVENT_SCHEMA_VERSION
+
+def has_event_keys(conn) -> bool:
+    """True when events carries path_key/to_key/subject_key (migration 1)."""
+    return event_schema_version(conn) >= 1
+
+def has_email_claims(conn) -> bool:
+    """True when the email_claims table exists (migration 2)."""
+    return event_schema_version(conn) >= 2
+
+def has_event_sender(conn) -> bool:
+    """True when events carries the sender account column (migration 3)."""
+    return event_schema_version(conn) >= 3
+
+def claim_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"[:64]
+
+def _pid_alive(pid: int) -> bool:
+    """
+    Whether a process of this host runs under pid (True when unsure: the caller then
+    waits for CLAIM_STALE_S). On Windows os.kill(pid, 0) sends CTRL_C_EVENT rather than
+    probing, so the process is opened and its exit code read instead.
+    """
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() != 87  # ERROR_INVALID_PARAMETER: no such process
+        try:
+            code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return True
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+def _owner_dead(owner: str) -> bool:
+    """
+    True when a claim owner (host:pid) is a process of this host that no longer runs.
+    Our own pid is alive: thread-engine workers and resident sender jobs share one owner.
+    """
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname()[:64 - len(pid) - 1] or not pid.isdigit():
+        return False
+    return not _pid_alive(int(pid))
+
+def db_claim_email(conn, claim_key: str, rundate: date, batch: str, owner: str, stale_s: int, resume: bool = False) -> str | None:
+    """
+    Atomically claim one email before sending it. Returns None when the caller
+    now holds the claim (new key, or a FAIL / stale PENDING claim taken over),
+    otherwise the status of the claim held elsewhere ('OK' or 'PENDING').
+    resume: the outbox recorded this email as in flight in a run that stopped; its
+    PENDING claim is taken over at once when the owner was a process of this host
+    that is gone, instead of waiting stale_s.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT IGNORE INTO email_claims (claim_key, rundate, batch, status, owner, claimed_utc, updated_utc)
+            VALUES (%s, %s, %s, 'PENDING', %s, UTC_TIMESTAMP(), UTC_TIMESTAMP())
+        """, (claim_key, rundate, batch, owner))
+        if cur.rowcount == 1:
+            return None
+        # Row lock + re-evaluated WHERE: of two callers taking over the same claim only one matches
+        cur.execute("""
+            UPDATE email_claims
+            SET status='PENDING', owner=%s, claimed_utc=UTC_TIMESTAMP(), updated_utc=UTC_TIMESTAMP()
+            WHERE claim_key=%s
+              AND (status='FAIL' OR (status='PENDING' AND updated_utc < UTC_TIMESTAMP() - INTERVAL %s SECOND))
+        """, (owner, claim_key, int(stale_s)))
+        if cur.rowcount == 1:
+            return None
+        cur.execute("SELECT status, owner FROM email_claims WHERE claim_key=%s", (claim_key,))
+        row = cur.fetchone()
+        if row and resume and row[0] == "PENDING" and _owner_dead(row[1]):
+            cur.execute("""
+                UPDATE email_claims
+                SET owner=%s, claimed_utc=UTC_TIMESTAMP(), updated_utc=UTC_TIMESTAMP()
+                WHERE claim_key=%s AND status='PENDING' AND owner=%s
+            """, (owner, claim_key, row[1]))
+            if cur.rowcount == 1:
+                return None
+        return row[0] if row else "PENDING"
+
+def db_finish_claim(conn, claim_key: str, owner: str, status: str):
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE email_claims SET status=%s, updated_utc=UTC_TIMESTAMP() WHERE claim_key=%s AND owner=%s",
+            (status, claim_key, owner),
+        )
+
+def db_prune_email_claims(conn, keep_days: int, chunk: int = 5000) -> int:
+    """
+    Delete claims of rundates more than keep_days before today, in chunks (the
+    rundate index bounds each DELETE, no long table lock). Returns rows deleted.
+    """
+    cutoff = date.today() - timedelta(days=keep_days)
+    deleted = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM email_claims WHERE rundate < %s LIMIT %s", (cutoff, chunk))
+            deleted += cur.rowcount
+        if cur.rowcount < chunk:
+            return deleted
 
 def db_get_latest_refresh_date(conn, file_path: str) -> date | None:
     """
     Get the most recent rundate when this file was successfully refreshed.
     Returns None if no successful refresh found.
     """
-    sql = """
-        SELECT rundate
-        FROM events
-        WHERE LOWER(file_path) COLLATE utf8mb4_unicode_ci = LOWER(%s) COLLATE utf8mb4_unicode_ci
-          AND stage='Refresh' AND status='OK'
-        ORDER BY rundate DESC, timestamp_utc DESC
-        LIMIT 1
-    """
+    if has_event_keys(conn):
+        sql = """
+            SELECT rundate
+            FROM events
+            WHERE stage='Refresh' AND status='OK'
+              AND path_key = %s
+            ORDER BY rundate DESC, timestamp_utc DESC
+            LIMIT 1
+        """
+        params = (path_key(file_path),)
+    else:
+        sql = """
+            SELECT rundate
+            FROM events
+            WHERE LOWER(file_path) COLLATE utf8mb4_unicode_ci = LOWER(%s) COLLATE utf8mb4_unicode_ci
+              AND stage='Refresh' AND status='OK'
+            ORDER BY rundate DESC, timestamp_utc DESC
+            LIMIT 1
+        """
+        params = (file_path,)
     with conn.cursor() as cur:
-        cur.execute(sql, (file_path,))
+        cur.execute(sql, params)
         result = cur.fetchone()
         return result[0] if result else None
 
@@ -218,77 +1551,628 @@ def db_refresh_ok_for_date(conn, file_path: str, check_date: date) -> bool:
     """
     Check if file was successfully refreshed on a specific date.
     """
-    sql = """
-        SELECT 1
-        FROM events
-        WHERE LOWER(file_path) COLLATE utf8mb4_unicode_ci = LOWER(%s) COLLATE utf8mb4_unicode_ci
-          AND stage='Refresh' AND status='OK'
-          AND rundate = %s
-        LIMIT 1
-    """
+    if has_event_keys(conn):
+        sql = """
+            SELECT 1
+            FROM events
+            WHERE stage='Refresh' AND status='OK'
+              AND path_key = %s
+              AND rundate = %s
+            LIMIT 1
+        """
+        params = (path_key(file_path), check_date)
+    else:
+        sql = """
+            SELECT 1
+            FROM events
+            WHERE LOWER(file_path) COLLATE utf8mb4_unicode_ci = LOWER(%s) COLLATE utf8mb4_unicode_ci
+              AND stage='Refresh' AND status='OK'
+              AND rundate = %s
+            LIMIT 1
+        """
+        params = (file_path, check_date)
     with conn.cursor() as cur:
-        cur.execute(sql, (file_path, check_date))
+        cur.execute(sql, params)
         return cur.fetchone() is not None
 
 def db_refresh_method_email_for_date(conn, file_path: str, check_date: date) -> bool:
     """
     Check if file was refreshed with method 'email' on a specific date.
     """
-    sql = """
-        SELECT 1
-        FROM events
-        WHERE LOWER(file_path) COLLATE utf8mb4_unicode_ci = LOWER(%s) COLLATE utf8mb4_unicode_ci
-          AND stage='Refresh' AND status='OK'
-          AND rundate = %s
-          AND LOWER(COALESCE(method,'')) = 'email'
-        LIMIT 1
-    """
+    if has_event_keys(conn):
+        sql = """
+            SELECT 1
+            FROM events
+            WHERE stage='Refresh' AND status='OK'
+              AND path_key = %s
+              AND rundate = %s
+              AND LOWER(COALESCE(method,'')) = 'email'
+            LIMIT 1
+        """
+        params = (path_key(file_path), check_date)
+    else:
+        sql = """
+            SELECT 1
+            FROM events
+            WHERE LOWER(file_path) COLLATE utf8mb4_unicode_ci = LOWER(%s) COLLATE utf8mb4_unicode_ci
+              AND stage='Refresh' AND status='OK'
+              AND rundate = %s
+              AND LOWER(COALESCE(method,'')) = 'email'
+            LIMIT 1
+        """
+        params = (file_path, check_date)
     with conn.cursor() as cur:
-        cur.execute(sql, (file_path, check_date))
+        cur.execute(sql, params)
         return cur.fetchone() is not None
 
+class RefreshStatus(NamedTuple):
+    latest_rundate: date | None
+    method_email_on_run_date: bool
+
+# Paths per IN (...) list when prefetching refresh status
+REFRESH_PREFETCH_CHUNK = 500
+
+def refresh_key(file_path: str) -> str:
+    return path_key(file_path)
+
+def db_prefetch_refresh_status(conn, file_paths, check_date: date) -> dict[str, RefreshStatus]:
+    """
+    Latest OK refresh (rundate + whether it was method 'email' on check_date) for
+    many files at once. Keyed by refresh_key(path); files never refreshed are absent.
+    """
+    use_keys = has_event_keys(conn)
+    if use_keys:
+        wanted = sorted({refresh_key(p) for p in file_paths})
+        match_col = "path_key"
+    else:
+        wanted = sorted({str(p).lower() for p in file_paths})
+        match_col = "LOWER(file_path) COLLATE utf8mb4_unicode_ci"
+    lookup: dict[str, RefreshStatus] = {}
+    for start in range(0, len(wanted), REFRESH_PREFETCH_CHUNK):
+        chunk = wanted[start:start + REFRESH_PREFETCH_CHUNK]
+        placeholders = ",".join(["%s"] * len(chunk))
+        group_col = "path_key" if use_keys else "LOWER(file_path)"
+        sql = f"""
+            SELECT {group_col} AS fp,
+                   MAX(rundate) AS latest_rundate,
+                   MAX(CASE WHEN rundate = %s AND LOWER(COALESCE(method,'')) = 'email' THEN 1 ELSE 0 END) AS method_email
+            FROM events
+            WHERE stage='Refresh' AND status='OK'
+              AND {match_col} IN ({placeholders})
+            GROUP BY {group_col}
+        """
+        with conn.cursor() as cur:
+            cur.execute(sql, (check_date, *chunk))
+            for fp, latest_rundate, method_email in cur.fetchall():
+                key = refresh_key(fp)
+                prev = lookup.get(key)
+                # Spellings that normalize to the same key fold into one entry
+                if prev is not None and prev.latest_rundate and latest_rundate and prev.latest_rundate > latest_rundate:
+                    latest_rundate = prev.latest_rundate
+                lookup[key] = RefreshStatus(latest_rundate, bool(method_email) or (prev is not None and prev.method_email_on_run_date))
+    return lookup
+
+def db_max_event_id(conn) -> int:
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM events")
+        return int(cur.fetchone()[0])
+
+# Events per round trip when tailing the events table
+REFRESH_TAIL_CHUNK = 1000
+
+def db_refresh_ok_since(conn, last_id: int, check_date: date) -> tuple[list[tuple[str, bool]], int]:
+    """
+    Refresh OK events for check_date with id > last_id, oldest first, as
+    (refresh_key, method_email) pairs, plus the highest id seen. Walks the
+    primary key, so each poll only reads rows written since the previous one.
+    """
+    path_col = "path_key" if has_event_keys(conn) else "file_path"
+    sql = f"""
+        SELECT id, {path_col}, LOWER(COALESCE(method,'')) = 'email'
+        FROM events
+        WHERE id > %s AND stage='Refresh' AND status='OK' AND rundate = %s
+        ORDER BY id
+        LIMIT %s
+    """
+    found = []
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(sql, (last_id, check_date, REFRESH_TAIL_CHUNK))
+            rows = cur.fetchall()
+        for event_id, fp, method_email in rows:
+            found.append((refresh_key(fp), bool(method_email)))
+            last_id = event_id
+        if len(rows) < REFRESH_TAIL_CHUNK:
+            return found, last_id
+
 def db_already_emailed_ok(conn, to_norm: str, subject: str, run_date: date, batch: str, file_path: str) -> bool:
     """
     Check if the same email (To+Subject) was already sent in the last X hours (fallback period).
     This prevents sending duplicate emails within the fallback window.
     """
-    #print(f'File path is :- {file_path}')
-    sql = """
-        SELECT 1
-        FROM events
-        WHERE stage='Email' AND status='OK'
-          AND rundate = %s
-          AND batch   = %s
-          AND LOWER(recipients_to) = LOWER(%s)
-          AND LOWER(subject)       = LOWER(%s)
-          AND LOWER(REPLACE(file_path, '\\\\', '/')) = LOWER(REPLACE(%s, '\\\\', '/'))
-        LIMIT 1
-    """
-    #print(f"SQL query :- {sql}")
+    if has_event_keys(conn):
+        sql = """
+            SELECT 1
+            FROM events
+            WHERE stage='Email' AND status='OK'
+              AND rundate = %s
+              AND batch   = %s
+              AND to_key      = %s
+              AND subject_key = %s
+              AND path_key    = %s
+            LIMIT 1
+        """
+        params = (str(run_date), batch, to_key(to_norm), subject_key(subject), path_key(file_path))
+    else:
+        sql = """
+            SELECT 1
+            FROM events
+            WHERE stage='Email' AND status='OK'
+              AND rundate = %s
+              AND batch   = %s
+              AND LOWER(recipients_to) = LOWER(%s)
+              AND LOWER(subject)       = LOWER(%s)
+              AND LOWER(REPLACE(file_path, '\\\\', '/')) = LOWER(REPLACE(%s, '\\\\', '/'))
+            LIMIT 1
+        """
+        params = (str(run_date), batch, to_norm, subject, file_path)
     with conn.cursor() as cur:
-        cur.execute(sql, (str(run_date), batch, to_norm, subject, file_path))
+        cur.execute(sql, params)
         return cur.fetchone() is not None
 
-def db_write_email_event(conn, run_id: str, batch: str, rundate: date,
-                         master_path: str, file_paths: list[Path],
-                         to_norm: str, subject: str,
-                         status: str, error_text: str = "", duration_s: int | None = None):
-    sql = """
-        INSERT INTO events
-        (run_id,batch,stage,timestamp_utc,rundate,master_path,file_path,method,status,error_text,duration_s,recipients_to,subject)
-        VALUES
-        (%s,%s,'Email',%s,%s,%s,%s,'Email',%s,%s,%s,%s,%s)
+def emailed_key(to_norm: str, subject: str, file_path: str) -> tuple[str, str, str]:
+    """
+    Normalized (recipients, subject, file path) key - the same keys the events table stores.
+    """
+    return (to_key(to_norm), subject_key(subject), path_key(file_path))
+
+class EmailedKeySet:
+    """
+    Keys of all OK Email events for one rundate + batch, loaded with a single query
+    so the duplicate check is a set lookup. refresh_s > 0 reloads it during long runs.
+    """
+
+    def __init__(self, run_date: date, batch: str, refresh_s: float = 0):
+        self.run_date = run_date
+        self.batch = batch
+        self.refresh_s = float(refresh_s or 0)
+        self.keys: set[tuple[str, str, str]] = set()
+        self.loaded_at = 0.0
+
+    def load(self, conn):
+        sql = """
+            SELECT recipients_to, subject, file_path
+            FROM events
+            WHERE stage='Email' AND status='OK'
+              AND rundate = %s
+              AND batch   = %s
+        """
+        with conn.cursor() as cur:
+            cur.execute(sql, (str(self.run_date), self.batch))
+            loaded = {emailed_key(to, subj, fp) for to, subj, fp in cur.fetchall()}
+        # Keep keys added locally since the last load (their events may not be visible yet)
+        self.keys |= loaded
+        self.loaded_at = time.monotonic()
+
+    def maybe_refresh(self):
+        if self.refresh_s <= 0 or time.monotonic() - self.loaded_at < self.refresh_s:
+            return
+        try:
+            with db_session() as conn:
+                self.load(conn)
+        except Exception as e:
+            # Keep the old set; try again after the next interval
+            self.loaded_at = time.monotonic()
+            write_log(f"WARNING: Could not refresh already-emailed keys: {e}")
+
+    def add(self, key):
+        self.keys.add(key)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+def apply_refresh_events(lookup: dict, events: list[tuple[str, bool]], run_date: date):
+    """Fold tailed Refresh OK events (db_refresh_ok_since) into a prefetched lookup."""
+    for key, method_email in events:
+        prev = lookup.get(key)
+        same_day = prev is not None and prev.latest_rundate == run_date
+        lookup[key] = RefreshStatus(run_date, method_email or (same_day and prev.method_email_on_run_date))
+
+class SharedRefreshStatus:
+    """
+    Refresh status prefetched once for the attachments of every batch in one
+    invocation. Each batch calls catch_up() before dispatch, which tails the
+    Refresh OK events written since (by id), so files refreshed while an
+    earlier batch was sending count as fresh.
+    """
+
+    def __init__(self, run_date: date):
+        self.run_date = run_date
+        self.lookup: dict | None = None
+        self.last_id = 0
+
+    def prefetch(self, file_paths):
+        with db_session() as conn:
+            # High-water mark first: refreshes landing during the prefetch are tailed, not lost
+            last_id = db_max_event_id(conn)
+            self.lookup = db_prefetch_refresh_status(conn, file_paths, self.run_date)
+            self.last_id = last_id
+
+    def catch_up(self) -> int:
+        """Apply new Refresh OK events to the shared lookup; returns how many there were."""
+        with db_session() as conn:
+            events, self.last_id = db_refresh_ok_since(conn, self.last_id, self.run_date)
+        apply_refresh_events(self.lookup, events, self.run_date)
+        return len(events)
+
+class RefreshFollower:
+    """
+    Follow mode: rows whose attachments are not refreshed for the run date yet are
+    held back, and the events table is tailed by id for new Refresh OK rows. A row
+    is released as soon as all its files are fresh; at the deadline every row
+    still waiting is released too and fails the normal refresh check.
+    lookup is the prefetched refresh status and is updated in place.
+    """
+
+    def __init__(self, lookup: dict, run_date: date, require_method_email: bool, last_id: int,
+                 poll_s: float, deadline_s: float):
+        self.lookup = lookup
+        self.run_date = run_date
+        self.require_method_email = require_method_email
+        self.last_id = last_id
+        self.poll_s = max(1.0, float(poll_s))
+        self.deadline = time.monotonic() + max(0.0, float(deadline_s))
+        self.ready: deque = deque()
+        self.waiting: dict[int, tuple] = {}
+        self._next_poll = time.monotonic() + self.poll_s
+        self.stats = {"held": 0, "polls": 0, "events": 0, "released": 0, "expired": 0}
+
+    def _fresh(self, key: str) -> bool:
+        rs = self.lookup.get(key)
+        return (rs is not None and rs.latest_rundate == self.run_date
+                and (rs.method_email_on_run_date or not self.require_method_email))
+
+    def add(self, row_data, atts):
+        keys = {refresh_key(str(p)) for p in atts}
+        if all(self._fresh(k) for k in keys):
+            self.ready.append(row_data)
+        else:
+            self.waiting[row_data[1]] = (row_data, keys)
+            self.stats["held"] += 1
+
+    def next_row(self):
+        return self.ready.popleft() if self.ready else None
+
+    def wait_s(self) -> float:
+        return max(0.05, min(self._next_poll, self.deadline) - time.monotonic())
+
+    def poll(self):
+        """Apply new Refresh OK events and release rows that became fresh (or all, at the deadline)."""
+        now = time.monotonic()
+        if not self.waiting or now < min(self._next_poll, self.deadline):
+            return
+        self._next_poll = now + self.poll_s
+        if now >= self.deadline:
+            write_log(f"Follow deadline reached: {len(self.waiting)} rows still not refreshed")
+            for idx in sorted(self.waiting):
+                self.ready.append(self.waiting[idx][0])
+            self.stats["expired"] += len(self.waiting)
+            self.waiting.clear()
+            return
+        self.stats["polls"] += 1
+        try:
+            with db_session() as conn:
+                events, self.last_id = db_refresh_ok_since(conn, self.last_id, self.run_date)
+        except Exception as e:
+            write_log(f"WARNING: Follow poll failed (retry in {self.poll_s:.0f}s): {e}")
+            return
+        if not events:
+            return
+        self.stats["events"] += len(events)
+        apply_refresh_events(self.lookup, events, self.run_date)
+        released = sorted(idx for idx, (_, keys) in self.waiting.items() if all(self._fresh(k) for k in keys))
+        for idx in released:
+            self.ready.append(self.waiting.pop(idx)[0])
+        self.stats["released"] += len(released)
+        write_log(f"Follow: {len(events)} new refresh events, {len(released)} rows released, {len(self.waiting)} waiting")
+
+def make_email_event(run_id: str, batch: str, rundate: date,
+                     master_path: str, file_paths: list[Path],
+                     to_norm: str, subject: str,
+                     status: str, error_text: str = "", duration_s: int | None = None,
+                     method: str = "Email", sender: str = "") -> dict:
+    """
+    Build one Email event row (plain, JSON-safe dict) stamped with the current UTC time.
+    Written to the DB later by EmailEventWriter.
     """
     # store UTC in DB
     ts_utc = datetime.now(timezone.utc).replace(tzinfo=None)
     fp = ";".join(str(p) for p in file_paths) if file_paths else ""
+    return {
+        "run_id": run_id,
+        "batch": batch,
+        "timestamp_utc": ts_utc.strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "rundate": str(rundate),
+        "master_path": master_path,
+        "file_path": fp,
+        "method": method,
+        "status": status,
+        "error_text": error_text or "",
+        "duration_s": duration_s,
+        "recipients_to": to_norm,
+        "subject": subject,
+        "sender": sender or "",
+    }
+
+EMAIL_EVENT_COLUMNS = ["run_id", "batch", "timestamp_utc", "rundate", "master_path", "file_path",
+                       "method", "status", "error_text", "duration_s", "recipients_to", "subject"]
+
+def db_insert_email_events(conn, events: list[dict]):
+    """
+    Insert many Email events in one transaction (PyMySQL turns executemany into a multi-row INSERT).
+    """
+    if not events:
+        return
+    with_sender = has_event_sender(conn)
+    if not with_sender and len(sender_account_specs()) > 1:
+        # No sender column yet: keep the account in error_text (only worth it with several accounts)
+        events = [
+            dict(ev, error_text=f"{ev['error_text']}; via {ev['sender']}" if ev["error_text"] else f"via {ev['sender']}")
+            if ev.get("sender") else ev
+            for ev in events
+        ]
+    rows = [tuple(ev.get(c) for c in EMAIL_EVENT_COLUMNS) for ev in events]
+    if has_event_keys(conn):
+        sql = """
+            INSERT INTO events
+            (run_id,batch,stage,timestamp_utc,rundate,master_path,file_path,method,status,error_text,duration_s,recipients_to,subject,path_key,to_key,subject_key{sender_col})
+            VALUES
+            (%s,%s,'Email',%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s{sender_val})
+        """
+        rows = [
+            row + (path_key(ev["file_path"]), to_key(ev["recipients_to"]), subject_key(ev["subject"]))
+            for row, ev in zip(rows, events)
+        ]
+    else:
+        sql = """
+            INSERT INTO events
+            (run_id,batch,stage,timestamp_utc,rundate,master_path,file_path,method,status,error_text,duration_s,recipients_to,subject{sender_col})
+            VALUES
+            (%s,%s,'Email',%s,%s,%s,%s,%s,%s,%s,%s,%s,%s{sender_val})
+        """
+    if with_sender:
+        sql = sql.format(sender_col=",sender", sender_val=",%s")
+        rows = [row + (ev.get("sender") or None,) for row, ev in zip(rows, events)]
+    else:
+        sql = sql.format(sender_col="", sender_val="")
+    conn.begin()
+    try:
+        with conn.cursor() as cur:
+            cur.executemany(sql, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def _lock_file(fh) -> bool:
+    """Non-blocking exclusive lock on an open file; released by the OS when the process dies."""
+    try:
+        fh.seek(0)
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+def _unlock_file(fh):
+    try:
+        fh.seek(0)
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    except OSError:
+        pass
+
+def db_unwritten_email_events(conn, events: list[dict]) -> list[dict]:
+    """
+    The journaled events that are not in the events table yet. A writer that died
+    between its INSERT and the ack line, or a replay that died before removing the
+    journal, leaves events that were already written. They match on run, status,
+    recipients, subject and files, with a timestamp within a second (DATETIME may round).
+    """
+    if not events:
+        return []
+    stamps = [datetime.strptime(ev["timestamp_utc"], "%Y-%m-%d %H:%M:%S.%f") for ev in events]
+    run_ids = sorted({ev["run_id"] for ev in events})
+    sql = f"""
+        SELECT run_id, status, recipients_to, subject, file_path, timestamp_utc
+        FROM events
+        WHERE stage='Email' AND run_id IN ({",".join(["%s"] * len(run_ids))})
+          AND timestamp_utc BETWEEN %s AND %s
+    """
+    written: dict[tuple, list] = {}
     with conn.cursor() as cur:
-        cur.execute(sql, (
-            run_id, batch, ts_utc, rundate,
-            master_path, fp, status, error_text or "",
-            duration_s if duration_s is not None else None,
-            to_norm, subject
-        ))
+        cur.execute(sql, (*run_ids, min(stamps) - timedelta(seconds=1), max(stamps) + timedelta(seconds=1)))
+        for run_id, status, to, subject, fp, ts in cur.fetchall():
+            written.setdefault((run_id, status, to or "", subject or "", fp or ""), []).append(ts)
+    unwritten = []
+    for ev, ts in zip(events, stamps):
+        seen = written.get((ev["run_id"], ev["status"], ev["recipients_to"] or "", ev["subject"] or "", ev["file_path"] or ""), [])
+        match = next((t for t in seen if abs((t - ts).total_seconds()) <= 1), None)
+        if match is None:
+            unwritten.append(ev)
+        else:
+            seen.remove(match)  # one written row accounts for one journaled event
+    return unwritten
+
+def _read_journal(fh) -> list[dict]:
+    """Events of an open journal file that were never acknowledged as written to the DB."""
+    events: dict[int, dict] = {}
+    acked = 0
+    fh.seek(0)
+    for line in fh.read().splitlines():
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue  # blank or torn last line after a crash
+        if "ack" in rec:
+            acked = max(acked, int(rec["ack"]))
+        elif "seq" in rec:
+            events[int(rec["seq"])] = rec["event"]
+    return [ev for seq, ev in sorted(events.items()) if seq > acked]
+
+class EmailEventWriter:
+    """
+    Write-behind buffer for Email events.
+
+    Every event is appended (and fsync'ed) to a local journal before it is buffered,
+    so a crash or DB outage loses nothing. Buffered events go to the DB in one
+    multi-row INSERT when flush_size events are waiting or flush_interval_s passed.
+    After a successful flush an ack line is journaled; a journal left behind by a
+    dead process is replayed by replay_journals() on the next start.
+    """
+
+    def __init__(self, journal_dir: Path, run_id: str, flush_size: int = 50, flush_interval_s: float = 5.0):
+        self.flush_size = max(1, int(flush_size))
+        self.flush_interval_s = float(flush_interval_s)
+        journal_dir.mkdir(parents=True, exist_ok=True)
+        self.journal_path = journal_dir / f"email-events_{run_id}_{os.getpid()}_{int(time.time())}.jsonl"
+        self._journal = open(self.journal_path, "a+", encoding="utf-8")
+        _lock_file(self._journal)
+        self._journal.seek(0, os.SEEK_END)
+        self._buffer: list[tuple[int, dict]] = []
+        self._seq = 0
+        self._oldest = None
+        self._retry_at = 0.0
+        self._last_error = ""
+        self.stats = {"events": 0, "flushes": 0, "flush_failures": 0}
+
+    def _journal_line(self, rec: dict):
+        self._journal.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def add(self, event: dict):
+        self._seq += 1
+        self._journal_line({"seq": self._seq, "event": event})
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.append((self._seq, event))
+        self.stats["events"] += 1
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if not self._buffer or time.monotonic() < self._retry_at:
+            return
+        if len(self._buffer) >= self.flush_size or time.monotonic() - self._oldest >= self.flush_interval_s:
+            self.flush()
+
+    def flush(self) -> bool:
+        if not self._buffer:
+            return True
+        batch = self._buffer
+        try:
+            with db_session() as conn:
+                db_insert_email_events(conn, [ev for _, ev in batch])
+        except Exception as e:
+            self.stats["flush_failures"] += 1
+            # Back off for one interval; events stay in the journal meanwhile
+            self._retry_at = time.monotonic() + self.flush_interval_s
+            if str(e) != self._last_error:
+                self._last_error = str(e)
+                write_log(f"WARNING: Email event flush failed ({len(batch)} buffered, journaled): {e}")
+            return False
+        self._buffer = []
+        self._last_error = ""
+        self.stats["flushes"] += 1
+        self._journal_line({"ack": batch[-1][0]})
+        return True
+
+    def close(self) -> bool:
+        """Final flush. The journal is removed only when every event reached the DB."""
+        ok = self.flush()
+        _unlock_file(self._journal)
+        self._journal.close()
+        if ok:
+            try:
+                self.journal_path.unlink()
+            except OSError:
+                pass
+        else:
+            write_log(f"WARNING: {len(self._buffer)} Email events not written; kept in {self.journal_path} for replay")
+        return ok
+
+def replay_journals(journal_dir: Path) -> int:
+    """
+    Write events from journals of dead writers to the DB, except those already
+    there (db_unwritten_email_events). A journal whose lock is still held belongs
+    to a running sender and is left alone.
+    """
+    replayed = 0
+    if not journal_dir.is_dir():
+        return 0
+    for path in sorted(journal_dir.glob("email-events_*.jsonl")):
+        try:
+            fh = open(path, "a+", encoding="utf-8")
+        except OSError:
+            continue
+        try:
+            if not _lock_file(fh):
+                continue
+            events = _read_journal(fh)
+            if events:
+                with db_session() as conn:
+                    events = db_unwritten_email_events(conn, events)
+                    db_insert_email_events(conn, events)
+                replayed += len(events)
+            _unlock_file(fh)
+            fh.close()
+            path.unlink()
+        except Exception as e:
+            write_log(f"WARNING: Journal replay failed for {path.name}: {e}")
+        finally:
+            if not fh.closed:
+                _unlock_file(fh)
+                fh.close()
+    return replayed
+
+def db_emails_sent_by_hour(conn, sender: str | None = None, unattributed: bool = True) -> dict[int, int]:
+    """
+    OK Email events of the last 24 hours per hours-ago (0..23); seeds the rolling daily
+    send budget. With `sender` (schema 3) only that account's events, plus events
+    without a sender when `unattributed`; before schema 3 every event is unattributed.
+    """
+    sql = """
+        SELECT TIMESTAMPDIFF(HOUR, timestamp_utc, UTC_TIMESTAMP()) AS ago, COUNT(*)
+        FROM events
+        WHERE stage='Email' AND status='OK'
+          AND timestamp_utc >= UTC_TIMESTAMP() - INTERVAL 24 HOUR
+    """
+    params = ()
+    if sender is not None:
+        if not has_event_sender(conn):
+            if not unattributed:
+                return {}
+        elif unattributed:
+            sql += " AND (sender = %s OR sender IS NULL)"
+            params = (sender,)
+        else:
+            sql += " AND sender = %s"
+            params = (sender,)
+    sql += " GROUP BY ago"
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return {int(ago): int(n) for ago, n in cur.fetchall() if ago is not None}
 
 def export_email_csv(conn, run_id: str, out_csv_path: Path):
     sql = """
@@ -323,202 +2207,1267 @@ def export_email_csv(conn, run_id: str, out_csv_path: Path):
             rec = dict(zip(cols, r))
             w.writerow([rec.get(c,"") for c in ["Timestamp","RunDate","Batch","Stage","Master","FilePath","Method","Status","Error","DurationS","RecipientsTo","Subject"]])
 
+# --------------------------- Outbox (retry / resume) ----------------
+
+# "try again in 30 seconds", "retry after 2 minutes"
+_RETRY_AFTER_RE = re.compile(r"(?:again|after)\s+(?:in\s+)?(\d+)\s*(s|sec|secs|seconds?|m|min|mins|minutes?)\b", re.I)
+
+def _retry_after_hint(text: str) -> float:
+    m = _RETRY_AFTER_RE.search(text or "")
+    if not m:
+        return 0.0
+    return float(m.group(1)) * (60 if m.group(2).lower().startswith("m") else 1)
+
+def classify_send_error(exc: BaseException) -> float | None:
+    """
+    None for a permanent failure (5xx, bad address, auth rejected, and any other
+    error such as an unreadable attachment); otherwise the retry-after hint in
+    seconds (0 = none) for a transient one: 4xx replies, dropped or refused
+    connections, timeouts, resets, DNS lookup failures.
+    """
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+        if codes and all(400 <= code < 500 for code in codes):
+            return max(_retry_after_hint(str(err)) for _, err in exc.recipients.values())
+        return None
+    if isinstance(exc, smtplib.SMTPResponseException):
+        if 400 <= exc.smtp_code < 500:
+            text = exc.smtp_error.decode("utf-8", "replace") if isinstance(exc.smtp_error, bytes) else str(exc.smtp_error)
+            return _retry_after_hint(text)
+        return None
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, TimeoutError, ConnectionError, socket.gaierror)):
+        return 0.0
+    return None
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """A 4xx reply from the server (421 / 450 / 451 / 452 / 454 ...): it wants us to slow down."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return any(400 <= code < 500 for code, _ in exc.recipients.values())
+    return isinstance(exc, smtplib.SMTPResponseException) and 400 <= exc.smtp_code < 500
+
+def retry_delay(attempt: int, hint_s: float, base_s: float, max_s: float) -> float:
+    """Exponential backoff with jitter (50-100% of the step); never shorter than the server's hint."""
+    step = min(float(max_s), float(base_s) * 2 ** max(0, attempt - 1))
+    return max(random.uniform(step / 2, step), float(hint_s or 0))
+
+class OutboxEntry(NamedTuple):
+    status: str
+    attempts: int
+    next_at: float | None
+
+class Outbox:
+    """
+    Local SQLite record of every row of a run, keyed by (run_id, row key):
+    PENDING when dispatched, RETRY (attempts, next_at) after a transient send
+    failure, OK / FAIL / SKIP when final. Survives a crash, so a rerun of the
+    same run_id skips rows already sent and keeps the retry count of the rest.
+    """
+
+    def __init__(self, path: Path, keep_days: int = 7):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                run_id     TEXT    NOT NULL,
+                row_key    TEXT    NOT NULL,
+                row_index  INTEGER NOT NULL,
+                status     TEXT    NOT NULL,
+                attempts   INTEGER NOT NULL DEFAULT 0,
+                next_at    REAL,
+                last_error TEXT,
+                updated_at REAL    NOT NULL,
+                PRIMARY KEY (run_id, row_key)
+            )
+        """)
+        self.conn.execute("DELETE FROM outbox WHERE updated_at < ?", (time.time() - keep_days * 86400,))
+
+    def load(self, run_id: str) -> dict[str, OutboxEntry]:
+        cur = self.conn.execute("SELECT row_key, status, attempts, next_at FROM outbox WHERE run_id = ?", (run_id,))
+        return {key: OutboxEntry(status, attempts, next_at) for key, status, attempts, next_at in cur}
+
+    def mark(self, run_id: str, key: str, index: int, status: str, attempts: int,
+             next_at: float | None = None, error: str | None = None):
+        self.conn.execute("""
+            INSERT INTO outbox (run_id, row_key, row_index, status, attempts, next_at, last_error, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (run_id, row_key) DO UPDATE SET
+                row_index=excluded.row_index, status=excluded.status, attempts=excluded.attempts,
+                next_at=excluded.next_at, last_error=COALESCE(excluded.last_error, last_error),
+                updated_at=excluded.updated_at
+        """, (run_id, key, index, status, attempts, next_at, error, time.time()))
+
+    def close(self):
+        self.conn.close()
+
+def outbox_key(key: tuple) -> str:
+    """Stable row identity (emailed_key of the row) that survives reordering of the Email_List."""
+    return hashlib.sha1("\x1f".join(key).encode("utf-8")).hexdigest()
+
+# --------------------------- Adaptive concurrency -------------------
+
+class ConcurrencyController:
+    """
+    AIMD limit on rows in flight. Each real send reports its SMTP latency and
+    whether the server throttled it:
+    - additive increase: +1 after `limit` clean sends in a row
+    - multiplicative decrease: halve on a throttle reply
+    - -1 when the latency EWMA exceeds latency_factor x the best EWMA seen
+    After a cut, further cuts of the same kind wait for a cool-down (sends that
+    were already in flight report the old load).
+    """
+
+    def __init__(self, lo: int, hi: int, latency_factor: float = 2.0):
+        self.lo = max(1, int(lo))
+        self.hi = max(self.lo, int(hi))
+        self.latency_factor = float(latency_factor)
+        self.limit = self.lo
+        self._clean = 0
+        self._ewma: float | None = None
+        self._baseline: float | None = None
+        self._cooldown_until = 0.0
+        self._throttle_cooldown_until = 0.0
+        self._t0 = time.monotonic()
+        self.timeline: list[tuple[float, int]] = [(0.0, self.limit)]
+        self.stats = {"increases": 0, "throttle_cuts": 0, "latency_cuts": 0}
+
+    def _set(self, limit: int, reason: str):
+        limit = min(self.hi, max(self.lo, limit))
+        if limit == self.limit:
+            return
+        write_log(f"Concurrency {self.limit} -> {limit} ({reason})")
+        self.limit = limit
+        self._clean = 0
+        self.timeline.append((time.monotonic() - self._t0, limit))
+
+    def record(self, latency_s: float | None, throttled: bool):
+        """One result; latency_s is None when the row did not reach SMTP."""
+        now = time.monotonic()
+        if throttled:
+            if now >= self._throttle_cooldown_until:
+                self.stats["throttle_cuts"] += 1
+                self._set(self.limit // 2, "throttled by server")
+                self._throttle_cooldown_until = self._cooldown_until = now + max(1.0, 2 * (self._ewma or 1.0))
+            return
+        if latency_s is None:
+            return
+        self._ewma = latency_s if self._ewma is None else 0.8 * self._ewma + 0.2 * latency_s
+        # Best sustained latency seen; it is the reference for "the server keeps up"
+        self._baseline = self._ewma if self._baseline is None else min(self._baseline, self._ewma)
+        if self._ewma > self.latency_factor * self._baseline:
+            if now >= self._cooldown_until and self.limit > self.lo:
+                self.stats["latency_cuts"] += 1
+                self._set(self.limit - 1, f"latency {self._ewma * 1000:.0f}ms vs baseline {self._baseline * 1000:.0f}ms")
+                self._cooldown_until = now + max(1.0, 2 * self._ewma)
+            return
+        self._clean += 1
+        if self._clean >= self.limit and self.limit < self.hi:
+            self.stats["increases"] += 1
+            self._set(self.limit + 1, f"{self._clean} clean sends, latency {self._ewma * 1000:.0f}ms")
+
+    def describe(self) -> str:
+        steps = " ".join(f"{t:.0f}s:{n}" for t, n in self.timeline[-20:])
+        return f"final={self.limit} bounds={self.lo}..{self.hi} {format_stats(self.stats)} timeline=[{steps}]"
+
+# --------------------------- Pre-flight -----------------------------
+
+class Preflight(NamedTuple):
+    rows: list          # (row dict, index) for the workers, addresses normalized
+    atts: dict          # index -> attachment paths, clean rows only
+    rejected: list      # (index, status, error, to_norm, subject, atts): FAIL / duplicate SKIP
+
+def preflight_email_list(columns, rows, dedupe: bool = True) -> Preflight:
+    """
+    Validate and normalize the whole List before dispatch, one column at a time:
+    addresses split and cleaned, attachment cells exploded into paths, greeting
+    chosen, and rows repeating an earlier row's (recipients, subject, attachments)
+    found. Rejected rows never reach a worker.
+    """
+    def column(name):
+        i = columns.index(name) if name in columns else None
+        return ["" if i is None or _is_blank(v[i]) else str(v[i]).strip() for v in rows]
+
+    to_lists, cc_lists, bcc_lists = ([clean_addr_list(v) for v in column(c)] for c in ("Receiver", "CC", "BCC"))
+    to_norm = [", ".join(good) for good, _ in to_lists]
+    subjects = column("Subject")
+    atts = [split_attachments(v) for v in column("Attachement Path")]
+    greetings = ["Dear Sir" if len(good) == 1 else "Dear Team" for good, _ in to_lists]
+    invalid = [to[1] + cc[1] + bcc[1] for to, cc, bcc in zip(to_lists, cc_lists, bcc_lists)]
+
+    clean, clean_atts, rejected = [], {}, []
+    first_seen: dict[tuple, int] = {}
+    for idx, values in enumerate(rows):
+        if not to_norm[idx] and not invalid[idx]:
+            rejected.append((idx, "FAIL", "Missing Receiver", "", subjects[idx], atts[idx]))
+            continue
+        if invalid[idx]:
+            rejected.append((idx, "FAIL", f"Invalid address: {', '.join(invalid[idx])}", to_norm[idx], subjects[idx], atts[idx]))
+            continue
+        if not subjects[idx]:
+            rejected.append((idx, "FAIL", "Missing Subject", to_norm[idx], "", atts[idx]))
+            continue
+        if dedupe:
+            key = emailed_key(to_norm[idx], subjects[idx], ";".join(str(p) for p in atts[idx]))
+            if key in first_seen:
+                rejected.append((idx, "SKIP", f"Duplicate of row {first_seen[key] + 1} in the list", to_norm[idx], subjects[idx], atts[idx]))
+                continue
+            first_seen[key] = idx
+        row = row_from_values(columns, values)
+        row["Receiver"] = to_norm[idx]
+        row["CC"] = ", ".join(cc_lists[idx][0])
+        row["BCC"] = ", ".join(bcc_lists[idx][0])
+        row["_greeting"] = greetings[idx]
+        clean.append((row, idx))
+        clean_atts[idx] = atts[idx]
+    return Preflight(clean, clean_atts, rejected)
+
+# --------------------------- Content dedupe -------------------------
+
+CONTENT_DEDUPE_MODES = ("off", "skip", "notice")
+CONTENT_HASH_CHUNK = 1024 * 1024
+
+NOCHANGE_LINE = "Today's report has not changed since it was last sent to you on {LAST_SENT}, so it is not attached again."
+
+class ContentHashStore:
+    """
+    Local SQLite (STATE_DIR/content_hashes.sqlite) behind content dedupe: the
+    sha256 of each file, reused while its path + size + mtime match (a file is
+    only read again after it changed), and the attachment-set hash last
+    delivered per recipients + subject. One connection per process; WAL lets
+    worker processes share the file.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path     TEXT    NOT NULL PRIMARY KEY,
+                size     INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256   TEXT    NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS deliveries (
+                to_key      TEXT NOT NULL,
+                subject_key TEXT NOT NULL,
+                set_hash    TEXT NOT NULL,
+                sent_at     REAL NOT NULL,
+                PRIMARY KEY (to_key, subject_key)
+            )
+        """)
+        self.stats = {"hashed": 0, "hash_hits": 0, "bytes_hashed": 0, "unchanged": 0}
+
+    def file_hash(self, path: Path, st: FileStat | None = None) -> str:
+        st = st or stat_file(path)
+        if st is None:
+            raise FileNotFoundError(f"Missing file: {path}")
+        key = path_key(path)
+        with self._lock:
+            row = self.conn.execute("SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?", (key,)).fetchone()
+        if row is not None and (row[0], row[1]) == (st.size, st.mtime_ns):
+            with self._lock:
+                self.stats["hash_hits"] += 1
+            return row[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(CONTENT_HASH_CHUNK), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                              (key, st.size, st.mtime_ns, digest))
+            self.stats["hashed"] += 1
+            self.stats["bytes_hashed"] += st.size
+        return digest
+
+    def set_hash(self, atts: list[Path], file_stats: dict | None = None) -> str:
+        """Hash of an attachment set: file names + contents, order-insensitive."""
+        file_stats = file_stats or {}
+        parts = sorted(f"{p.name.lower()}:{self.file_hash(p, file_stats.get(str(p)))}" for p in atts)
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def last_delivery(self, to_norm: str, subject: str, set_hash: str, window_s: float) -> float | None:
+        """When this exact set last went to these recipients under this subject, if within the window."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT sent_at FROM deliveries WHERE to_key = ? AND subject_key = ? AND set_hash = ? AND sent_at >= ?",
+                (to_key(to_norm), subject_key(subject), set_hash, time.time() - window_s),
+            ).fetchone()
+            if row is not None:
+                self.stats["unchanged"] += 1
+        return row[0] if row else None
+
+    def record_delivery(self, to_norm: str, subject: str, set_hash: str):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO deliveries (to_key, subject_key, set_hash, sent_at) VALUES (?, ?, ?, ?)",
+                (to_key(to_norm), subject_key(subject), set_hash, time.time()),
+            )
+
+
+_CONTENT_STORE: ContentHashStore | None = None
+
+def get_content_store(config) -> ContentHashStore:
+    global _CONTENT_STORE
+    with _SINGLETON_LOCK:
+        if _CONTENT_STORE is None:
+            _CONTENT_STORE = ContentHashStore(Path(config["STATE_DIR"]) / "content_hashes.sqlite")
+        return _CONTENT_STORE
+
+# --------------------------- Coalescing -----------------------------
+
+COALESCE_SUBJECT_MAX = 150
+
+def coalesce_key(row) -> str:
+    """Rows with the same key can share a message: same To / CC / BCC and attach mode."""
+    return "\x1f".join([to_key(cell_str(row, "Receiver")), to_key(cell_str(row, "CC")),
+                         to_key(cell_str(row, "BCC")), cell_str(row, "Attach Mode").lower()])
+
+def merged_subject(subjects: list[str]) -> str:
+    subjects = list(dict.fromkeys(subjects))
+    joined = "; ".join(subjects)
+    if len(subjects) == 1 or len(joined) <= COALESCE_SUBJECT_MAX:
+        return joined
+    return f"{subjects[0]} (+{len(subjects) - 1} more reports)"
+
+class RowCoalescer:
+    """
+    Coalescing mode: rows that are ready together and share a coalesce_key go out
+    as one message, in list order, up to max_rows rows and max_bytes of attachments
+    (raw size on disk); the key's remaining rows form its next message. next_row
+    supplies ready rows (the list, or rows released by follow mode).
+    """
+
+    def __init__(self, next_row, size, max_rows: int, max_bytes: int):
+        self._next_row = next_row
+        self._size = size
+        self.max_rows = max(1, int(max_rows))
+        self.max_bytes = int(max_bytes)
+        self._ready: deque = deque()
+        self._by_key: dict[str, deque] = {}
+        self._taken: set[int] = set()
+        self.stats = {"rows": 0, "messages": 0, "merged_rows": 0}
+
+    def next_group(self) -> list | None:
+        while True:
+            row_data = self._next_row()
+            if row_data is None:
+                break
+            self._ready.append(row_data)
+            self._by_key.setdefault(coalesce_key(row_data[0]), deque()).append(row_data)
+        # Rows already sent along with an earlier row of their key
+        while self._ready and self._ready[0][1] in self._taken:
+            self._taken.discard(self._ready.popleft()[1])
+        if not self._ready:
+            return None
+        first = self._ready.popleft()
+        key = coalesce_key(first[0])
+        same = self._by_key[key]
+        same.popleft()
+        group, size = [first], self._size(first)
+        while same and len(group) < self.max_rows and size + self._size(same[0]) <= self.max_bytes:
+            row_data = same.popleft()
+            self._taken.add(row_data[1])
+            group.append(row_data)
+            size += self._size(row_data)
+        if not same:
+            del self._by_key[key]
+        self.stats["rows"] += len(group)
+        self.stats["messages"] += 1
+        if len(group) > 1:
+            self.stats["merged_rows"] += len(group)
+        return group
+
 # --------------------------- Parallel Processing Functions ----------
 
-def process_single_email(row_data, config, email_run_id, batch, email_run_date, master_path, require_method_email, dry_run, fallback_hours, force_resend):
+def process_single_email(row_data, config, email_run_id, batch, email_run_date, master_path, require_method_email, dry_run, fallback_hours, force_resend, refresh_status=None, already_emailed=None, file_stats=None, staged=False):
+    """
+    Process a single email row - this function runs in parallel.
+    refresh_status: prefetched RefreshStatus per attachment of this row (None = query DB per file)
+    already_emailed: result of the EmailedKeySet lookup done by main (None = query DB)
+    file_stats: FileStat (None = missing) per attachment from main's StatCache (None = stat here)
+    staged: return a StagedEmail once the message is built; its deliver() sends it (pipeline engine)
+    """
+    prepared = stage_email([row_data], config, email_run_id, batch, email_run_date, master_path, require_method_email, dry_run, force_resend,
+                        refresh_status, None if already_emailed is None else [already_emailed], file_stats, group=False)
+    return prepared if staged else prepared.deliver()
+
+def process_email_group(rows_data, config, email_run_id, batch, email_run_date, master_path, require_method_email, dry_run, fallback_hours, force_resend, refresh_status=None, already_emailed=None, file_stats=None, staged=False):
     """
-    Process a single email row - this function runs in parallel
+    Coalescing mode: rows to the same recipients, sent as one message.
+    Same arguments as process_single_email, except already_emailed is one flag per row
+    and refresh_status / file_stats cover every row's attachments.
+    Returns {'members': one result per row, ...}.
     """
-    time.sleep(2)
+    prepared = stage_email(rows_data, config, email_run_id, batch, email_run_date, master_path, require_method_email, dry_run, force_resend,
+                        refresh_status, already_emailed, file_stats, group=True)
+    return prepared if staged else prepared.deliver()
+
+class RowFields(NamedTuple):
+    index: int
+    to_addrs: str
+    cc_addrs: str
+    bcc_addrs: str
+    subject: str
+    atts: list
+    greeting: str
+    attach_mode: str
+    resume: bool = False        # in flight when a previous run of this batch stopped (outbox)
+
+def stage_email(rows_data, config, email_run_id, batch, email_run_date, master_path, require_method_email, dry_run, force_resend, refresh_status, already_emailed, file_stats, group: bool) -> StagedEmail:
+    """First half of a send: check every row and build their message (file reads, MIME / base64)."""
+    results = []
+    ready = []
+    for n, row_data in enumerate(rows_data):
+        try:
+            checked = _check_row(row_data, config, email_run_id, batch, email_run_date, master_path, require_method_email, force_resend,
+                                 refresh_status, None if already_emailed is None else already_emailed[n], file_stats)
+        except Exception as e:
+            # e.g. DB unreachable for a fallback query: this row only
+            results.append(_unchecked_fail(row_data[1], e))
+            continue
+        if isinstance(checked, dict):
+            results.append(checked)
+        else:
+            ready.append(checked)
+    message = None
+    if ready:
+        message = OutgoingMessage(ready, config, email_run_id, batch, email_run_date, master_path, dry_run, force_resend, file_stats)
+        try:
+            message.build()
+        except Exception as e:
+            return StagedEmail(rows_data, group, results + message.results, error=e)
+    return StagedEmail(rows_data, group, results, message)
+
+class StagedEmail:
+    """
+    Rows that are checked, with their message built (None when no row is left to
+    send). deliver() is the second half - claims and SMTP - and returns the
+    process_single_email / process_email_group result.
+    """
+
+    def __init__(self, rows_data, group: bool, results=None, message=None, error=None):
+        self.rows_data = rows_data
+        self.group = group
+        self.results = results or []
+        self.message = message
+        self.error = error
+
+    def deliver(self) -> dict:
+        results = list(self.results)
+        error = self.error
+        if error is None and self.message is not None:
+            try:
+                self.message.send()
+            except Exception as e:
+                error = e
+            results += self.message.results
+        if error is not None:
+            resolved = {r['index'] for r in results}
+            results += [_unchecked_fail(index, error) for _, index in self.rows_data if index not in resolved]
+        if self.group:
+            return {'members': sorted(results, key=lambda r: r['index']), 'worker': os.getpid(), 'stats': worker_stats()}
+        result = results[0]
+        result['worker'] = os.getpid()
+        result['stats'] = worker_stats()
+        return result
+
+def _unchecked_fail(index: int, error: Exception) -> dict:
+    """FAIL result of a row that raised before it could be checked; no event, same as a failed DB connect before."""
+    return {
+        'index': index,
+        'status': 'FAIL',
+        'error': f"{type(error).__name__}: {error}",
+        'to_norm': "",
+        'subject': "",
+        'atts': []
+    }
+
+def _check_row(row_data, config, email_run_id, batch, email_run_date, master_path, require_method_email, force_resend, refresh_status, already_emailed, file_stats):
+    """Field, refresh and already-emailed checks: RowFields when the row may be sent, else its final result."""
     row, index = row_data
     
-    # Create a new DB connection for this process
-    try:
-        conn = db_connect()
-    except Exception as e:
+    to_addrs = normalize_addr_list(cell_str(row, "Receiver"))
+    cc_addrs = normalize_addr_list(cell_str(row, "CC"))
+    bcc_addrs = normalize_addr_list(cell_str(row, "BCC"))
+    subject = cell_str(row, "Subject")
+    atts = split_attachments(cell_str(row, "Attachement Path"))
+
+    # Pre-flight already picked the greeting
+    greeting = row.get("_greeting") or get_greeting(to_addrs)
+
+    # Validate fields
+    if not to_addrs:
+        event = make_email_event(email_run_id, batch, email_run_date, master_path, atts, "", subject, "FAIL", "Missing Receiver")
         return {
             'index': index,
+            'event': event,
             'status': 'FAIL',
-            'error': f"DB connection failed: {e}",
+            'error': "Missing Receiver",
             'to_norm': "",
+            'subject': subject,
+            'atts': atts
+        }
+
+    if not subject:
+        event = make_email_event(email_run_id, batch, email_run_date, master_path, atts, to_addrs, "", "FAIL", "Missing Subject")
+        return {
+            'index': index,
+            'event': event,
+            'status': 'FAIL',
+            'error': "Missing Subject",
+            'to_norm': to_addrs,
             'subject': "",
-            'atts': []
+            'atts': atts
         }
-    
-    try:
-        to_addrs = normalize_addr_list(cell_str(row, "Receiver"))
-        cc_addrs = normalize_addr_list(cell_str(row, "CC"))
-        bcc_addrs = normalize_addr_list(cell_str(row, "BCC"))
-        subject = cell_str(row, "Subject")
-        atts = split_attachments(cell_str(row, "Attachement Path"))
-
-        # Build body
-        greeting = get_greeting(to_addrs)
-        body_text = DEFAULT_BODY.replace("{GREETING}", greeting)
-
-        # Validate fields
-        if not to_addrs:
-            db_write_email_event(conn, email_run_id, batch, email_run_date, master_path, atts, "", subject, "FAIL", "Missing Receiver")
-            return {
-                'index': index,
-                'status': 'FAIL',
-                'error': "Missing Receiver",
-                'to_norm': "",
-                'subject': subject,
-                'atts': atts
-            }
 
-        if not subject:
-            db_write_email_event(conn, email_run_id, batch, email_run_date, master_path, atts, to_addrs, "", "FAIL", "Missing Subject")
+    # Skip all validations if force resend is enabled
+    if not force_resend:
+        # FIRST: Check if files are refreshed (this should take priority)
+        problems = []
+        for p in atts:
+            exists = file_stats[str(p)] is not None if file_stats is not None else p.exists()
+            if not exists:
+                problems.append(f"Missing file: {p}")
+                continue
+            
+            fp_str = str(p)
+            
+            # Get the latest refresh date for this file (prefetched, or from DB)
+            if refresh_status is not None:
+                rs = refresh_status.get(refresh_key(fp_str))
+                latest_refresh_date = rs.latest_rundate if rs else None
+            else:
+                rs = None
+                with db_session() as conn:
+                    latest_refresh_date = db_get_latest_refresh_date(conn, fp_str)
+            
+            if not latest_refresh_date:
+                problems.append(f"No successful refresh found in database: {p}")
+                continue
+            
+            # Check if the latest refresh is for today's email run date
+            if latest_refresh_date != email_run_date:
+                problems.append(f"File not refreshed for today ({email_run_date}). Last refresh: {latest_refresh_date}: {p}")
+                continue
+            
+            # If we require method email, check that too
+            if require_method_email:
+                if rs is not None:
+                    method_ok = rs.method_email_on_run_date
+                else:
+                    with db_session() as conn:
+                        method_ok = db_refresh_method_email_for_date(conn, fp_str, email_run_date)
+                if not method_ok:
+                    problems.append(f"Method not 'Email' for today: {p}")
+
+        if problems:
+            event = make_email_event(email_run_id, batch, email_run_date, master_path, atts, to_addrs, subject, "FAIL", "; ".join(problems))
             return {
                 'index': index,
+                'event': event,
                 'status': 'FAIL',
-                'error': "Missing Subject",
+                'error': "; ".join(problems),
                 'to_norm': to_addrs,
-                'subject': "",
+                'subject': subject,
                 'atts': atts
             }
 
-        # Skip all validations if force resend is enabled
-        if not force_resend:
-            # FIRST: Check if files are refreshed (this should take priority)
-            problems = []
-            for p in atts:
-                if not p.exists():
-                    problems.append(f"Missing file: {p}")
-                    continue
-                
-                fp_str = str(p)
-                
-                # Get the latest refresh date for this file from DB
-                latest_refresh_date = db_get_latest_refresh_date(conn, fp_str)
-                
-                if not latest_refresh_date:
-                    problems.append(f"No successful refresh found in database: {p}")
-                    continue
-                
-                # Check if the latest refresh is for today's email run date
-                if latest_refresh_date != email_run_date:
-                    problems.append(f"File not refreshed for today ({email_run_date}). Last refresh: {latest_refresh_date}: {p}")
-                    continue
-                
-                # If we require method email, check that too
-                if require_method_email and not db_refresh_method_email_for_date(conn, fp_str, email_run_date):
-                    problems.append(f"Method not 'Email' for today: {p}")
-
-            if problems:
-                db_write_email_event(conn, email_run_id, batch, email_run_date, master_path, atts, to_addrs, subject, "FAIL", "; ".join(problems))
-                return {
-                    'index': index,
-                    'status': 'FAIL',
-                    'error': "; ".join(problems),
-                    'to_norm': to_addrs,
-                    'subject': subject,
-                    'atts': atts
-                }
-
-            # SECOND: Check if already emailed in last X hours (only if files are fresh)
-            to_norm = to_addrs
-            if db_already_emailed_ok(conn, to_norm, subject, email_run_date, batch, fp_str):
-                db_write_email_event(conn, email_run_id, batch, email_run_date, master_path, atts, to_norm, subject, "SKIP", f"Already emailed for this run (rundate={email_run_date}, batch={batch})")
-                return {
-                    'index': index,
-                    'status': 'SKIP',
-                    'error': f"Already emailed for this run",
-                    'to_norm': to_norm,
-                    'subject': subject,
-                    'atts': atts
-                }
-        else:
-            # Force resend mode - skip all validations
-            to_norm = to_addrs
-            write_log(f"Email {index+1}: FORCE RESEND - Bypassing all validations")
-
-        # Build message + recipients
-        msg = EmailMessage()
-        msg["From"] = config["FROM_USER"]
-        msg["To"] = to_addrs
-        if cc_addrs:
-            msg["Cc"] = cc_addrs
-        msg["Subject"] = subject
-        msg.set_content(body_text)
-        msg.add_alternative(f"<pre style='font-family: inherit; white-space: pre-wrap'>{body_text}</pre>", subtype="html")
-        for p in atts:
-            maintype, subtype = infer_mime(p)
-            with open(p, "rb") as fh:
-                data = fh.read()
-            msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=p.name)
-        all_recipients = []
-        for hdr in ["To","Cc"]:
-            val = msg.get(hdr)
-            if val:
-                all_recipients += [a.strip() for a in val.split(",") if a.strip()]
-        if bcc_addrs:
-            all_recipients += [a.strip() for a in bcc_addrs.split(",") if a.strip()]
-
-        if dry_run:
-            db_write_email_event(conn, email_run_id, batch, email_run_date, master_path, atts, to_norm, subject, "SKIP", "DRYRUN")
+        # SECOND: Check if already emailed in last X hours (only if files are fresh)
+        to_norm = to_addrs
+        if already_emailed is None:
+            fp_joined = ";".join(str(p) for p in atts)
+            with db_session() as conn:
+                already_emailed = db_already_emailed_ok(conn, to_norm, subject, email_run_date, batch, fp_joined)
+        if already_emailed:
+            event = make_email_event(email_run_id, batch, email_run_date, master_path, atts, to_norm, subject, "SKIP", f"Already emailed for this run (rundate={email_run_date}, batch={batch})")
             return {
                 'index': index,
+                'event': event,
                 'status': 'SKIP',
-                'error': "DRYRUN",
+                'error': f"Already emailed for this run",
                 'to_norm': to_norm,
                 'subject': subject,
                 'atts': atts
             }
+    else:
+        # Force resend mode - skip all validations
+        write_log(f"Email {index+1}: FORCE RESEND - Bypassing all validations")
+
+    return RowFields(index, to_addrs, cc_addrs, bcc_addrs, subject, atts, greeting,
+                     (cell_str(row, "Attach Mode") or config.get("ATTACH_MODE", "auto")).lower(),
+                     bool(row.get("_resume")))
+
+class BuiltMessage(NamedTuple):
+    msg: EmailMessage
+    plain: list         # attachments sent as-is (streamed when stream is set, else already in msg)
+    stream: bool
+    recipients: list    # To + Cc + Bcc envelope addresses
+    method: str
+    note: str
+    plan: list          # AttachmentPlan per file, counted by count_sent_plan() once delivered
+
+def build_message(rows: list[RowFields], unchanged: dict, config, file_stats=None) -> BuiltMessage:
+    """
+    One message for rows to the same recipients (one row unless coalescing).
+    unchanged: index -> last delivery time of rows whose attachments are left out (content dedupe notice).
+    """
+    head = rows[0]
+    body_text = DEFAULT_BODY.replace("{GREETING}", head.greeting)
+    if len(rows) == 1:
+        subject = head.subject
+        if head.index in unchanged:
+            # notice: same recipients and subject, no attachments
+            body_text = body_text.replace("Please find attached today's report.", NOCHANGE_LINE.replace("{LAST_SENT}", unchanged[head.index]))
+    else:
+        subject = merged_subject([row.subject for row in rows])
+        lines = [f"  - {row.subject}" + (f" (unchanged since {unchanged[row.index]}, not attached again)" if row.index in unchanged else "")
+                 for row in rows]
+        intro = "Today's reports:" if all(row.index in unchanged for row in rows) else "Please find attached today's reports:"
+        body_text = body_text.replace("Please find attached today's report.", intro + "\n" + "\n".join(lines))
+    # A file listed on several rows is attached once
+    atts = list(dict.fromkeys(p for row in rows if row.index not in unchanged for p in row.atts))
+
+    # Size policy: attach / zip / link per file
+    plan = plan_attachments(config, atts, head.attach_mode, file_stats)
+    method, policy_note = describe_plan(plan)
+    links = [item for item in plan if item.action == "link"]
+    if links:
+        marker = "\nThis is an automated email."
+        section = link_section(links, config)
+        body_text = body_text.replace(marker, section + marker, 1) if marker in body_text else body_text + section
+
+    # Build message + recipients
+    msg = EmailMessage()
+    msg["From"] = config["FROM_USER"]
+    msg["To"] = head.to_addrs
+    if head.cc_addrs:
+        msg["Cc"] = head.cc_addrs
+    msg["Subject"] = subject
+    msg.set_content(body_text)
+    msg.add_alternative(f"<pre style='font-family: inherit; white-space: pre-wrap'>{body_text}</pre>", subtype="html")
+    for item in plan:
+        if item.action == "zip":
+            attach_part(msg, item.part)
+    # Large attachments go out through the streaming path instead of being encoded in memory
+    plain = [item.path for item in plan if item.action == "attach"]
+    stream = bool(config.get("STREAM_LARGE_ATTACHMENTS")) and \
+        sum(item.size for item in plan if item.action == "attach") >= int(config.get("STREAM_THRESHOLD_BYTES", 0))
+    if not stream:
+        attachment_cache = get_attachment_cache(config)
+        for p in plain:
+            attach_part(msg, attachment_cache.get_part(p, (file_stats or {}).get(str(p))))
+    all_recipients = []
+    for hdr in ["To","Cc"]:
+        val = msg.get(hdr)
+        if val:
+            all_recipients += [a.strip() for a in val.split(",") if a.strip()]
+    if head.bcc_addrs:
+        all_recipients += [a.strip() for a in head.bcc_addrs.split(",") if a.strip()]
+    return BuiltMessage(msg, plain, stream, all_recipients, method, policy_note, plan)
+
+class OutgoingMessage:
+    """
+    One message for checked rows to the same recipients (one row unless coalescing),
+    in two steps: build() - content dedupe, size policy, MIME / base64 - and send() -
+    claims and SMTP with account failover. results gets one result per row as it ends.
+    """
 
-        # Send email
+    def __init__(self, rows: list[RowFields], config, email_run_id, batch, email_run_date, master_path, dry_run, force_resend, file_stats):
+        self.rows = list(rows)
+        self.config = config
+        self.email_run_id = email_run_id
+        self.batch = batch
+        self.email_run_date = email_run_date
+        self.master_path = master_path
+        self.dry_run = dry_run
+        self.force_resend = force_resend
+        self.file_stats = file_stats
+        self.to_norm = rows[0].to_addrs
+        self.results: list[dict] = []
+        self.content_hashes: dict[int, str] = {}
+        self.unchanged: dict[int, str] = {}
+        self.built: BuiltMessage | None = None
+
+    def finish(self, row, status, error, text=None, method="Email", sender="", **extra):
+        event = make_email_event(self.email_run_id, self.batch, self.email_run_date, self.master_path, row.atts, self.to_norm, row.subject,
+                                 status, error if text is None else text, method=method, sender=sender)
+        self.results.append({
+            'index': row.index,
+            'event': event,
+            'status': status,
+            'error': error,
+            **extra,
+            **({'sender': sender} if sender else {}),
+            'to_norm': self.to_norm,
+            'subject': row.subject,
+            'atts': row.atts
+        })
+
+    def _build(self):
+        """
+        build_message() for self.rows. When it raises for a coalesced message, each row
+        is built alone: rows whose own attachments fail (missing, locked file) end as FAIL
+        and the message is built again from the others.
+        """
+        self.built = None
+        if not self.rows:
+            return
         try:
-            send_via_gmail(
-                config["FROM_USER"], config["APP_PASSWORD"], msg, 
-                config["USE_SSL"], config["SMTP_SERVER"], 
-                config["SMTP_PORT_SSL"], config["SMTP_PORT_STARTTLS"], 
-                all_recipients
-            )
-            status_msg = "OK (FORCED)" if force_resend else "OK"
-            db_write_email_event(conn, email_run_id, batch, email_run_date, master_path, atts, to_norm, subject, "OK", status_msg)
-            return {
-                'index': index,
-                'status': 'OK',
-                'error': status_msg,
-                'to_norm': to_norm,
-                'subject': subject,
-                'atts': atts
-            }
+            self.built = build_message(self.rows, self.unchanged, self.config, self.file_stats)
+            return
         except Exception as e:
-            db_write_email_event(conn, email_run_id, batch, email_run_date, master_path, atts, to_norm, subject, "FAIL", str(e))
-            return {
-                'index': index,
-                'status': 'FAIL',
-                'error': str(e),
-                'to_norm': to_norm,
-                'subject': subject,
-                'atts': atts
-            }
-    
-    finally:
+            if len(self.rows) == 1:
+                self.finish(self.rows.pop(), "FAIL", f"{type(e).__name__}: {e}")
+                return
+        for row in list(self.rows):
+            try:
+                build_message([row], self.unchanged, self.config, self.file_stats)
+            except Exception as e:
+                self.rows.remove(row)
+                self.finish(row, "FAIL", f"{type(e).__name__}: {e}")
+        if self.rows:
+            self.built = build_message(self.rows, self.unchanged, self.config, self.file_stats)
+
+    def described(self, row, text: str) -> tuple[str, str]:
+        """(event method, error_text) of a row sent in this message."""
+        if row.index in self.unchanged:
+            method, note = "Email+NoChange", f"no-change notice, content {self.content_hashes[row.index][:12]} as sent {self.unchanged[row.index]}"
+        else:
+            method, note = self.built.method, self.built.note
+        if len(self.rows) > 1:
+            others = ", ".join(str(r.index + 1) for r in self.rows if r is not row)
+            method, note = method + "+Merged", "; ".join(filter(None, [f"one message with rows {others}", note]))
+        return method, f"{text}; {note}" if note else text
+
+    def build(self):
+        config = self.config
+        # Content dedupe: the same bytes already went to these recipients within the window
+        dedupe_mode = config.get("CONTENT_DEDUPE", "off")
+        for row in list(self.rows):
+            if dedupe_mode == "off" or not row.atts:
+                continue
+            try:
+                store = get_content_store(config)
+                self.content_hashes[row.index] = store.set_hash(row.atts, self.file_stats)
+                unchanged_since = store.last_delivery(self.to_norm, row.subject, self.content_hashes[row.index], float(config.get("CONTENT_DEDUPE_WINDOW_H", 24)) * 3600)
+            except Exception as e:
+                write_log(f"WARNING: Email {row.index+1}: content hash unavailable, sending as usual: {e}")
+                continue
+            if unchanged_since is None:
+                continue
+            last_sent = datetime.fromtimestamp(unchanged_since).strftime("%Y-%m-%d %H:%M")
+            if dedupe_mode == "skip":
+                self.rows.remove(row)
+                self.finish(row, "SKIP", f"Unchanged since last delivery ({last_sent}, content {self.content_hashes[row.index][:12]})")
+            else:
+                self.unchanged[row.index] = last_sent
+        self._build()
+        if self.built is not None and self.dry_run:
+            for row in self.rows:
+                method, text = self.described(row, "DRYRUN")
+                self.finish(row, "SKIP", "DRYRUN", text, method)
+            self.rows = []
+
+    def send(self):
+        if not self.rows:
+            return
+        config = self.config
+        email_run_date, batch = self.email_run_date, self.batch
+
+        # Claim each email before SMTP (schema 2); whoever holds the claim is the only sender
+        claims = {}
+        if not self.force_resend:
+            claimed = []
+            try:
+                with db_session() as conn:
+                    if has_email_claims(conn):
+                        for row in self.rows:
+                            key = email_claim_key(email_run_date, batch, self.to_norm, row.subject, row.atts)
+                            held = db_claim_email(conn, key, email_run_date, batch, claim_owner(), config.get("CLAIM_STALE_S", 900), row.resume)
+                            if held == "OK":
+                                self.finish(row, "SKIP", "Already emailed for this run",
+                                            f"Already emailed for this run (claim OK, rundate={email_run_date}, batch={batch})", self.described(row, "")[0])
+                            elif held is not None:
+                                # Someone else is sending it right now; retried later (their OK then turns this into a SKIP)
+                                self.finish(row, "FAIL", "Being sent by another worker or run (claim PENDING)", method=self.described(row, "")[0],
+                                            retry_after=0.0, claim_pending=True)
+                            else:
+                                claims[row.index] = key
+                                claimed.append(row)
+                    else:
+                        claimed = self.rows
+            except Exception as e:
+                _finish_claims(claims, self.rows, "FAIL")
+                resolved = {r['index'] for r in self.results}
+                for row in self.rows:
+                    if row.index not in resolved:
+                        self.finish(row, "FAIL", f"Could not claim email: {e}", method=self.described(row, "")[0], retry_after=0.0)
+                return
+            if len(claimed) < len(self.rows):
+                # Part of a coalesced message is someone else's: build it again without those rows
+                self.rows = claimed
+                self._build()
+                _finish_claims(claims, [r for r in claimed if r not in self.rows], "FAIL")
+                if self.built is None:
+                    return
+
+        # Send email. Real sends only are throttled, by the account's bucket (shared across all
+        # workers); an account that is out of quota or throttled (4xx) hands over to the next one
+        built = self.built
+        msg = built.msg
+        accounts = _SENDER_ACCOUNTS.order(self.to_norm) if _SENDER_ACCOUNTS is not None else [None]
+        sender = None
+        send_error = None
+        t_send = time.perf_counter()
+        for account in accounts:
+            if account is not None and not account.limiter.acquire():
+                continue
+            sender = account.user if account is not None else config["FROM_USER"]
+            msg.replace_header("From", sender)
+            t_send = time.perf_counter()
+            try:
+                if built.stream:
+                    send_via_gmail_streamed(config, msg, built.plain, built.recipients, account)
+                else:
+                    send_via_gmail(config, msg, built.recipients, account)
+                send_error = None
+                break
+            except Exception as e:
+                send_error = e
+                if account is not None:
+                    # Not delivered: neither the rate bucket nor the daily budget is spent
+                    account.limiter.refund()
+                if account is None or len(accounts) == 1 or not is_throttle_error(e):
+                    break
+                account.pause(max(float(config.get("ACCOUNT_THROTTLE_PAUSE_S", 300)), classify_send_error(e) or 0.0))
+                write_log(f"Email {self.rows[0].index+1}: {sender} throttled ({e}); trying the next account")
+
+        if sender is None:
+            _finish_claims(claims, self.rows, "FAIL")
+            error = f"Daily send quota exhausted ({_SENDER_ACCOUNTS.describe()})"
+            for row in self.rows:
+                self.finish(row, "FAIL", error, method=self.described(row, "")[0])
+            return
+
+        if send_error is None:
+            send_s = time.perf_counter() - t_send
+            count_sent_plan(built.plan)
+            _finish_claims(claims, self.rows, "OK")
+            status_msg = "OK (FORCED)" if self.force_resend else "OK"
+            for row in self.rows:
+                if row.index in self.content_hashes and row.index not in self.unchanged:
+                    try:
+                        get_content_store(config).record_delivery(self.to_norm, row.subject, self.content_hashes[row.index])
+                    except Exception as e:
+                        write_log(f"WARNING: Email {row.index+1}: could not record delivered content hash: {e}")
+                method, text = self.described(row, status_msg)
+                self.finish(row, "OK", status_msg, text, method, sender, send_s=send_s)
+            return
+
+        _finish_claims(claims, self.rows, "FAIL")
+        for row in self.rows:
+            method, text = self.described(row, str(send_error))
+            self.finish(row, "FAIL", str(send_error), text, method, sender,
+                        retry_after=classify_send_error(send_error),
+                        send_s=time.perf_counter() - t_send,
+                        throttled=is_throttle_error(send_error))
+
+def _finish_claims(claims: dict, rows: list[RowFields], status: str):
+    for row in rows:
+        claim = claims.get(row.index)
+        if claim is None:
+            continue
         try:
-            conn.close()
-        except:
-            pass
+            with db_session() as conn:
+                db_finish_claim(conn, claim, claim_owner(), status)
+        except Exception as e:
+            write_log(f"WARNING: Could not finalize claim {claim} as {status}: {e}")
 
 # --------------------------- Args -----------------------------------
 
-def parse_arguments():
+def parse_arguments(argv=None):
     p = argparse.ArgumentParser(description="Send email reports for a batch (DB-backed).")
-    p.add_argument('--batch', type=int, required=True, help='Batch number (1..6 etc.)')
-    p.add_argument('--email-list', type=str, required=True, help='Path to Email_List.xlsx')
+    p.add_argument('--batch', type=int, action='append', default=None, help='Batch number (1..6 etc.); repeat with --email-list for several batches in one run')
+    p.add_argument('--email-list', type=str, action='append', default=None, help='Path to Email_List.xlsx, one per --batch')
+    p.add_argument('--batch-map', type=str, default=None, help='File of "<batch>,<Email_List path>" lines (relative paths from the file); adds to --batch/--email-list')
     p.add_argument('--email-date', type=str, default=None, help='YYYY-MM-DD for email run; default=TODAY')
     p.add_argument('--max-parallel', type=int, default=None, help='Max parallel processes (default: 3)')
+    p.add_argument('--adaptive', action='store_true', help='Adapt rows in flight to SMTP latency/throttling between ADAPTIVE_MIN and --max-parallel (or ADAPTIVE_MAX)')
+    p.add_argument('--engine', choices=ENGINES, default=None, help='Fan-out engine: process, thread or pipeline (default: CONFIG ENGINE)')
+    p.add_argument('--build-workers', type=int, default=None, help='pipeline engine: message build threads; --max-parallel sizes the SMTP senders (default: CONFIG PIPELINE_BUILD_WORKERS)')
+    p.add_argument('--rate-per-sec', type=float, default=None, help='Max SMTP sends per second across all workers (default: 1.0)')
+    p.add_argument('--daily-quota', type=int, default=None, help='Max SMTP sends per day (default: 2000)')
+    p.add_argument('--emailed-refresh-s', type=int, default=None, help='Reload already-emailed keys every N seconds (default: 0 = load once)')
+    p.add_argument('--stream-large', action='store_true', help='Stream messages with large attachments from a spooled temp file')
+    p.add_argument('--attach-mode', choices=ATTACH_MODES, default=None, help='Attachment size policy for rows without an "Attach Mode" (default: auto)')
+    p.add_argument('--no-list-cache', action='store_true', help='Always re-parse the Email_List workbook (ignore the local cache)')
+    p.add_argument('--list-reader', choices=LIST_READERS, default=None, help='Email_List reader: pandas, or stream (openpyxl read-only, faster start-up) (default: CONFIG LIST_READER)')
+    p.add_argument('--content-dedupe', choices=CONTENT_DEDUPE_MODES, default=None, help='Unchanged attachments already delivered within CONTENT_DEDUPE_WINDOW_H: skip the row, or send a short no-change notice (default: CONFIG CONTENT_DEDUPE)')
+    p.add_argument('--coalesce', action='store_true', help='Send rows to the same Receiver/CC/BCC as one message (caps: COALESCE_MAX_ROWS, COALESCE_MAX_BYTES)')
     p.add_argument('--fallback-hours', type=int, default=None, help='Hours to check for already sent emails (default: 18)')
     p.add_argument('--force-resend', action='store_true', help='Force resend all emails regardless of refresh status or previous sends')
-    return p.parse_args()
+    p.add_argument('--follow', action='store_true', help='Send each row as soon as all its attachments are refreshed (tails the events table)')
+    p.add_argument('--follow-minutes', type=float, default=None, help='Follow mode deadline in minutes (default: CONFIG FOLLOW_DEADLINE_MIN)')
+    p.add_argument('--serve', action='store_true', help='Run as a resident sender and accept jobs on DAEMON_ADDR')
+    p.add_argument('--daemon', action='store_true', help='Hand this job to the resident sender (runs here if none is listening)')
+    args = p.parse_args(argv)
+    if len(args.batch or []) != len(args.email_list or []):
+        p.error("give one --email-list per --batch")
+    if not args.serve and not args.batch and not args.batch_map:
+        p.error("--batch and --email-list (or --batch-map) are required")
+    return args
+
+def batch_jobs(args, cwd: str | None = None) -> list[tuple[int, Path]]:
+    """(batch, Email_List path) pairs of one invocation: --batch/--email-list, then --batch-map lines."""
+    base = Path(cwd or ".")
+    jobs = [(b, base / p) for b, p in zip(args.batch or [], args.email_list or [])]
+    if args.batch_map:
+        map_path = base / args.batch_map
+        for line in map_path.read_text(encoding="utf-8-sig").splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            num, sep, path = line.partition(",")
+            if not sep or not num.strip().isdigit() or not path.strip():
+                raise ValueError(f"{map_path}: expected '<batch>,<Email_List path>', got {line!r}")
+            jobs.append((int(num), map_path.parent / path.strip().strip('"')))
+    return jobs
+
+# --------------------------- Engines --------------------------------
+
+ENGINES = ("process", "thread", "pipeline")
+
+def engine_name(args) -> str:
+    """--engine, else CONFIG ENGINE; a CONFIG still naming the removed "async" engine runs as thread."""
+    engine = args.engine or CONFIG["ENGINE"]
+    if engine == "async":
+        write_log('WARNING: ENGINE "async" was removed (it was the thread engine behind asyncio); using "thread"')
+        return "thread"
+    return engine
+
+class PipelineEngine:
+    """
+    Executor-shaped two-stage engine. Build threads run the first half of each
+    submitted row (checks, content hash, MIME / base64: fn(..., staged=True)) and
+    put the built message in a bounded queue; sender threads take messages off it
+    and do the claim + SMTP half (StagedEmail.deliver()). A full queue holds the
+    build threads back, so at most queue_size built messages wait in memory.
+    stats: busy seconds per stage, time builders waited on a full queue (send-bound)
+    and senders on an empty one (build-bound), queue depth seen at each put.
+    """
 
-# --------------------------- Main -----------------------------------
+    def __init__(self, build_workers: int, send_workers: int, queue_size: int):
+        self.build_workers = max(1, int(build_workers))
+        self.send_workers = max(1, int(send_workers))
+        self.queue_size = max(1, int(queue_size))
+        self._queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self._builders = ThreadPoolExecutor(max_workers=self.build_workers, thread_name_prefix="send-build")
+        self._lock = threading.Lock()
+        self.stats = {"built": 0, "sent": 0, "build_s": 0.0, "send_s": 0.0, "full_wait_s": 0.0,
+                      "empty_wait_s": 0.0, "depth_sum": 0, "depth_max": 0}
+        self._senders = [threading.Thread(target=self._send_loop, name=f"send-smtp-{i}", daemon=True)
+                         for i in range(self.send_workers)]
+        for t in self._senders:
+            t.start()
+
+    def _count(self, **deltas):
+        with self._lock:
+            for k, v in deltas.items():
+                self.stats[k] += v
+            self.stats["depth_max"] = max(self.stats["depth_max"], self._queue.qsize())
+
+    def _build(self, future: Future, fn, args):
+        t0 = time.perf_counter()
+        try:
+            staged = fn(*args, staged=True)
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        t1 = time.perf_counter()
+        depth = self._queue.qsize()
+        self._queue.put((future, staged))
+        self._count(built=1, build_s=t1 - t0, full_wait_s=time.perf_counter() - t1, depth_sum=depth)
+
+    def _send_loop(self):
+        while True:
+            t0 = time.perf_counter()
+            item = self._queue.get()
+            if item is None:
+                return
+            future, staged = item
+            t1 = time.perf_counter()
+            try:
+                future.set_result(staged.deliver())
+            except BaseException as e:
+                future.set_exception(e)
+            self._count(sent=1, send_s=time.perf_counter() - t1, empty_wait_s=t1 - t0)
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self._builders.submit(self._build, future, fn, args)
+        return future
+
+    def snapshot(self) -> dict:
+        """Counters so far; depth_max restarts from here."""
+        with self._lock:
+            snap = dict(self.stats, t=time.perf_counter())
+            self.stats["depth_max"] = self._queue.qsize()
+            return snap
+
+    def describe(self, before: dict) -> str:
+        """Stage utilization and queue depth since the before snapshot."""
+        now = self.snapshot()
+        d = {k: now[k] - before[k] for k in now if k != "depth_max"}
+        wall = max(1e-6, d["t"])
+        build_busy = d["build_s"] / (wall * self.build_workers)
+        send_busy = d["send_s"] / (wall * self.send_workers)
+        return (f"build {self.build_workers} threads {build_busy:.0%} busy, "
+                f"send {self.send_workers} threads {send_busy:.0%} busy, "
+                f"queue avg {d['depth_sum'] / max(1, d['built']):.1f} max {now['depth_max']}/{self.queue_size}, "
+                f"builders waited {d['full_wait_s']:.1f}s on a full queue, senders {d['empty_wait_s']:.1f}s on an empty one "
+                f"({'send' if send_busy >= build_busy else 'build'}-bound)")
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        self._builders.shutdown(wait=wait, cancel_futures=cancel_futures)
+        for _ in self._senders:
+            self._queue.put(None)
+        if wait:
+            for t in self._senders:
+                t.join()
+
+# --------------------------- Resident sender ------------------------
+
+class SenderResources:
+    """
+    What a run needs beyond its own rows: the worker pool (with the SMTP sessions,
+    DB pools and attachment caches its workers hold), the sender accounts with their shared rate limiters,
+    parsed Email_Lists and the latest stats snapshot per worker. A plain CLI run
+    builds one for itself; the resident sender keeps one across jobs.
+    """
 
-def main():
-    args = parse_arguments()
+    def __init__(self, max_parallel: int, accounts: SenderAccounts, engine: str = "process", build_workers: int = 0):
+        self.max_parallel = max(1, int(max_parallel))
+        self.accounts = accounts
+        self.engine = engine
+        self.build_workers = max(1, int(build_workers or CONFIG["PIPELINE_BUILD_WORKERS"]))
+        self.lists: dict = {}
+        self.worker_stats: dict[int, dict] = {}
+        self.broken = False
+        self.executor = self._new_executor()
+
+    def _new_executor(self):
+        if self.engine == "pipeline":
+            init_in_process_workers(self.accounts, self.max_parallel + self.build_workers)
+            return PipelineEngine(self.build_workers, self.max_parallel, CONFIG["PIPELINE_QUEUE_SIZE"])
+        if self.engine != "process":
+            init_in_process_workers(self.accounts, self.max_parallel)
+            return ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="send")
+        return ProcessPoolExecutor(
+            max_workers=self.max_parallel,
+            initializer=init_worker,
+            initargs=(self.accounts, CONFIG["DB_POOL_SIZE"]),
+        )
+
+    def restart_if_broken(self):
+        """Replace a pool whose worker died (BrokenProcessPool) before the next job."""
+        if self.broken:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self._new_executor()
+            self.worker_stats.clear()
+            self.broken = False
+            write_log("Resident sender: worker pool restarted")
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def sender_resources(args) -> SenderResources:
+    """SenderResources sized from the CLI / CONFIG the way run_batch would size its own."""
+    adaptive = args.adaptive or bool(CONFIG["ADAPTIVE_CONCURRENCY"])
+    max_parallel = args.max_parallel if args.max_parallel is not None else CONFIG["ADAPTIVE_MAX" if adaptive else "MAX_PARALLEL"]
+    per_second = args.rate_per_sec if args.rate_per_sec is not None else CONFIG["SEND_RATE_PER_SEC"]
+    per_day = args.daily_quota if args.daily_quota is not None else CONFIG["DAILY_SEND_QUOTA"]
+    return SenderResources(
+        max_parallel, build_sender_accounts(per_second, per_day, bool(CONFIG["DRY_RUN"])),
+        engine_name(args), args.build_workers,
+    )
+
+def _daemon_addr() -> tuple[str, int]:
+    host, _, port = CONFIG["DAEMON_ADDR"].rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+def _daemon_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
 
+def _restrict_to_owner(path: Path):
+    """
+    Make a file accessible to the current user only: mode 0600, and on Windows, which
+    ignores the mode, an ACL with inheritance removed that grants only this user.
+    """
+    os.chmod(path, 0o600)
+    if os.name == "nt":
+        import getpass
+        domain = os.environ.get("USERDOMAIN")
+        account = f"{domain}\\{getpass.getuser()}" if domain else getpass.getuser()
+        subprocess.run(["icacls", str(path), "/inheritance:r", "/grant:r", f"{account}:F"],
+                       check=True, capture_output=True)
+
+def _daemon_token(create: bool = False) -> str:
+    """DAEMON_TOKEN, else the one --serve generated into STATE_DIR/daemon.token ("" when none)."""
+    if CONFIG["DAEMON_TOKEN"]:
+        return CONFIG["DAEMON_TOKEN"]
+    path = Path(CONFIG["STATE_DIR"]) / "daemon.token"
+    if create:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        token = secrets.token_urlsafe(32)
+        # Restricted while still empty, so the token is never readable by others
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600))
+        _restrict_to_owner(path)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(token)
+        return token
+    try:
+        return path.read_text(encoding="utf-8").strip()
+    except OSError:
+        return ""
+
+def _send_json_line(wfile, obj):
+    wfile.write(json.dumps(obj, default=str).encode("utf-8") + b"\n")
+    wfile.flush()
+
+def serve(args) -> int:
+    """
+    Resident sender: one warm SenderResources, jobs accepted as JSON lines
+    {"argv": [...], "cwd": ..., "token": ...} on DAEMON_ADDR. Jobs run one at a
+    time; each streams back {"type": "log"|"row"|"summary", ...} and ends with
+    {"type": "exit", "code": n}, the exit code the CLI would return.
+    """
+    host, port = _daemon_addr()
+    if not CONFIG["DAEMON_TOKEN"] and not _daemon_loopback(host):
+        write_log(f"ERROR: DAEMON_ADDR {host}:{port} is not loopback; set DAEMON_TOKEN to serve on it")
+        return 2
+    try:
+        token = _daemon_token(create=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        write_log(f"ERROR: Could not create a private daemon token file (set DAEMON_TOKEN instead): {e}")
+        return 2
+    # spawn (the Windows default) everywhere: a forked worker would inherit the listening socket
+    multiprocessing.set_start_method("spawn", force=True)
+    resources = sender_resources(args)
+    job_lock = threading.Lock()
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline(1024 * 1024) or b"{}")
+            except ValueError:
+                return
+            send_lock = threading.Lock()
+            connected = True
+
+            def send(obj):
+                nonlocal connected
+                if not connected:
+                    return
+                with send_lock:
+                    try:
+                        _send_json_line(self.wfile, obj)
+                    except OSError:
+                        connected = False  # client went away; the job still finishes
+
+            if not secrets.compare_digest(str(request.get("token") or ""), token):
+                send({"type": "log", "line": "ERROR: sender daemon token mismatch"})
+                send({"type": "exit", "code": 2})
+                return
+            if not job_lock.acquire(blocking=False):
+                send({"type": "log", "line": "Resident sender busy; job queued"})
+                job_lock.acquire()
+            saved_config = dict(CONFIG)
+            listener = lambda line: send({"type": "log", "line": line})
+            code = 1
+            try:
+                resources.restart_if_broken()
+                _LOG_LISTENERS.append(listener)
+                try:
+                    job = parse_arguments(request.get("argv") or [])
+                    code = run_batches(job, resources, lambda kind, payload: send({"type": kind, **payload}),
+                                       cwd=request.get("cwd"))
+                except SystemExit as e:
+                    code = e.code if isinstance(e.code, int) else 2
+                except Exception as e:
+                    write_log(f"ERROR: job failed: {type(e).__name__}: {e}")
+                    resources.broken = resources.broken or isinstance(e, BrokenProcessPool)
+                    code = 1
+            finally:
+                if listener in _LOG_LISTENERS:
+                    _LOG_LISTENERS.remove(listener)
+                CONFIG.clear()
+                CONFIG.update(saved_config)
+                job_lock.release()
+            send({"type": "exit", "code": code})
+
+    class Server(socketserver.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    server = Server((host, port), JobHandler)
+    # Service managers stop us with SIGTERM; finish the running job, then shut down
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    write_log(f"Resident sender listening on {host}:{port} ({resources.max_parallel} {resources.engine} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        write_log("Resident sender stopping")
+    finally:
+        server.server_close()
+        resources.close()
+    return 0
+
+def submit_to_daemon(argv: list[str]) -> int | None:
+    """
+    Run a job on the resident sender and print its log lines as they arrive.
+    Returns the job's exit code, or None when no sender is listening.
+    """
+    try:
+        sock = socket.create_connection(_daemon_addr(), timeout=5)
+    except OSError:
+        return None
+    with sock:
+        sock.settimeout(None)
+        with sock.makefile("rwb") as stream:
+            _send_json_line(stream, {"argv": argv, "cwd": os.getcwd(), "token": _daemon_token()})
+            for raw in stream:
+                msg = json.loads(raw)
+                if msg.get("type") == "log":
+                    print(msg["line"], flush=True)
+                elif msg.get("type") == "exit":
+                    return int(msg["code"])
+    print("ERROR: resident sender closed the connection before the job finished", flush=True)
+    return 1
+
+# --------------------------- Main -----------------------------------
+
+def run_batch(args, resources=None, notify=None, refresh=None) -> int:
+    """
+    One email run for args.batch. Uses warm resources (resident sender, or shared
+    by run_batches) when given, else its own pool for the run. refresh is a
+    SharedRefreshStatus already covering this list. notify(kind, payload)
+    receives a "row" per result and the final "summary".
+    """
+    # Start-up is measured from interpreter start, or from job receipt in the resident sender
+    t_origin = _T_START if resources is None else time.perf_counter()
     BATCH_NUMBER = args.batch
     EMAIL_LIST_PATH = Path(args.email_list)
 
@@ -535,8 +3484,6 @@ def main():
     LOG_DIR = Path(CONFIG["LOG_DIR"])
     BATCH = f"EmailBatch{BATCH_NUMBER}"
     MASTER_PATH = CONFIG["MASTER_PATH"]
-    FROM_USER = CONFIG["FROM_USER"]
-    APP_PASSWORD = CONFIG["APP_PASSWORD"]
     REQUIRE_METHOD_EMAIL = bool(CONFIG["REQUIRE_METHOD_EMAIL"])
     DRY_RUN = bool(CONFIG["DRY_RUN"])
     USE_SSL = bool(CONFIG["USE_SSL"])
@@ -545,8 +3492,26 @@ def main():
     SMTP_PORT_STARTTLS = int(CONFIG["SMTP_PORT_STARTTLS"])
     
     # Parallel execution config
-    MAX_PARALLEL = args.max_parallel if args.max_parallel is not None else CONFIG["MAX_PARALLEL"]
+    ADAPTIVE = args.adaptive or bool(CONFIG["ADAPTIVE_CONCURRENCY"])
+    MAX_PARALLEL = args.max_parallel if args.max_parallel is not None else CONFIG["ADAPTIVE_MAX" if ADAPTIVE else "MAX_PARALLEL"]
+    ENGINE = engine_name(args) if resources is None else resources.engine
     
+    # Send rate config
+    SEND_RATE_PER_SEC = args.rate_per_sec if args.rate_per_sec is not None else CONFIG["SEND_RATE_PER_SEC"]
+    DAILY_SEND_QUOTA = args.daily_quota if args.daily_quota is not None else CONFIG["DAILY_SEND_QUOTA"]
+
+    # Streaming send config (workers read it from the CONFIG they receive)
+    if args.stream_large:
+        CONFIG["STREAM_LARGE_ATTACHMENTS"] = True
+
+    if args.attach_mode:
+        CONFIG["ATTACH_MODE"] = args.attach_mode
+
+    if args.content_dedupe:
+        CONFIG["CONTENT_DEDUPE"] = args.content_dedupe
+
+    COALESCE = args.coalesce or bool(CONFIG["COALESCE_ROWS"])
+
     # Fallback hours config
     FALLBACK_HOURS = args.fallback_hours if args.fallback_hours is not None else CONFIG["FALLBACK_HOURS"]
     
@@ -557,80 +3522,497 @@ def main():
     email_run_id = f"email-log_{EMAIL_RUN_DATE:%Y-%m-%d}_Batch-{BATCH_NUMBER}"
     email_csv_out = LOG_DIR / f"email-log_{EMAIL_RUN_DATE:%Y-%m-%d}_Batch-{BATCH_NUMBER}.csv"
 
-    if not FROM_USER or not APP_PASSWORD:
-        write_log("ERROR: Please set FROM_USER and APP_PASSWORD in CONFIG.")
+    if not all(spec.get("user") and spec.get("password") for spec in sender_account_specs()):
+        write_log("ERROR: Please set FROM_USER and APP_PASSWORD (or user/password for every SENDER_ACCOUNTS entry) in CONFIG.")
         return 2
 
-    # Load email list
-    df_list = load_email_list(EMAIL_LIST_PATH)
+    # Load email list (local parse cache unless --no-list-cache)
+    list_reader = args.list_reader or CONFIG["LIST_READER"]
+    t0 = time.perf_counter()
+    list_columns, list_rows, how = load_email_list_for_run(
+        EMAIL_LIST_PATH, list_reader, CONFIG["LIST_CACHE"] and not args.no_list_cache,
+        None if resources is None else resources.lists,
+    )
+    write_log(f"Email list loaded: {len(list_rows)} rows ({list_reader} reader, {how}, {time.perf_counter() - t0:.2f}s)")
     for col in ["Receiver","CC","BCC","Subject","Attachement Path"]:
-        if col not in df_list.columns:
+        if col not in list_columns:
             write_log(f"ERROR: Column '{col}' missing in List sheet.")
             return 2
 
     write_log(f"Processing Batch {BATCH_NUMBER} for {EMAIL_RUN_DATE} | email_run_id={email_run_id}")
     write_log(f"Email list: {EMAIL_LIST_PATH}")
-    write_log(f"Parallel execution: {MAX_PARALLEL} processes")
+    write_log(f"Parallel execution: {MAX_PARALLEL} ({ENGINE} engine)")
     write_log(f"Fallback hours: {FALLBACK_HOURS} hours")
+    write_log(f"Send rate: {SEND_RATE_PER_SEC}/s (burst {CONFIG['SEND_BURST']}), daily quota: {DAILY_SEND_QUOTA}")
     write_log(f"Force resend: {FORCE_RESEND}")
-
-    # Prepare data for parallel processing
-    email_rows = [(row, idx) for idx, row in df_list.iterrows()]
-    
-    total_ok = total_fail = total_skip = 0
-
-    # Process emails in parallel
-    with ProcessPoolExecutor(max_workers=MAX_PARALLEL) as executor:
-        # Submit all tasks
-        future_to_index = {
-            executor.submit(
-                process_single_email, 
-                row_data, 
-                CONFIG, 
-                email_run_id, 
-                BATCH, 
-                EMAIL_RUN_DATE, 
-                MASTER_PATH, 
-                REQUIRE_METHOD_EMAIL, 
-                DRY_RUN,
-                FALLBACK_HOURS,
-                FORCE_RESEND
-            ): row_data[1] 
-            for row_data in email_rows
-        }
-        
-        # Process results as they complete
-        for future in as_completed(future_to_index):
+    write_log(f"Attachment policy: {CONFIG['ATTACH_MODE']} (zip > {CONFIG['ATTACH_ZIP_OVER_BYTES']}, link > {CONFIG['ATTACH_LINK_OVER_BYTES']} bytes)")
+    if CONFIG["STREAM_LARGE_ATTACHMENTS"]:
+        write_log(f"Streaming send for attachments >= {CONFIG['STREAM_THRESHOLD_BYTES']} bytes")
+    if CONFIG["CONTENT_DEDUPE"] != "off":
+        write_log(f"Content dedupe: {CONFIG['CONTENT_DEDUPE']} when unchanged within {CONFIG['CONTENT_DEDUPE_WINDOW_H']}h")
+    if COALESCE:
+        write_log(f"Coalescing rows per recipient set: up to {CONFIG['COALESCE_MAX_ROWS']} rows / {CONFIG['COALESCE_MAX_BYTES']} bytes per message")
+
+    if resources is None:
+        accounts = build_sender_accounts(SEND_RATE_PER_SEC, DAILY_SEND_QUOTA, DRY_RUN)
+    else:
+        # Shared accounts, limiters and pool outlive the job (resident sender / later batches)
+        accounts = resources.accounts
+        MAX_PARALLEL = resources.max_parallel
+        ENGINE = resources.engine
+        write_log(f"Warm resources: {MAX_PARALLEL} {ENGINE} workers, sent in last 24h {accounts.sent_24h}/{accounts.per_day}")
+    if len(accounts.accounts) > 1:
+        write_log(f"Sender accounts ({'sticky per recipient' if accounts.sticky else 'round-robin'}): {accounts.describe()}")
+
+    # Events of a previous run that crashed or lost the DB before flushing
+    journal_dir = Path(CONFIG["STATE_DIR"]) / "journal"
+    replayed = replay_journals(journal_dir)
+    if replayed:
+        write_log(f"Replayed {replayed} journaled Email events from a previous run")
+    event_writer = EmailEventWriter(journal_dir, email_run_id, CONFIG["EVENT_FLUSH_SIZE"], CONFIG["EVENT_FLUSH_INTERVAL_S"])
+
+    # Pre-flight: validate / normalize the whole list at once; only clean rows are dispatched
+    t0 = time.perf_counter()
+    preflight = preflight_email_list(list_columns, list_rows, dedupe=not FORCE_RESEND)
+    email_rows = preflight.rows
+    row_atts = preflight.atts
+    write_log(f"Pre-flight: {len(email_rows)} rows clean, "
+              f"{sum(1 for r in preflight.rejected if r[1] == 'FAIL')} invalid, "
+              f"{sum(1 for r in preflight.rejected if r[1] == 'SKIP')} duplicates ({time.perf_counter() - t0:.3f}s)")
+
+    def row_key(row, idx):
+        to_norm = normalize_addr_list(cell_str(row, "Receiver"))
+        fp = ";".join(str(p) for p in row_atts[idx])
+        return emailed_key(to_norm, cell_str(row, "Subject"), fp)
+
+    # Outbox: resume a run that stopped part-way (rows already sent are not dispatched or re-checked)
+    outbox = None
+    send_attempts: dict[str, int] = {}
+    retry_heap: list = []
+    if CONFIG["OUTBOX"]:
+        try:
+            outbox = Outbox(Path(CONFIG["STATE_DIR"]) / "outbox.sqlite", CONFIG["OUTBOX_KEEP_DAYS"])
+        except Exception as e:
+            write_log(f"WARNING: Outbox unavailable, running without retry state: {e}")
+    if outbox is not None and not FORCE_RESEND:
+        previous = outbox.load(email_run_id)
+        if previous:
+            resumed_ok = 0
+            fresh_rows = []
+            for row, idx in email_rows:
+                entry = previous.get(outbox_key(row_key(row, idx)))
+                if entry is not None and entry.status == "OK":
+                    resumed_ok += 1
+                    continue
+                if entry is not None and entry.status in ("RETRY", "PENDING"):
+                    send_attempts[outbox_key(row_key(row, idx))] = entry.attempts
+                    # Its claim may still be PENDING under the stopped run's pid
+                    row["_resume"] = True
+                if entry is not None and entry.status == "RETRY" and (entry.next_at or 0) > time.time():
+                    heapq.heappush(retry_heap, (entry.next_at, idx, [(row, idx)]))
+                    continue
+                fresh_rows.append((row, idx))
+            email_rows = fresh_rows
+            write_log(f"Outbox: resuming {email_run_id}: {resumed_ok} rows already sent, "
+                      f"{len(retry_heap)} retries scheduled, {len(email_rows)} rows to process")
+
+    # Prefetch refresh status for every attachment in one pass (None = workers query per file)
+    refresh_lookup = None
+    follow_from_id = None
+    if not FORCE_RESEND:
+        all_paths = {str(p) for atts in row_atts.values() for p in atts}
+        if refresh is not None and refresh.lookup is not None and refresh.run_date == EMAIL_RUN_DATE:
             try:
-                result = future.result()
-                if result['status'] == 'OK':
-                    total_ok += 1
-                    status_indicator = "Force Resend is set to Ture" if FORCE_RESEND else "Force Resend is set to False"
-                    write_log(f"Email {result['index']+1}: OK - To: {result['to_norm']}")
-                elif result['status'] == 'FAIL':
-                    total_fail += 1
-                    write_log(f"X Email {result['index']+1}: FAIL - {result['error']}")
-                elif result['status'] == 'SKIP':
-                    total_skip += 1
-                    write_log(f"- Email {result['index']+1}: SKIP - {result['error']}")
-                    
+                t0 = time.perf_counter()
+                new_events = refresh.catch_up()
+                refresh_lookup, follow_from_id = refresh.lookup, refresh.last_id
+                write_log(f"Refresh status: shared prefetch, {new_events} refresh events since ({time.perf_counter() - t0:.2f}s)")
             except Exception as e:
-                total_fail += 1
-                write_log(f"X Email {future_to_index[future]+1}: EXCEPTION - {str(e)}")
+                write_log(f"WARNING: Could not catch up shared refresh status, prefetching for this batch: {e}")
+    if not FORCE_RESEND and refresh_lookup is None:
+        try:
+            t0 = time.perf_counter()
+            with db_session() as conn:
+                if args.follow:
+                    # High-water mark first: refreshes landing during the prefetch are tailed, not lost
+                    follow_from_id = db_max_event_id(conn)
+                refresh_lookup = db_prefetch_refresh_status(conn, all_paths, EMAIL_RUN_DATE)
+            write_log(f"Refresh status prefetched: {len(all_paths)} paths, {len(refresh_lookup)} refreshed ({time.perf_counter() - t0:.2f}s)")
+        except Exception as e:
+            write_log(f"WARNING: Refresh status prefetch failed, falling back to per-file queries: {e}")
+    
+    # Stat every attachment once: one listing per folder, folders in parallel
+    stat_cache = StatCache(CONFIG["STAT_WORKERS"])
+    t0 = time.perf_counter()
+    stat_cache.prefetch(p for atts in row_atts.values() for p in atts)
+    write_log(f"Attachment stats: {stat_cache.stats['files']} files in {stat_cache.stats['dirs']} folders, "
+              f"{stat_cache.stats['missing']} missing ({time.perf_counter() - t0:.2f}s)")
+    # Rows whose files may have changed since (released by follow mode, retried): stat again at dispatch
+    restat: set[int] = {idx for _, idx, _ in retry_heap}
+
+    # Load "already emailed" keys for this rundate + batch once (None = workers query per row)
+    emailed_keys = None
+    if not FORCE_RESEND:
+        EMAILED_REFRESH_S = args.emailed_refresh_s if args.emailed_refresh_s is not None else CONFIG["EMAILED_KEYS_REFRESH_S"]
+        try:
+            emailed_keys = EmailedKeySet(EMAIL_RUN_DATE, BATCH, EMAILED_REFRESH_S)
+            with db_session() as conn:
+                emailed_keys.load(conn)
+            write_log(f"Already-emailed keys loaded: {len(emailed_keys)} (refresh every {EMAILED_REFRESH_S}s)")
+        except Exception as e:
+            emailed_keys = None
+            write_log(f"WARNING: Could not load already-emailed keys, falling back to per-row queries: {e}")
+
+    # email_claims retention: one key per email ever sent otherwise
+    if CONFIG["CLAIM_KEEP_DAYS"] > 0 and not DRY_RUN:
+        try:
+            with db_session() as conn:
+                if has_email_claims(conn):
+                    pruned = db_prune_email_claims(conn, CONFIG["CLAIM_KEEP_DAYS"])
+                    if pruned:
+                        write_log(f"Pruned {pruned} email claims older than {CONFIG['CLAIM_KEEP_DAYS']} days")
+        except Exception as e:
+            write_log(f"WARNING: Could not prune old email claims: {e}")
+
+    total_ok = total_fail = total_skip = total_retry = 0
+    # Rows rejected by pre-flight: events in one bulk write, before any send
+    for idx, status, error, to_norm, subject, atts in preflight.rejected:
+        event_writer.add(make_email_event(email_run_id, BATCH, EMAIL_RUN_DATE, MASTER_PATH, atts, to_norm, subject, status, error))
+        if status == "FAIL":
+            total_fail += 1
+            write_log(f"X Email {idx+1}: FAIL - {error}")
+        else:
+            total_skip += 1
+            write_log(f"- Email {idx+1}: SKIP - {error}")
+        if notify:
+            notify("row", {"index": idx, "status": status, "to_norm": to_norm, "error": error})
+    if preflight.rejected:
+        event_writer.flush()
+    owned = resources is None
+    if owned:
+        resources = SenderResources(MAX_PARALLEL, accounts, ENGINE, args.build_workers)
+    # Worker counters are cumulative per process; report this run's share
+    stats_before = merge_worker_stats(resources.worker_stats.values())
+    db_before = get_db_pool().snapshot()
+
+    # Process emails in parallel; keep a bounded window in flight so each row's
+    # duplicate check sees the keys of rows that finished before it was submitted
+    follower = None
+    if args.follow:
+        if refresh_lookup is None or follow_from_id is None:
+            write_log("WARNING: Follow mode needs the refresh status prefetch; sending all rows now")
+        else:
+            follow_minutes = args.follow_minutes if args.follow_minutes is not None else CONFIG["FOLLOW_DEADLINE_MIN"]
+            follower = RefreshFollower(refresh_lookup, EMAIL_RUN_DATE, REQUIRE_METHOD_EMAIL, follow_from_id,
+                                       CONFIG["FOLLOW_POLL_S"], follow_minutes * 60)
+            for row_data in email_rows:
+                follower.add(row_data, row_atts[row_data[1]])
+            restat.update(follower.waiting)
+            write_log(f"Follow mode: {len(follower.ready)} rows ready, {len(follower.waiting)} waiting for refresh "
+                      f"(events after id {follow_from_id}, poll {follower.poll_s:.0f}s, deadline {follow_minutes:g} min)")
+    pending_rows = iter(email_rows)
+    source_next = (lambda: next(pending_rows, None)) if follower is None else follower.next_row
+    coalescer = None
+    if COALESCE:
+        coalescer = RowCoalescer(
+            source_next,
+            lambda row_data: sum(st.size for st in stat_cache.get_many(row_atts[row_data[1]]).values() if st is not None),
+            CONFIG["COALESCE_MAX_ROWS"], CONFIG["COALESCE_MAX_BYTES"],
+        )
+
+    def next_group():
+        """Rows of the next message: a due retry first, else new rows (coalesced per recipient set)."""
+        if retry_heap and retry_heap[0][0] <= time.time():
+            return heapq.heappop(retry_heap)[2]
+        if coalescer is not None:
+            return coalescer.next_group()
+        row_data = source_next()
+        return None if row_data is None else [row_data]
+
+    def idle_s():
+        """Seconds until held-back rows (follow mode, retries) may be ready; None if there are none."""
+        waits = []
+        if follower is not None and follower.waiting:
+            waits.append(follower.wait_s())
+        if retry_heap:
+            waits.append(max(0.05, retry_heap[0][0] - time.time()))
+        return min(waits) if waits else None
+
+    max_attempts = max(1, int(CONFIG["SEND_RETRY_MAX_ATTEMPTS"]))
+    claim_waits: dict[str, float] = {}
+    in_flight = {}
+    max_in_flight = max(1, MAX_PARALLEL) * 2
+    pipeline = resources.executor if isinstance(resources.executor, PipelineEngine) else None
+    if pipeline is not None:
+        # Enough rows to keep every builder, the queue and every sender busy
+        max_in_flight = pipeline.build_workers + pipeline.queue_size + pipeline.send_workers
+        pipeline_before = pipeline.snapshot()
+        write_log(f"Pipeline: {pipeline.build_workers} build threads -> queue of {pipeline.queue_size} -> {pipeline.send_workers} SMTP senders")
+    controller = None
+    if ADAPTIVE:
+        # The pool has MAX_PARALLEL workers; the controller decides how many are busy
+        controller = ConcurrencyController(CONFIG["ADAPTIVE_MIN"], MAX_PARALLEL, CONFIG["ADAPTIVE_LATENCY_FACTOR"])
+        write_log(f"Adaptive concurrency: {controller.lo}..{controller.hi} rows in flight")
+    t_dispatch = time.perf_counter()
+    write_log(f"Start-up: imports {(_T_IMPORTED - _T_START) * 1000:.0f}ms, ready to dispatch {t_dispatch - t_origin:.2f}s after start")
+    first_result_s = None
+    executor = resources.executor
+    try:
+        while True:
+            if follower is not None:
+                follower.poll()
+            while len(in_flight) < (max_in_flight if controller is None else controller.limit):
+                members = next_group()
+                if members is None:
+                    break
+                for row, idx in members:
+                    if idx in restat:
+                        restat.discard(idx)
+                        stat_cache.forget(row_atts[idx])
+                atts = [p for _, idx in members for p in row_atts[idx]]
+                already_emailed = None
+                if emailed_keys is not None:
+                    emailed_keys.maybe_refresh()
+                    already_emailed = [row_key(row, idx) in emailed_keys for row, idx in members]
+                future = executor.submit(
+                    process_single_email if len(members) == 1 else process_email_group,
+                    members[0] if len(members) == 1 else members,
+                    CONFIG,
+                    email_run_id,
+                    BATCH,
+                    EMAIL_RUN_DATE,
+                    MASTER_PATH,
+                    REQUIRE_METHOD_EMAIL,
+                    DRY_RUN,
+                    FALLBACK_HOURS,
+                    FORCE_RESEND,
+                    None if refresh_lookup is None else {
+                        refresh_key(p): refresh_lookup[refresh_key(p)]
+                        for p in atts if refresh_key(p) in refresh_lookup
+                    },
+                    already_emailed if already_emailed is None or len(members) > 1 else already_emailed[0],
+                    stat_cache.get_many(atts),
+                )
+                in_flight[future] = members
+                if outbox is not None:
+                    for row, idx in members:
+                        key = outbox_key(row_key(row, idx))
+                        outbox.mark(email_run_id, key, idx, "PENDING", send_attempts.get(key, 0))
+            pause = idle_s()
+            if not in_flight:
+                if pause is None:
+                    break
+                time.sleep(min(pause, event_writer.flush_interval_s))
+                event_writer.maybe_flush()
+                continue
+
+            # Process results as they complete
+            timeout = event_writer.flush_interval_s if pause is None else min(pause, event_writer.flush_interval_s)
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            event_writer.maybe_flush()
+            for future in done:
+                members = in_flight.pop(future)
+                if first_result_s is None:
+                    first_result_s = time.perf_counter() - t_dispatch
+                handled = set()
+                try:
+                    result = future.result()
+                    resources.worker_stats[result['worker']] = result['stats']
+                    results = result.get('members', [result])
+                    if controller is not None:
+                        # One SMTP transaction per message, however many rows it carries
+                        sent = next((r for r in results if 'send_s' in r), results[0])
+                        controller.record(sent.get('send_s') if sent['status'] == 'OK' else None, bool(sent.get('throttled')))
+                    rows_by_index = {idx: row for row, idx in members}
+                    retry_rows = []
+                    retry_at = 0.0
+                    for result in results:
+                        idx = result['index']
+                        row = rows_by_index[idx]
+                        handled.add(idx)
+                        key = outbox_key(row_key(row, idx))
+                        # Someone else holds the claim: not a send attempt; wait until they finish
+                        # or the claim goes stale (CLAIM_STALE_S), when it is taken over
+                        claim_wait = False
+                        if result.get('claim_pending'):
+                            since = claim_waits.setdefault(key, time.time())
+                            claim_wait = time.time() - since < CONFIG["CLAIM_STALE_S"] + CONFIG["SEND_RETRY_MAX_S"]
+                        attempts = send_attempts.get(key, 0) + (0 if claim_wait else 1)
+                        send_attempts[key] = attempts
+                        # Transient send failure: back off and try again; the FAIL event is only written once retries run out
+                        if result['status'] == 'FAIL' and result.get('retry_after') is not None and (claim_wait or attempts < max_attempts):
+                            delay = retry_delay(max(1, attempts), result['retry_after'], CONFIG["SEND_RETRY_BASE_S"], CONFIG["SEND_RETRY_MAX_S"])
+                            retry_rows.append((row, idx))
+                            retry_at = max(retry_at, time.time() + delay)
+                            restat.add(idx)
+                            if outbox is not None:
+                                outbox.mark(email_run_id, key, idx, "RETRY", attempts, time.time() + delay, result['error'])
+                            total_retry += 1
+                            if claim_wait:
+                                write_log(f"~ Email {result['index']+1}: WAIT in {delay:.0f}s - {result['error']}")
+                            else:
+                                write_log(f"~ Email {result['index']+1}: RETRY {attempts}/{max_attempts - 1} in {delay:.0f}s - {result['error']}")
+                            continue
+                        if outbox is not None:
+                            outbox.mark(email_run_id, key, idx, result['status'], attempts, None, result.get('error'))
+                        if result.get('event'):
+                            event_writer.add(result['event'])
+                        if result['status'] == 'OK':
+                            total_ok += 1
+                            if emailed_keys is not None:
+                                emailed_keys.add(row_key(row, idx))
+                            via = f" (via {result['sender']})" if len(accounts.accounts) > 1 else ""
+                            write_log(f"Email {result['index']+1}: OK - To: {result['to_norm']}{via}")
+                        elif result['status'] == 'FAIL':
+                            total_fail += 1
+                            write_log(f"X Email {result['index']+1}: FAIL - {result['error']}")
+                        elif result['status'] == 'SKIP':
+                            total_skip += 1
+                            write_log(f"- Email {result['index']+1}: SKIP - {result['error']}")
+
+                        if notify:
+                            notify("row", {k: result.get(k) for k in ("index", "status", "to_norm", "error")})
+                    if retry_rows:
+                        # Rows of one message are retried together
+                        heapq.heappush(retry_heap, (retry_at, retry_rows[0][1], retry_rows))
+
+                except Exception as e:
+                    for _, idx in members:
+                        if idx in handled:
+                            continue
+                        total_fail += 1
+                        write_log(f"X Email {idx+1}: EXCEPTION - {str(e)}")
+                    if isinstance(e, BrokenProcessPool):
+                        resources.broken = True
+    finally:
+        if owned:
+            resources.close()
+        if outbox is not None:
+            outbox.close()
+
+    # All events must be in the DB before the export
+    event_writer.close()
 
     # Export this email run to CSV (IST timestamps)
     try:
-        # Reconnect to export CSV (main process connection)
-        conn = db_connect()
-        export_email_csv(conn, email_run_id, email_csv_out)
+        with db_session() as conn:
+            export_email_csv(conn, email_run_id, email_csv_out)
         write_log(f"Email CSV exported: {email_csv_out}")
-        conn.close()
     except Exception as e:
         write_log(f"WARNING: CSV export failed: {e}")
 
+    run_stats = diff_worker_stats(merge_worker_stats(resources.worker_stats.values()), stats_before)
+    write_log(f"SMTP sessions: {format_stats(run_stats.get('smtp', {}))}")
+    # thread / pipeline engines: main's pool is the workers' pool, already in run_stats
+    db_main = {} if os.getpid() in resources.worker_stats else diff_worker_stats({"db": get_db_pool().snapshot()}, {"db": db_before})
+    db_stats = merge_worker_stats([run_stats, db_main]).get("db", {})
+    write_log(f"DB connections (main + workers): {format_stats(db_stats)}")
+    write_log(f"Attachment stats: {format_stats(stat_cache.stats)}")
+    write_log(f"Attachment cache: {format_stats(run_stats.get('attachments', {}))}")
+    write_log(f"Size policy: {format_stats(run_stats.get('size_policy', {}))}")
+    if CONFIG["CONTENT_DEDUPE"] != "off":
+        write_log(f"Content dedupe: {format_stats(run_stats.get('content', {}))}")
+    if coalescer is not None:
+        write_log(f"Coalescing: {format_stats(coalescer.stats)}")
+    if pipeline is not None:
+        write_log(f"Pipeline: {pipeline.describe(pipeline_before)}")
+    write_log(f"Event writer: {format_stats(event_writer.stats)}")
+    if follower is not None:
+        write_log(f"Follow: {format_stats(follower.stats)}")
+    write_log(f"Rate limiter (sent in last 24h/quota): {accounts.describe()}")
+    worker_startup = run_stats.get("startup", {})
+    write_log(
+        f"Start-up: main imports={(_T_IMPORTED - _T_START) * 1000:.0f}ms "
+        f"dispatch_at={t_dispatch - t_origin:.2f}s "
+        f"pool_warmup={'n/a' if first_result_s is None else f'{first_result_s:.2f}s'} "
+        f"worker_imports_avg={worker_startup.get('import_ms', 0) // max(1, worker_startup.get('processes', 0))}ms"
+    )
+    if controller is not None:
+        write_log(f"Concurrency: {controller.describe()}")
+    if total_retry:
+        write_log(f"Send retries: {total_retry}")
     write_log(f"Summary: OK={total_ok} FAIL={total_fail} SKIP={total_skip}")
+    if notify:
+        notify("summary", {"ok": total_ok, "fail": total_fail, "skip": total_skip})
     return 0 if total_fail == 0 else 1
 
+def run_batches(args, resources=None, notify=None, cwd=None) -> int:
+    """
+    Every (batch, Email_List) pair of the invocation, one after another, on one set
+    of warm resources: worker pool (SMTP sessions, DB pools, attachment caches),
+    sender accounts, parsed lists and a refresh-status prefetch covering all lists.
+    Each batch keeps its own run_id and CSV. Returns the worst exit code.
+    """
+    try:
+        jobs = batch_jobs(args, cwd)
+    except (OSError, ValueError) as e:
+        write_log(f"ERROR: Could not read batch map: {e}")
+        return 2
+    if not jobs:
+        write_log("ERROR: No batches to run")
+        return 2
+    job_args = [argparse.Namespace(**{**vars(args), "batch": b, "email_list": str(p)}) for b, p in jobs]
+    if len(job_args) == 1:
+        return run_batch(job_args[0], resources, notify)
+
+    owned = resources is None
+    if owned:
+        resources = sender_resources(args)
+    write_log(f"Batches this run: {', '.join(str(b) for b, _ in jobs)} (shared workers, sessions and refresh status)")
+    try:
+        refresh = None
+        force_resend = args.force_resend if args.force_resend is not None else CONFIG["FORCE_RESEND"]
+        if not force_resend:
+            # Attachments of every list, prefetched in one pass; each batch then only tails what is new
+            all_paths = set()
+            reader = args.list_reader or CONFIG["LIST_READER"]
+            for _, list_path in jobs:
+                try:
+                    columns, rows, _ = load_email_list_for_run(
+                        list_path, reader, CONFIG["LIST_CACHE"] and not args.no_list_cache, resources.lists)
+                except Exception as e:
+                    write_log(f"WARNING: Could not read {list_path} for the shared prefetch: {e}")
+                    continue
+                for values in rows:
+                    all_paths.update(str(p) for p in split_attachments(cell_str(dict(zip(columns, values)), "Attachement Path")))
+            try:
+                t0 = time.perf_counter()
+                refresh = SharedRefreshStatus(date.fromisoformat(args.email_date) if args.email_date else date.today())
+                refresh.prefetch(all_paths)
+                write_log(f"Refresh status prefetched for all batches: {len(all_paths)} paths, "
+                          f"{len(refresh.lookup)} refreshed ({time.perf_counter() - t0:.2f}s)")
+            except Exception as e:
+                refresh = None
+                write_log(f"WARNING: Shared refresh status prefetch failed, each batch prefetches its own: {e}")
+
+        codes = []
+        for job in job_args:
+            write_log(f"==== Batch {job.batch} ====")
+            resources.restart_if_broken()
+            try:
+                codes.append(run_batch(job, resources, notify, refresh))
+            except Exception as e:
+                write_log(f"ERROR: Batch {job.batch} failed: {type(e).__name__}: {e}")
+                resources.broken = resources.broken or isinstance(e, BrokenProcessPool)
+                codes.append(1)
+        write_log("Batches done: " + ", ".join(f"{job.batch}=exit {code}" for job, code in zip(job_args, codes)))
+        return max(codes)
+    finally:
+        if owned:
+            resources.close()
+
+def main():
+    args = parse_arguments()
+    if args.serve:
+        return serve(args)
+    if args.daemon:
+        argv = [a for a in sys.argv[1:] if a != "--daemon"]
+        rc = submit_to_daemon(argv)
+        if rc is not None:
+            return rc
+        write_log(f"No resident sender on {CONFIG['DAEMON_ADDR']}; running the job here")
+    return run_batches(args)
+
 
 if __name__ == "__main__":
     raise SystemExit(main())
\ No newline at end of file
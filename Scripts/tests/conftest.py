@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The scripts import each other as top-level modules (path_keys, send_reports_configured)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture(autouse=True)
+def local_dirs(tmp_path, monkeypatch):
+    """Log and state files of the code under test go to the test's own folder; no reachable DB."""
+    import send_reports_configured as m
+    monkeypatch.setitem(m.CONFIG, "LOG_DIR", str(tmp_path / "log"))
+    monkeypatch.setattr(m, "LOG_FILE_PATH", str(tmp_path / "log" / m.LOG_FILE_NAME))
+    monkeypatch.setitem(m.CONFIG, "STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setenv("REPORTLOGS_CONN", "Server=127.0.0.1;Port=9;Database=reportlogs;Uid=test;Pwd=test")
+    # Inherited by worker processes, which read CONFIG before it is handed to them
+    monkeypatch.setenv("REPORTLOGS_LOG_DIR", str(tmp_path / "log"))
+    monkeypatch.setenv("REPORTLOGS_STATE_DIR", str(tmp_path / "state"))
+
+
+@pytest.fixture
+def smtp_stub(monkeypatch):
+    """A local SmtpStub with CONFIG pointed at it (STARTTLS, no rate limit)."""
+    import send_reports_configured as m
+    from smtp_stub import SmtpStub
+    stub = SmtpStub()
+    monkeypatch.setitem(m.CONFIG, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setitem(m.CONFIG, "SMTP_PORT_STARTTLS", stub.port)
+    monkeypatch.setitem(m.CONFIG, "USE_SSL", False)
+    monkeypatch.setitem(m.CONFIG, "SEND_RATE_PER_SEC", 0)
+    monkeypatch.setitem(m.CONFIG, "SENDER_ACCOUNTS", [])
+    yield stub
+    m._close_smtp_pools()
+    m._SMTP_POOLS.clear()
+    stub.close()
+
+
+@pytest.fixture
+def email_list(tmp_path):
+    """write(rows) -> path of an Email_List workbook; rows are dicts of List columns."""
+    from openpyxl import Workbook
+    columns = ["Receiver", "CC", "BCC", "Subject", "Attachement Path"]
+
+    def write(rows, name="Email_List.xlsx"):
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "List"
+        ws.append(columns)
+        for row in rows:
+            ws.append([row.get(c, "") for c in columns])
+        path = tmp_path / name
+        wb.save(path)
+        return path
+
+    return write
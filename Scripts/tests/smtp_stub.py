@@ -0,0 +1,116 @@
+"""
+Local SMTP server for tests: STARTTLS (self-signed keycert.pem; smtplib does not
+verify it), any AUTH accepted, every message kept in memory. Replies can be
+scripted per command, e.g. stub.script("MAIL", "451 4.7.0 Try again in 1 seconds").
+Runs in the test process; worker processes of the process engine reach it over TCP.
+"""
+
+import socketserver
+import ssl
+import threading
+from pathlib import Path
+
+KEYCERT = Path(__file__).with_name("keycert.pem")
+
+
+class SmtpStub:
+    def __init__(self):
+        self.messages: list[dict] = []      # {"from", "to", "data", "conn"}
+        self.commands: list[tuple] = []     # (connection number, command verb)
+        self.connections = 0
+        self._scripted: dict[str, list[str]] = {}
+        self._lock = threading.Lock()
+        self._tls = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self._tls.load_cert_chain(KEYCERT)
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                with stub._lock:
+                    stub.connections += 1
+                    conn_no = stub.connections
+                stub._session(self, conn_no)
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def script(self, verb: str, *replies: str):
+        """Answer the next len(replies) `verb` commands with these replies instead of the default."""
+        with self._lock:
+            self._scripted.setdefault(verb.upper(), []).extend(replies)
+
+    def verbs(self, conn_no: int | None = None) -> list[str]:
+        with self._lock:
+            return [verb for n, verb in self.commands if conn_no is None or n == conn_no]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _reply(self, verb: str, default: str) -> str:
+        with self._lock:
+            queued = self._scripted.get(verb)
+            return queued.pop(0) if queued else default
+
+    def _session(self, handler, conn_no: int):
+        rfile, wfile = handler.rfile, handler.wfile
+
+        def send(line: str):
+            wfile.write((line + "\r\n").encode("ascii"))
+            wfile.flush()
+
+        send("220 stub ESMTP")
+        mail_from, rcpts = None, []
+        while True:
+            line = rfile.readline()
+            if not line:
+                return
+            text = line.decode("utf-8", "replace").strip()
+            verb = text.split(" ", 1)[0].upper()
+            with self._lock:
+                self.commands.append((conn_no, verb))
+            if verb in ("EHLO", "HELO"):
+                send("250-stub")
+                send("250-STARTTLS")
+                send("250-AUTH PLAIN LOGIN")
+                send("250 SIZE 100000000")
+            elif verb == "STARTTLS":
+                send("220 ready")
+                sock = self._tls.wrap_socket(handler.request, server_side=True)
+                rfile, wfile = sock.makefile("rb"), sock.makefile("wb")
+            elif verb == "AUTH":
+                send(self._reply(verb, "235 ok"))
+            elif verb == "MAIL":
+                reply = self._reply(verb, "250 ok")
+                if reply.startswith("250"):
+                    mail_from, rcpts = text.split(":", 1)[1].strip().split(" ")[0].strip("<>"), []
+                send(reply)
+            elif verb == "RCPT":
+                rcpts.append(text.split(":", 1)[1].strip().strip("<>"))
+                send(self._reply(verb, "250 ok"))
+            elif verb == "DATA":
+                send("354 go ahead")
+                data = []
+                while True:
+                    chunk = rfile.readline()
+                    if not chunk or chunk == b".\r\n":
+                        break
+                    data.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                reply = self._reply(verb, "250 queued")
+                if reply.startswith("250"):
+                    with self._lock:
+                        self.messages.append({"from": mail_from, "to": rcpts, "data": b"".join(data), "conn": conn_no})
+                send(reply)
+                if reply.startswith("421"):
+                    return
+            elif verb == "QUIT":
+                send("221 bye")
+                return
+            else:
+                # RSET, NOOP
+                send(self._reply(verb, "250 ok"))
@@ -0,0 +1,64 @@
+import base64
+
+import send_reports_configured as m
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return path
+
+
+def test_same_file_reuses_the_encoded_part(tmp_path):
+    report = write(tmp_path / "r.csv", b"a,b\n" * 50)
+    cache = m.AttachmentCache(1 << 20)
+
+    part = cache.get_part(report)
+    assert cache.get_part(report) is part
+    assert base64.b64decode(part.get_payload()) == report.read_bytes()
+    assert part.get_filename() == "r.csv"
+    assert cache.stats == {"hits": 1, "misses": 1, "evictions": 0, "bytes_read": 200, "bytes_saved": 200}
+
+
+def test_rewritten_file_is_read_again(tmp_path):
+    report = write(tmp_path / "r.csv", b"old\n")
+    cache = m.AttachmentCache(1 << 20)
+    first = cache.get_part(report)
+    st = report.stat()
+    write(report, b"new!\n")
+    m.os.utime(report, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    second = cache.get_part(report)
+    assert second is not first
+    assert base64.b64decode(second.get_payload()) == b"new!\n"
+
+
+def test_zip_and_plain_parts_are_cached_apart(tmp_path):
+    report = write(tmp_path / "r.csv", b"x,y,z\n" * 2000)
+    cache = m.AttachmentCache(1 << 20)
+    plain, plain_size = cache.get_part_sized(report)
+    zipped, zipped_size = cache.get_part_sized(report, zipped=True)
+    assert zipped.get_filename() == "r.csv.zip"
+    assert plain_size == 12000 and 0 < zipped_size < plain_size
+    assert cache.get_part_sized(report, zipped=True) == (zipped, zipped_size)
+
+
+def test_least_recently_used_parts_are_evicted(tmp_path):
+    files = [write(tmp_path / f"r{i}.bin", bytes([i]) * 600) for i in range(3)]
+    cache = m.AttachmentCache(2000)  # two encoded parts (~800 bytes each) fit
+
+    cache.get_part(files[0])
+    cache.get_part(files[1])
+    cache.get_part(files[0])  # r0 now most recent
+    cache.get_part(files[2])  # evicts r1
+    assert cache.stats["evictions"] == 1
+
+    cache.get_part(files[0])
+    cache.get_part(files[1])
+    assert (cache.stats["hits"], cache.stats["misses"]) == (2, 4)
+
+
+def test_part_larger_than_the_cache_is_not_kept(tmp_path):
+    report = write(tmp_path / "big.bin", b"\0" * 3000)
+    cache = m.AttachmentCache(1000)
+    assert cache.get_part(report) is not cache.get_part(report)
+    assert cache.stats["hits"] == 0
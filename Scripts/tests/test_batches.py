@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+
+import pytest
+
+import send_reports_configured as m
+
+
+class NoDbConn:
+    def cursor(self):
+        raise OSError("no DB in tests")
+
+
+@pytest.fixture
+def exports(monkeypatch):
+    """CSV exports of the run as (run_id, path); the CSV file is written empty."""
+    done = []
+
+    @contextmanager
+    def session():
+        yield NoDbConn()
+
+    def export(conn, run_id, out_csv_path):
+        out_csv_path.parent.mkdir(parents=True, exist_ok=True)
+        out_csv_path.write_text("")
+        done.append((run_id, out_csv_path))
+
+    monkeypatch.setattr(m, "db_session", session)
+    monkeypatch.setattr(m, "export_email_csv", export)
+    return done
+
+
+def test_batch_map_runs_each_batch_with_its_own_run_id_and_csv(smtp_stub, email_list, exports, tmp_path):
+    email_list([{"Receiver": "a@x.com", "Subject": "S1"}, {"Receiver": "b@x.com", "Subject": "S2"}], "List3.xlsx")
+    email_list([{"Receiver": "c@x.com", "Subject": "S3"}], "List5.xlsx")
+    (tmp_path / "batches.txt").write_text("# batch,list\n3,List3.xlsx\n\n5,\"List5.xlsx\"\n", encoding="utf-8")
+
+    args = m.parse_arguments(["--batch-map", str(tmp_path / "batches.txt"), "--engine", "thread", "--force-resend"])
+    assert m.run_batches(args) == 0
+
+    day = f"{m.date.today():%Y-%m-%d}"
+    log_dir = m.Path(m.CONFIG["LOG_DIR"])
+    assert exports == [(f"email-log_{day}_Batch-3", log_dir / f"email-log_{day}_Batch-3.csv"),
+                       (f"email-log_{day}_Batch-5", log_dir / f"email-log_{day}_Batch-5.csv")]
+    assert sorted(msg["to"][0] for msg in smtp_stub.messages) == ["a@x.com", "b@x.com", "c@x.com"]
+    assert smtp_stub.connections == 1  # the SMTP session outlives the first batch
+    log = m.Path(m.LOG_FILE_PATH).read_text(encoding="utf-8")
+    assert "==== Batch 3 ====" in log and "==== Batch 5 ====" in log
+    assert "Batches done: 3=exit 0, 5=exit 0" in log
+
+
+def test_cli_pairs_come_before_map_lines(tmp_path):
+    (tmp_path / "map.txt").write_text("2,lists/B.xlsx\n", encoding="utf-8")
+    args = m.parse_arguments(["--batch", "1", "--email-list", "A.xlsx", "--batch-map", "map.txt"])
+    assert m.batch_jobs(args, str(tmp_path)) == [(1, tmp_path / "A.xlsx"), (2, tmp_path / "lists" / "B.xlsx")]
+
+
+def test_bad_map_line_stops_the_run(tmp_path, exports):
+    (tmp_path / "map.txt").write_text("1,A.xlsx\nx,B.xlsx\n", encoding="utf-8")
+    assert m.run_batches(m.parse_arguments(["--batch-map", str(tmp_path / "map.txt")])) == 2
+    assert exports == []
+    assert "expected '<batch>,<Email_List path>'" in m.Path(m.LOG_FILE_PATH).read_text(encoding="utf-8")
+
+
+def test_one_email_list_per_batch_is_required():
+    with pytest.raises(SystemExit):
+        m.parse_arguments(["--batch", "1", "--batch", "2", "--email-list", "A.xlsx"])
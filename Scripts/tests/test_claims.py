@@ -0,0 +1,158 @@
+import ctypes
+import os
+import socket
+import subprocess
+import sys
+from datetime import date
+
+import pytest
+
+import send_reports_configured as m
+
+
+def owner(pid):
+    return f"{socket.gethostname()}:{pid}"
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+class FakeCursor:
+    """email_claims as one row: INSERT IGNORE / stale-or-FAIL takeover / SELECT / owner takeover."""
+
+    def __init__(self, claim):
+        self.claim = claim  # None or [status, owner, stale]
+        self.rowcount = 0
+        self.updates = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params=()):
+        verb = sql.split()[0]
+        self.rowcount = 0
+        if verb == "INSERT":
+            if self.claim is None:
+                self.claim = ["PENDING", params[3], False]
+                self.rowcount = 1
+        elif verb == "UPDATE" and "INTERVAL" in sql:
+            if self.claim[0] == "FAIL" or (self.claim[0] == "PENDING" and self.claim[2]):
+                self.claim = ["PENDING", params[0], False]
+                self.rowcount = 1
+        elif verb == "UPDATE":
+            new_owner, _, old_owner = params
+            if self.claim[0] == "PENDING" and self.claim[1] == old_owner:
+                self.claim[1] = new_owner
+                self.rowcount = 1
+
+    def fetchone(self):
+        return (self.claim[0], self.claim[1]) if self.claim else None
+
+
+class FakeConn:
+    def __init__(self, claim=None):
+        self.cur = FakeCursor(claim)
+
+    def cursor(self):
+        return self.cur
+
+
+def claim(conn, resume=False):
+    return m.db_claim_email(conn, "k" * 40, date(2026, 1, 2), "7", "me:1", 900, resume)
+
+
+def test_new_fail_and_stale_claims_are_taken():
+    assert claim(FakeConn()) is None
+    assert claim(FakeConn(["FAIL", "x:1", False])) is None
+    assert claim(FakeConn(["PENDING", "x:1", True])) is None
+
+
+def test_ok_and_live_pending_claims_are_held():
+    assert claim(FakeConn(["OK", "x:1", False])) == "OK"
+    assert claim(FakeConn(["PENDING", owner(os.getpid()), False]), resume=True) == "PENDING"
+
+
+def test_resume_takes_over_a_dead_owner_only_when_resuming():
+    dead = owner(dead_pid())
+    assert claim(FakeConn(["PENDING", dead, False])) == "PENDING"
+    conn = FakeConn(["PENDING", dead, False])
+    assert claim(conn, resume=True) is None
+    assert conn.cur.claim[1] == "me:1"
+
+
+def test_owner_dead():
+    assert not m._owner_dead(owner(os.getpid()))
+    assert m._owner_dead(owner(dead_pid()))
+    assert not m._owner_dead("some-other-host:1")
+    assert not m._owner_dead("garbage")
+
+
+class FakeKernel32:
+    def __init__(self, handle, last_error=0, exit_code=259):
+        self.handle, self.last_error, self.exit_code = handle, last_error, exit_code
+        self.closed = False
+
+    def OpenProcess(self, access, inherit, pid):
+        return self.handle
+
+    def GetLastError(self):
+        return self.last_error
+
+    def GetExitCodeProcess(self, handle, code_ref):
+        code_ref._obj.value = self.exit_code
+        return 1
+
+    def CloseHandle(self, handle):
+        self.closed = True
+
+
+@pytest.mark.parametrize("kernel32, alive", [
+    (FakeKernel32(handle=0, last_error=87), False),     # no such process
+    (FakeKernel32(handle=0, last_error=5), True),       # access denied: it exists
+    (FakeKernel32(handle=42, exit_code=259), True),     # STILL_ACTIVE
+    (FakeKernel32(handle=42, exit_code=1), False),      # exited
+])
+def test_pid_alive_on_windows_reads_the_exit_code(monkeypatch, kernel32, alive):
+    monkeypatch.setattr(m.os, "name", "nt")
+    monkeypatch.setattr(ctypes, "windll", type("windll", (), {"kernel32": kernel32}), raising=False)
+    monkeypatch.setattr(m.os, "kill", lambda *a: pytest.fail("os.kill must not be used on Windows"))
+    assert m._pid_alive(1234) is alive
+    assert kernel32.closed == bool(kernel32.handle)
+
+
+class PruneCursor:
+    """email_claims as a list of rundates; DELETE ... WHERE rundate < %s LIMIT %s."""
+
+    def __init__(self, rundates):
+        self.rundates = list(rundates)
+        self.deletes = 0
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params):
+        cutoff, limit = params
+        old = [d for d in self.rundates if d < cutoff][:limit]
+        for d in old:
+            self.rundates.remove(d)
+        self.rowcount = len(old)
+        self.deletes += 1
+
+
+def test_prune_deletes_old_rundates_in_chunks():
+    today = date.today()
+    cur = PruneCursor([today - m.timedelta(days=n) for n in (0, 29, 30, 31, 40, 400)])
+    conn = type("Conn", (), {"cursor": lambda self: cur})()
+    assert m.db_prune_email_claims(conn, 30, chunk=2) == 3
+    assert sorted(cur.rundates) == [today - m.timedelta(days=n) for n in (30, 29, 0)]
+    assert cur.deletes == 2  # 2 + 1 < chunk: done
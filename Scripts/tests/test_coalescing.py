@@ -0,0 +1,82 @@
+import send_reports_configured as m
+
+
+def row(to, subject, cc="", mode=""):
+    return {"Receiver": to, "CC": cc, "BCC": "", "Subject": subject, "Attach Mode": mode}
+
+
+def coalescer(rows, sizes=None, max_rows=10, max_bytes=10**9):
+    ready = iter([(r, i) for i, r in enumerate(rows)])
+    sizes = sizes or {}
+    return m.RowCoalescer(lambda: next(ready, None), lambda rd: sizes.get(rd[1], 0), max_rows, max_bytes)
+
+
+def groups(c):
+    out = []
+    while True:
+        group = c.next_group()
+        if group is None:
+            return out
+        out.append([idx for _, idx in group])
+
+
+def test_key_ignores_case_and_spacing_but_not_cc_or_mode():
+    assert m.coalesce_key(row("A@x.com; b@x.com", "s")) == m.coalesce_key(row("a@x.com,b@x.com", "t"))
+    assert m.coalesce_key(row("a@x.com", "s")) != m.coalesce_key(row("a@x.com", "s", cc="c@x.com"))
+    assert m.coalesce_key(row("a@x.com", "s")) != m.coalesce_key(row("a@x.com", "s", mode="zip"))
+
+
+def test_rows_group_by_recipients_in_list_order():
+    rows = [row("a@x.com", "S1"), row("b@x.com", "S2"), row("A@x.com", "S3"), row("b@x.com", "S4"), row("c@x.com", "S5")]
+    c = coalescer(rows)
+    assert groups(c) == [[0, 2], [1, 3], [4]]
+    assert c.stats == {"rows": 5, "messages": 3, "merged_rows": 4}
+
+
+def test_max_rows_cap_starts_a_new_message():
+    rows = [row("a@x.com", f"S{i}") for i in range(5)]
+    assert groups(coalescer(rows, max_rows=2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_max_bytes_cap_starts_a_new_message():
+    rows = [row("a@x.com", f"S{i}") for i in range(4)]
+    sizes = {0: 60, 1: 30, 2: 20, 3: 10}
+    assert groups(coalescer(rows, sizes, max_bytes=100)) == [[0, 1], [2, 3]]
+
+
+def test_oversized_row_still_goes_out_alone():
+    rows = [row("a@x.com", "S0"), row("a@x.com", "S1")]
+    assert groups(coalescer(rows, {0: 500, 1: 1}, max_bytes=100)) == [[0], [1]]
+
+
+def test_merged_subject():
+    assert m.merged_subject(["Sales", "Stock", "Sales"]) == "Sales; Stock"
+    long = [f"Report number {i} with a long descriptive title" for i in range(10)]
+    assert m.merged_subject(long) == f"{long[0]} (+9 more reports)"
+
+
+def stage_group(rows, config=None):
+    config = dict(m.CONFIG, **(config or {}))
+    staged = m.stage_email([(r, i) for i, r in enumerate(rows)], config, "run-1", "7", m.date(2026, 1, 2), "master.xlsx",
+                           False, True, True, None, None, None, group=True)
+    return {r["index"]: r for r in staged.deliver()["members"]}
+
+
+def test_one_unreadable_file_fails_only_its_row(tmp_path):
+    good = [tmp_path / "a.xlsx", tmp_path / "b.xlsx"]
+    for p in good:
+        p.write_bytes(b"report")
+    rows = [row("a@x.com", "S0"), row("a@x.com", "S1"), row("a@x.com", "S2")]
+    rows[0]["Attachement Path"] = str(good[0])
+    rows[1]["Attachement Path"] = str(tmp_path / "missing.xlsx")
+    rows[2]["Attachement Path"] = str(good[1])
+
+    results = stage_group(rows)
+
+    assert results[1]["status"] == "FAIL"
+    assert "FileNotFoundError" in results[1]["error"]
+    assert results[1]["event"]["status"] == "FAIL"
+    for i, other in ((0, "3"), (2, "1")):
+        assert (results[i]["status"], results[i]["error"]) == ("SKIP", "DRYRUN")
+        assert results[i]["event"]["method"] == "Email+Merged"
+        assert f"one message with rows {other}" in results[i]["event"]["error_text"]
@@ -0,0 +1,81 @@
+import smtplib
+
+import pytest
+
+import send_reports_configured as m
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controller time, advanced by hand: clock.now += seconds."""
+    class Clock:
+        now = 1000.0
+
+    monkeypatch.setattr(m.time, "monotonic", lambda: Clock.now)
+    return Clock
+
+
+def sends(ctl, n, latency=0.1):
+    for _ in range(n):
+        ctl.record(latency, False)
+
+
+def test_clean_sends_grow_the_limit_by_one_up_to_the_cap(clock):
+    ctl = m.ConcurrencyController(1, 4)
+    seen = []
+    for _ in range(10):
+        sends(ctl, 1)
+        seen.append(ctl.limit)
+    # +1 after `limit` clean sends in a row: 1 -> 2 after 1, -> 3 after 2 more, -> 4 after 3 more
+    assert seen == [2, 2, 3, 3, 3, 4, 4, 4, 4, 4]
+    assert ctl.stats["increases"] == 3
+    assert [n for _, n in ctl.timeline] == [1, 2, 3, 4]
+
+
+def test_throttle_halves_once_per_cooldown(clock):
+    ctl = m.ConcurrencyController(2, 16)
+    ctl.limit = 16
+    ctl.record(None, True)
+    ctl.record(None, True)  # in flight before the cut: same load, not cut again
+    assert ctl.limit == 8 and ctl.stats["throttle_cuts"] == 1
+
+    clock.now += 5
+    ctl.record(None, True)
+    clock.now += 5
+    ctl.record(None, True)
+    clock.now += 5
+    ctl.record(None, True)
+    assert ctl.limit == 2  # never below lo
+    assert ctl.stats["throttle_cuts"] == 4
+
+
+def test_rising_latency_steps_down_with_cooldown(clock):
+    ctl = m.ConcurrencyController(1, 8)
+    ctl.limit = 6
+    sends(ctl, 3, latency=0.1)
+    limit = ctl.limit
+    sends(ctl, 10, latency=1.0)
+    assert ctl.limit == limit - 1 and ctl.stats["latency_cuts"] == 1
+
+    clock.now += 5
+    sends(ctl, 1, latency=1.0)
+    assert ctl.limit == limit - 2 and ctl.stats["latency_cuts"] == 2
+
+
+def test_rows_that_never_reached_smtp_do_not_count(clock):
+    ctl = m.ConcurrencyController(1, 4)
+    for _ in range(5):
+        ctl.record(None, False)
+    assert ctl.limit == 1 and ctl.stats == {"increases": 0, "throttle_cuts": 0, "latency_cuts": 0}
+
+
+@pytest.mark.parametrize("exc, throttled", [
+    (smtplib.SMTPResponseException(421, b"Too many connections"), True),
+    (smtplib.SMTPDataError(454, b"Throttled"), True),
+    (smtplib.SMTPRecipientsRefused({"a@x.com": (452, b"Too many recipients")}), True),
+    (smtplib.SMTPDataError(550, b"Rejected"), False),
+    (smtplib.SMTPRecipientsRefused({"a@x.com": (550, b"No such user")}), False),
+    (TimeoutError(), False),
+])
+def test_is_throttle_error(exc, throttled):
+    assert m.is_throttle_error(exc) is throttled
@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[1]
+
+
+def config_dirs(env) -> list[str]:
+    out = subprocess.run(
+        [sys.executable, "-c", "import send_reports_configured as m; print(m.CONFIG['LOG_DIR']); print(m.CONFIG['STATE_DIR'])"],
+        cwd=SCRIPTS, env=env, capture_output=True, text=True, check=True,
+    )
+    return out.stdout.splitlines()
+
+
+def test_dirs_come_from_config_unless_overridden(tmp_path):
+    env = {k: v for k, v in os.environ.items() if not k.startswith("REPORTLOGS_")}
+    log_dir, state_dir = config_dirs(env)
+    assert log_dir.endswith(r"Project-Reporting-Automation\Logginfo")
+    assert state_dir.endswith(r"Project-Reporting-Automation\State")
+
+    env.update(REPORTLOGS_LOG_DIR=str(tmp_path / "log"), REPORTLOGS_STATE_DIR=str(tmp_path / "state"))
+    assert config_dirs(env) == [str(tmp_path / "log"), str(tmp_path / "state")]
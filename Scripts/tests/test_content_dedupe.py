@@ -0,0 +1,43 @@
+import os
+
+import send_reports_configured as m
+
+
+def store(tmp_path):
+    return m.ContentHashStore(tmp_path / "state" / "content_hashes.sqlite")
+
+
+def test_file_hash_is_reused_until_the_file_changes(tmp_path):
+    s = store(tmp_path)
+    f = tmp_path / "r.xlsx"
+    f.write_bytes(b"v1")
+    first = s.file_hash(f)
+    assert s.file_hash(f) == first
+    assert (s.stats["hashed"], s.stats["hash_hits"]) == (1, 1)
+
+    f.write_bytes(b"v2")
+    st = os.stat(f)
+    os.utime(f, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert s.file_hash(f) != first
+    assert s.stats["hashed"] == 2
+
+
+def test_set_hash_ignores_order_but_not_names_or_content(tmp_path):
+    s = store(tmp_path)
+    a, b, c = (tmp_path / n for n in ("a.txt", "b.txt", "c.txt"))
+    a.write_bytes(b"A")
+    b.write_bytes(b"B")
+    c.write_bytes(b"B")
+    assert s.set_hash([a, b]) == s.set_hash([b, a])
+    assert s.set_hash([a, b]) != s.set_hash([a, c])
+    assert s.set_hash([a]) != s.set_hash([a, b])
+
+
+def test_last_delivery_matches_set_recipients_and_window(tmp_path):
+    s = store(tmp_path)
+    s.record_delivery("A@x.com; b@x.com", "Daily Sales", "h1")
+    assert s.last_delivery("a@x.com, b@x.com", "daily sales", "h1", 3600) is not None
+    assert s.last_delivery("a@x.com, b@x.com", "daily sales", "h2", 3600) is None
+    assert s.last_delivery("c@x.com", "daily sales", "h1", 3600) is None
+    assert s.last_delivery("a@x.com, b@x.com", "daily sales", "h1", -1) is None
+    assert s.stats["unchanged"] == 1
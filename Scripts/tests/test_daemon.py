@@ -0,0 +1,81 @@
+import json
+import os
+import signal
+import socket
+import stat
+import threading
+import time
+
+import pytest
+
+import send_reports_configured as m
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def daemon(monkeypatch):
+    """serve() on a free loopback port in a thread; stopped through its SIGTERM handler."""
+    port = free_port()
+    monkeypatch.setitem(m.CONFIG, "DAEMON_ADDR", f"127.0.0.1:{port}")
+    monkeypatch.setitem(m.CONFIG, "DAEMON_TOKEN", "")
+    monkeypatch.setattr(m.multiprocessing, "set_start_method", lambda *a, **k: None)
+    handlers = {}
+    monkeypatch.setattr(m.signal, "signal", lambda sig, handler: handlers.__setitem__(sig, handler))
+    thread = threading.Thread(target=m.serve, args=(m.parse_arguments(["--serve", "--engine", "thread"]),), daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            assert time.time() < deadline, "resident sender did not start"
+            time.sleep(0.05)
+    yield port
+    handlers[signal.SIGTERM]()
+    thread.join(30)
+
+
+def submit(port, token, argv):
+    with socket.create_connection(("127.0.0.1", port), timeout=30) as sock, sock.makefile("rwb") as stream:
+        m._send_json_line(stream, {"argv": argv, "cwd": os.getcwd(), "token": token})
+        return [json.loads(line) for line in stream]
+
+
+def test_wrong_or_missing_token_is_rejected(daemon):
+    for token in ("wrong", "", None):
+        replies = submit(daemon, token, ["--batch", "1", "--email-list", "nope.xlsx"])
+        assert replies == [{"type": "log", "line": "ERROR: sender daemon token mismatch"}, {"type": "exit", "code": 2}]
+
+
+def test_generated_token_is_private_and_accepted(daemon, tmp_path):
+    path = tmp_path / "state" / "daemon.token"
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+    replies = submit(daemon, m._daemon_token(), ["--batch", "1", "--email-list", str(tmp_path / "missing.xlsx")])
+    assert replies[-1]["type"] == "exit"
+    assert not any("token mismatch" in r.get("line", "") for r in replies)
+    assert any(r["type"] == "log" and "missing.xlsx" in r["line"] for r in replies)
+
+
+def test_non_loopback_address_needs_an_explicit_token(monkeypatch):
+    monkeypatch.setitem(m.CONFIG, "DAEMON_ADDR", "10.1.2.3:8765")
+    monkeypatch.setitem(m.CONFIG, "DAEMON_TOKEN", "")
+    assert m.serve(m.parse_arguments(["--serve"])) == 2
+
+
+def test_windows_token_file_gets_an_owner_only_acl(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(m.subprocess, "run", lambda cmd, **kw: calls.append((cmd, kw)))
+    monkeypatch.setenv("USERDOMAIN", "KAPL")
+    monkeypatch.setattr("getpass.getuser", lambda: "reports")
+    path = tmp_path / "daemon.token"
+    path.write_text("")
+    monkeypatch.setattr(m.os, "name", "nt")
+    m._restrict_to_owner(path)
+    monkeypatch.undo()
+    assert calls == [(["icacls", str(path), "/inheritance:r", "/grant:r", "KAPL\\reports:F"], {"check": True, "capture_output": True})]
@@ -0,0 +1,24 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import db_conn
+
+SCRIPTS = Path(__file__).resolve().parents[1]
+
+
+def test_parse_conn_env(monkeypatch):
+    monkeypatch.setenv("REPORTLOGS_CONN", "Server=db1; Port=3307;Database=logs;Uid=rep;Pwd=a=b;SslMode=None")
+    assert db_conn.parse_conn_env() == dict(host="db1", port=3307, user="rep", password="a=b", database="logs",
+                                            charset="utf8mb4", autocommit=True)
+    monkeypatch.setenv("REPORTLOGS_CONN", "Server=db1;SslMode=Required")
+    params = db_conn.parse_conn_env()
+    assert (params["port"], params["user"], params["ssl"]) == (3306, "root", {})
+
+
+def test_migration_does_not_import_the_sender():
+    out = subprocess.run(
+        [sys.executable, "-c", "import sys, migrate_events_schema; print('send_reports_configured' in sys.modules)"],
+        cwd=SCRIPTS, capture_output=True, text=True, check=True,
+    )
+    assert out.stdout.strip() == "False"
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+import send_reports_configured as m
+
+
+class FakeDbConn:
+    def __init__(self, n):
+        self.n = n
+        self.alive = True
+        self.closed = False
+        self.pings = 0
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+        if not self.alive:
+            raise OSError("gone away")
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    conns = []
+
+    def connect():
+        conns.append(FakeDbConn(len(conns)))
+        return conns[-1]
+
+    monkeypatch.setattr(m, "db_connect", connect)
+    return conns
+
+
+def test_connection_is_reused_without_ping_while_fresh(opened):
+    pool = m.DbPool(max_size=2, ping_idle_s=60)
+    for _ in range(3):
+        with pool.connection() as conn:
+            assert conn is opened[0]
+    assert pool.snapshot() == {"opened": 1, "reused": 2, "pings": 0, "dropped": 0}
+    assert opened[0].pings == 0
+
+
+def test_idle_connection_is_pinged_and_replaced_when_dead(opened):
+    pool = m.DbPool(max_size=2, ping_idle_s=0)
+    with pool.connection():
+        pass
+    with pool.connection() as conn:
+        assert conn is opened[0] and conn.pings == 1
+    opened[0].alive = False
+    with pool.connection() as conn:
+        assert conn is opened[1]
+    assert opened[0].closed
+    assert pool.snapshot() == {"opened": 2, "reused": 1, "pings": 2, "dropped": 1}
+
+
+def test_connection_that_raised_is_closed_not_returned(opened):
+    pool = m.DbPool(max_size=2, ping_idle_s=60)
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError("query failed")
+    assert opened[0].closed
+    with pool.connection() as conn:
+        assert conn is opened[1]
+    assert pool.snapshot()["dropped"] == 1
+
+
+def test_pool_size_bounds_connections_in_use(opened):
+    pool = m.DbPool(max_size=2, ping_idle_s=60)
+    release = threading.Event()
+    in_use = []
+
+    def hold():
+        with pool.connection() as conn:
+            in_use.append(conn)
+            release.wait(10)
+
+    threads = [threading.Thread(target=hold) for _ in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    assert len(in_use) == 2  # the third caller waits for a slot
+    release.set()
+    for t in threads:
+        t.join(10)
+    assert len(in_use) == 3 and len(opened) == 2
+
+    pool.close_all()
+    assert all(conn.closed for conn in opened)
@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+from datetime import date
+
+import send_reports_configured as m
+
+
+class EmailEventsConn:
+    """OK Email events (recipients_to, subject, file_path) of one rundate + batch."""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.loads = 0
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                pass
+
+            def execute(self, sql, params):
+                assert params == ("2026-03-02", "7")
+                conn.loads += 1
+
+            def fetchall(self):
+                return list(conn.rows)
+
+        return Cursor()
+
+
+def patch_session(monkeypatch, conn):
+    @contextmanager
+    def session():
+        if conn is None:
+            raise OSError("DB down")
+        yield conn
+
+    monkeypatch.setattr(m, "db_session", session)
+
+
+def test_keys_are_normalized_like_the_events_table():
+    keys = m.EmailedKeySet(date(2026, 3, 2), "7")
+    keys.load(EmailEventsConn([("A@x.com; b@x.com", " Report ", r"\\srv\Share\R.xlsx")]))
+
+    assert m.emailed_key("a@x.com,b@x.com", "report", "//srv/share/r.xlsx") in keys
+    assert m.emailed_key("a@x.com", "report", "//srv/share/r.xlsx") not in keys
+    assert len(keys) == 1
+
+
+def test_mid_run_refresh_picks_up_other_runs_and_keeps_local_keys(monkeypatch):
+    conn = EmailEventsConn([("a@x.com", "S1", "")])
+    patch_session(monkeypatch, conn)
+    keys = m.EmailedKeySet(date(2026, 3, 2), "7", refresh_s=60)
+    keys.load(conn)
+    keys.add(m.emailed_key("c@x.com", "S3", ""))  # sent here, event not written yet
+
+    conn.rows.append(("b@x.com", "S2", ""))  # sent by an overlapping run
+    keys.maybe_refresh()
+    assert conn.loads == 1 and m.emailed_key("b@x.com", "S2", "") not in keys  # interval not up
+
+    keys.loaded_at -= 61
+    keys.maybe_refresh()
+    assert conn.loads == 2
+    assert {m.emailed_key(*k) for k in [("a@x.com", "S1", ""), ("b@x.com", "S2", ""), ("c@x.com", "S3", "")]} == keys.keys
+
+
+def test_failed_refresh_keeps_the_set_until_the_next_interval(monkeypatch):
+    conn = EmailEventsConn([("a@x.com", "S1", "")])
+    keys = m.EmailedKeySet(date(2026, 3, 2), "7", refresh_s=60)
+    keys.load(conn)
+    patch_session(monkeypatch, None)
+    keys.loaded_at -= 61
+
+    keys.maybe_refresh()
+
+    assert len(keys) == 1
+    assert keys.loaded_at > m.time.monotonic() - 1  # not retried on every row
+    assert "Could not refresh already-emailed keys" in m.Path(m.LOG_FILE_PATH).read_text(encoding="utf-8")
+
+
+def test_refresh_disabled_loads_once(monkeypatch):
+    conn = EmailEventsConn([])
+    patch_session(monkeypatch, conn)
+    keys = m.EmailedKeySet(date(2026, 3, 2), "7", refresh_s=0)
+    keys.load(conn)
+    keys.loaded_at -= 3600
+    keys.maybe_refresh()
+    assert conn.loads == 1
@@ -0,0 +1,39 @@
+import pytest
+
+import send_reports_configured as m
+
+
+def rows_with_attachments(tmp_path, n):
+    rows = []
+    for i in range(n):
+        path = tmp_path / f"report{i}.csv"
+        path.write_text(f"col\n{i}\n")
+        rows.append({"Receiver": f"r{i}@x.com", "Subject": f"Report {i}", "Attachement Path": str(path)})
+    return rows
+
+
+@pytest.mark.parametrize("engine", m.ENGINES)
+def test_every_engine_delivers_the_batch(engine, smtp_stub, email_list, tmp_path):
+    path = email_list(rows_with_attachments(tmp_path, 5))
+
+    args = m.parse_arguments(["--batch", "7", "--email-list", str(path), "--engine", engine,
+                              "--max-parallel", "2", "--build-workers", "2", "--force-resend"])
+    assert m.run_batches(args) == 0
+
+    assert sorted(msg["to"][0] for msg in smtp_stub.messages) == [f"r{i}@x.com" for i in range(5)]
+    for msg in smtp_stub.messages:
+        i = msg["to"][0][1]
+        assert f"Subject: Report {i}".encode() in msg["data"]
+        assert f'filename="report{i}.csv"'.encode() in msg["data"]
+
+
+def test_removed_async_engine_runs_as_thread(smtp_stub, email_list, tmp_path, monkeypatch):
+    monkeypatch.setitem(m.CONFIG, "ENGINE", "async")
+    path = email_list(rows_with_attachments(tmp_path, 2))
+
+    assert m.run_batches(m.parse_arguments(["--batch", "7", "--email-list", str(path), "--force-resend"])) == 0
+
+    assert len(smtp_stub.messages) == 2
+    assert 'ENGINE "async" was removed' in m.Path(m.LOG_FILE_PATH).read_text(encoding="utf-8")
+    with pytest.raises(SystemExit):
+        m.parse_arguments(["--batch", "7", "--engine", "async"])
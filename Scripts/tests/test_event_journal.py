@@ -0,0 +1,133 @@
+import json
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+
+import send_reports_configured as m
+
+
+class FakeEventsDb:
+    """The events table as a list; db_session / db_insert_email_events / the dedupe SELECT go here."""
+
+    def __init__(self):
+        self.rows: list[dict] = []
+        self.down = False
+
+    def insert(self, conn, events):
+        self.rows.extend(events)
+
+    @contextmanager
+    def session(self):
+        if self.down:
+            raise ConnectionRefusedError(111, "Connection refused")
+        yield self
+
+    def cursor(self):
+        db = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                pass
+
+            def execute(self, sql, params):
+                assert sql.split()[0] == "SELECT"
+
+            def fetchall(self):
+                # As MySQL DATETIME returns it: whole seconds, rounded
+                return [(ev["run_id"], ev["status"], ev["recipients_to"], ev["subject"], ev["file_path"],
+                         datetime.strptime(ev["timestamp_utc"][:19], "%Y-%m-%d %H:%M:%S")) for ev in db.rows]
+
+        return Cursor()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeEventsDb()
+    monkeypatch.setattr(m, "db_session", fake.session)
+    monkeypatch.setattr(m, "db_insert_email_events", fake.insert)
+    return fake
+
+
+def event(n, status="OK"):
+    return m.make_email_event("run-1", "EmailBatch7", m.date(2026, 1, 2), "master.xlsx", [m.Path(f"r{n}.xlsx")],
+                              f"u{n}@x.com", f"Report {n}", status, "")
+
+
+def crash(writer):
+    """The writer's process dies: its lock goes away, nothing else happens."""
+    m._unlock_file(writer._journal)
+    writer._journal.close()
+
+
+def journal_lines(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_failed_flush_keeps_every_event_in_the_journal(tmp_path, db):
+    db.down = True
+    writer = m.EmailEventWriter(tmp_path / "journal", "run-1", flush_size=2, flush_interval_s=60)
+    events = [event(n) for n in range(3)]
+    for ev in events:
+        writer.add(ev)
+
+    assert writer.close() is False
+    assert writer.stats["flush_failures"] >= 1
+    assert writer.journal_path.exists()
+    with open(writer.journal_path, encoding="utf-8") as fh:
+        assert m._read_journal(fh) == events
+    assert db.rows == []
+
+    db.down = False
+    assert m.replay_journals(tmp_path / "journal") == 3
+    assert db.rows == events
+    assert not writer.journal_path.exists()
+
+
+def test_replay_writes_only_events_after_the_last_ack(tmp_path, db):
+    writer = m.EmailEventWriter(tmp_path / "journal", "run-1", flush_size=2, flush_interval_s=60)
+    events = [event(n) for n in range(5)]
+    for ev in events[:4]:
+        writer.add(ev)          # two flushes, acks 2 and 4
+    db.down = True
+    writer.add(events[4])
+    writer.flush()
+    crash(writer)
+    assert [rec["ack"] for rec in journal_lines(writer.journal_path) if "ack" in rec] == [2, 4]
+    with open(writer.journal_path, "a", encoding="utf-8") as fh:
+        fh.write('{"seq": 6, "eve')  # torn last line
+    assert db.rows == events[:4]
+
+    db.down = False
+    assert m.replay_journals(tmp_path / "journal") == 1
+    assert db.rows == events
+
+
+def test_replay_does_not_duplicate_events_already_written(tmp_path, db):
+    writer = m.EmailEventWriter(tmp_path / "journal", "run-1", flush_size=10, flush_interval_s=60)
+    events = [event(n) for n in range(3)] + [event(0, "FAIL")]
+    for ev in events:
+        writer.add(ev)
+    # Died right after the INSERT committed, before the ack line
+    db.insert(None, events[:2])
+    crash(writer)
+
+    assert m.replay_journals(tmp_path / "journal") == 2
+    assert db.rows == events[:2] + events[2:]
+    # A second replay (journal gone) changes nothing
+    assert m.replay_journals(tmp_path / "journal") == 0
+    assert len(db.rows) == 4
+
+
+def test_journal_of_a_running_writer_is_left_alone(tmp_path, db):
+    db.down = True
+    writer = m.EmailEventWriter(tmp_path / "journal", "run-1", flush_size=10, flush_interval_s=60)
+    writer.add(event(1))
+    db.down = False
+    assert m.replay_journals(tmp_path / "journal") == 0
+    assert db.rows == []
+    assert writer.close() is True
+    assert len(db.rows) == 1
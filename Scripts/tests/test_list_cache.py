@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+import send_reports_configured as m
+
+ROWS = [{"Receiver": "a@x.com", "Subject": "S1"}, {"Receiver": "b@x.com", "Subject": "S2"}]
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return tmp_path / "state" / "list-cache"
+
+
+def load(path, cache_dir, reader="stream"):
+    return m.load_email_list_cached(path, cache_dir, reader)
+
+
+def forbid_parsing(monkeypatch):
+    monkeypatch.setattr(m, "read_email_list", lambda *a: pytest.fail("workbook parsed again"))
+
+
+def test_unchanged_file_is_served_from_the_cache(email_list, cache_dir, monkeypatch):
+    path = email_list(ROWS)
+    columns, rows, how = load(path, cache_dir)
+    assert how == "parsed"
+    assert columns[:2] == ["Receiver", "CC"] and [r[0] for r in rows] == ["a@x.com", "b@x.com"]
+
+    forbid_parsing(monkeypatch)
+    assert load(path, cache_dir) == (columns, rows, "hit")
+
+    # Copied again (new mtime), same bytes: hashed, not parsed
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert load(path, cache_dir) == (columns, rows, "unchanged")
+    assert load(path, cache_dir)[2] == "hit"
+
+
+def test_changed_workbook_is_parsed_again(email_list, cache_dir):
+    path = email_list(ROWS)
+    load(path, cache_dir)
+    st = os.stat(path)
+    email_list(ROWS + [{"Receiver": "c@x.com", "Subject": "S3"}])
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    _, rows, how = load(path, cache_dir)
+    assert how == "parsed" and [r[0] for r in rows] == ["a@x.com", "b@x.com", "c@x.com"]
+
+
+def test_reader_change_or_corrupt_cache_reparses(email_list, cache_dir):
+    path = email_list(ROWS)
+    load(path, cache_dir, "stream")
+    assert load(path, cache_dir, "pandas")[2] == "parsed"
+
+    for cache_file in cache_dir.glob("*.pkl"):
+        cache_file.write_bytes(b"not a pickle")
+    assert load(path, cache_dir, "pandas")[2] == "parsed"
+    assert load(path, cache_dir, "pandas")[2] == "hit"
+
+
+def test_no_list_cache_and_resident_memo(email_list, cache_dir, monkeypatch):
+    path = email_list(ROWS)
+    assert m.load_email_list_for_run(path, "stream", use_cache=False)[2] == "cache off"
+    assert not cache_dir.exists()
+
+    memo = {}
+    assert m.load_email_list_for_run(path, "stream", True, memo)[2] == "parsed"
+    monkeypatch.setattr(m, "load_email_list_cached", lambda *a: pytest.fail("on-disk cache read again"))
+    assert m.load_email_list_for_run(path, "stream", True, memo)[2] == "memory"
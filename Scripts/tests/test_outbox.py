@@ -0,0 +1,113 @@
+import smtplib
+import socket
+import sqlite3
+import time
+
+import pytest
+
+import send_reports_configured as m
+
+
+@pytest.mark.parametrize("exc, expected", [
+    (smtplib.SMTPResponseException(451, b"4.7.0 Try again in 30 seconds"), 30.0),
+    (smtplib.SMTPResponseException(421, b"Service not available"), 0.0),
+    (smtplib.SMTPResponseException(550, b"Mailbox unavailable"), None),
+    (smtplib.SMTPAuthenticationError(535, b"Bad credentials"), None),
+    (smtplib.SMTPRecipientsRefused({"a@x.com": (452, b"try again after 2 minutes")}), 120.0),
+    (smtplib.SMTPRecipientsRefused({"a@x.com": (452, b"busy"), "b@x.com": (550, b"no such user")}), None),
+    (smtplib.SMTPServerDisconnected("Connection unexpectedly closed"), 0.0),
+    (ConnectionResetError(104, "Connection reset by peer"), 0.0),
+    (ConnectionRefusedError(111, "Connection refused"), 0.0),
+    (TimeoutError("timed out"), 0.0),
+    (socket.gaierror(-3, "Temporary failure in name resolution"), 0.0),
+    (FileNotFoundError(2, "No such file"), None),
+    (PermissionError(13, "Permission denied"), None),
+    (IsADirectoryError(21, "Is a directory"), None),
+    (ValueError("bad header"), None),
+])
+def test_classify_send_error(exc, expected):
+    assert m.classify_send_error(exc) == expected
+
+
+def test_retry_delay_backs_off_with_jitter_and_honours_the_hint():
+    for attempt, step in ((1, 2.0), (2, 4.0), (3, 8.0), (6, 30.0)):
+        for _ in range(20):
+            assert step / 2 <= m.retry_delay(attempt, 0, 2, 30) <= step
+    assert m.retry_delay(1, 45, 2, 30) == 45
+
+
+def test_outbox_survives_reopen_and_drops_old_runs(tmp_path):
+    path = tmp_path / "outbox.sqlite"
+    box = m.Outbox(path)
+    box.mark("run-1", "k1", 0, "PENDING", 0)
+    box.mark("run-1", "k2", 1, "RETRY", 1, 123.0, "451 busy")
+    box.mark("run-1", "k2", 1, "RETRY", 2, 456.0)
+    box.mark("run-1", "k3", 2, "OK", 1)
+    box.mark("run-2", "k1", 0, "OK", 1)
+    box.close()
+
+    box = m.Outbox(path)
+    assert box.load("run-1") == {
+        "k1": m.OutboxEntry("PENDING", 0, None),
+        "k2": m.OutboxEntry("RETRY", 2, 456.0),
+        "k3": m.OutboxEntry("OK", 1, None),
+    }
+    assert box.conn.execute("SELECT last_error FROM outbox WHERE row_key='k2'").fetchone() == ("451 busy",)
+    box.conn.execute("UPDATE outbox SET updated_at = ? WHERE run_id = 'run-2'", (time.time() - 8 * 86400,))
+    box.close()
+
+    box = m.Outbox(path, keep_days=7)
+    assert box.load("run-2") == {}
+    assert len(box.load("run-1")) == 3
+    box.close()
+
+
+def run(list_path, *extra):
+    return m.run_batches(m.parse_arguments(["--batch", "7", "--email-list", str(list_path), "--engine", "thread", *extra]))
+
+
+def outbox_rows(run_id):
+    conn = sqlite3.connect(str(m.Path(m.CONFIG["STATE_DIR"]) / "outbox.sqlite"))
+    try:
+        return conn.execute("SELECT row_index, status, attempts FROM outbox WHERE run_id = ? ORDER BY row_index", (run_id,)).fetchall()
+    finally:
+        conn.close()
+
+
+def test_transient_failure_is_retried_with_backoff(smtp_stub, email_list, monkeypatch):
+    monkeypatch.setitem(m.CONFIG, "SEND_RETRY_BASE_S", 0.05)
+    monkeypatch.setitem(m.CONFIG, "SEND_RETRY_MAX_S", 0.2)
+    smtp_stub.script("MAIL", "451 4.7.0 Temporary failure, please retry")
+    path = email_list([{"Receiver": "a@x.com", "Subject": "S1"}])
+
+    assert run(path, "--force-resend") == 0
+
+    assert [msg["to"] for msg in smtp_stub.messages] == [["a@x.com"]]
+    assert smtp_stub.verbs().count("MAIL") == 2
+    assert outbox_rows(f"email-log_{m.date.today():%Y-%m-%d}_Batch-7") == [(0, "OK", 2)]
+
+
+def test_permanent_failure_is_not_retried(smtp_stub, email_list):
+    smtp_stub.script("MAIL", "550 5.1.1 No such user")
+    path = email_list([{"Receiver": "a@x.com", "Subject": "S1"}])
+
+    assert run(path, "--force-resend") == 1
+
+    assert smtp_stub.messages == []
+    assert smtp_stub.verbs().count("MAIL") == 1
+    assert outbox_rows(f"email-log_{m.date.today():%Y-%m-%d}_Batch-7") == [(0, "FAIL", 1)]
+
+
+def test_rerun_skips_rows_the_outbox_has_as_sent(smtp_stub, email_list):
+    path = email_list([{"Receiver": "a@x.com", "Subject": "S1"}, {"Receiver": "b@x.com", "Subject": "S2"}])
+    run_id = f"email-log_{m.date.today():%Y-%m-%d}_Batch-7"
+    box = m.Outbox(m.Path(m.CONFIG["STATE_DIR"]) / "outbox.sqlite")
+    box.mark(run_id, m.outbox_key(m.emailed_key("a@x.com", "S1", "")), 0, "OK", 1)
+    box.close()
+
+    # No DB here: the row still to send fails its refresh check, the one already sent is not touched
+    run(path)
+
+    assert smtp_stub.messages == []
+    assert outbox_rows(run_id)[0] == (0, "OK", 1)
+    assert outbox_rows(run_id)[1][:2] == (1, "FAIL")
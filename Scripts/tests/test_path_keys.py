@@ -0,0 +1,45 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+import path_keys
+
+SAMPLES = [
+    None,
+    "",
+    r"  \\Share\Reports\Daily Sales.XLSB ",
+    "C:/Already/Forward/x.xlsx",
+    " A@X.com; b@x.com ,C@x.com ",
+    "  Daily Sales - North  ",
+    "x" * 1000,
+]
+
+
+def run_sql(expr: str, value):
+    """
+    A path_keys SQL expression on SQLite (ASCII samples: SQLite's LOWER is ASCII
+    only). LEFT is a keyword there, so it runs as left_(); MySQL reads the '\\\\'
+    literal as one backslash, SQLite takes it verbatim.
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.create_function("left_", 2, lambda s, n: None if s is None else s[:n])
+    sql = "SELECT " + expr.format(col="?").replace("LEFT(", "left_(").replace("'\\\\'", "'\\'")
+    return conn.execute(sql, (value,)).fetchone()[0]
+
+
+@pytest.mark.parametrize("value", SAMPLES)
+@pytest.mark.parametrize("fn, expr", [
+    (path_keys.path_key, path_keys.PATH_KEY_SQL),
+    (path_keys.to_key, path_keys.TO_KEY_SQL),
+    (path_keys.subject_key, path_keys.SUBJECT_KEY_SQL),
+])
+def test_sql_matches_python(fn, expr, value):
+    assert run_sql(expr, value) == fn(value)
+
+
+def test_claim_key_ignores_attachment_order_and_spelling():
+    a = path_keys.email_claim_key(date(2026, 1, 2), "7", "a@x.com; b@x.com", "Sales ", [r"C:\R\a.xlsx", "c:/r/b.xlsx"])
+    b = path_keys.email_claim_key(date(2026, 1, 2), "7", "A@x.com,b@x.com", "sales", ["C:/r/B.xlsx", r"c:\r\A.xlsx"])
+    assert a == b
+    assert a != path_keys.email_claim_key(date(2026, 1, 3), "7", "a@x.com,b@x.com", "sales", ["c:/r/a.xlsx", "c:/r/b.xlsx"])
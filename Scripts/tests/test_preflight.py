@@ -0,0 +1,39 @@
+import send_reports_configured as m
+
+COLUMNS = ["Receiver", "CC", "BCC", "Subject", "Attachement Path"]
+
+
+def test_clean_rows_are_normalized():
+    rows = [("a@x.com; b@x.com,A@x.com", " c@x.com ", None, "Sales", r"C:\r\a.xlsx; C:\r\b.xlsx")]
+    pf = m.preflight_email_list(COLUMNS, rows)
+    assert pf.rejected == []
+    (row, idx), = pf.rows
+    assert idx == 0
+    assert (row["Receiver"], row["CC"], row["BCC"]) == ("a@x.com, b@x.com", "c@x.com", "")
+    assert row["_greeting"] == "Dear Team"
+    assert [str(p) for p in pf.atts[0]] == [r"C:\r\a.xlsx", r"C:\r\b.xlsx"]
+
+
+def test_rejections_keep_list_indexes():
+    rows = [
+        ("", "", "", "S", ""),
+        ("a@x.com, not an address", "", "", "S", ""),
+        ("a@x.com", "", "", None, ""),
+        ("a@x.com", "", "", "S", "f.xlsx"),
+        ("A@X.com", "", "", "s", "F.xlsx"),
+    ]
+    pf = m.preflight_email_list(COLUMNS, rows)
+    assert [idx for _, idx in pf.rows] == [3]
+    assert pf.rows[0][0]["_greeting"] == "Dear Sir"
+    assert [(r[0], r[1], r[2]) for r in pf.rejected] == [
+        (0, "FAIL", "Missing Receiver"),
+        (1, "FAIL", "Invalid address: not an address"),
+        (2, "FAIL", "Missing Subject"),
+        (4, "SKIP", "Duplicate of row 4 in the list"),
+    ]
+
+
+def test_duplicates_kept_when_dedupe_is_off():
+    rows = [("a@x.com", "", "", "S", "f.xlsx")] * 2
+    pf = m.preflight_email_list(COLUMNS, rows, dedupe=False)
+    assert [idx for _, idx in pf.rows] == [0, 1]
@@ -0,0 +1,24 @@
+import send_reports_configured as m
+
+
+def test_seed_counts_only_the_last_24_hours():
+    limiter = m.SendRateLimiter(0, 1, 100, {0: 3, 5: 4, 23: 1, 24: 50, 30: 50})
+    assert limiter.sent_24h == 8
+
+
+def test_daily_budget_and_refund():
+    limiter = m.SendRateLimiter(0, 1, 3, {2: 1})
+    assert limiter.acquire() and limiter.acquire()
+    assert not limiter.acquire()
+    limiter.refund()
+    assert limiter.sent_24h == 2
+    assert limiter.acquire()
+    assert limiter.sent_24h == 3
+
+
+def test_refund_returns_the_token():
+    limiter = m.SendRateLimiter(0.001, 1, 0)
+    assert limiter.acquire()
+    limiter.refund()
+    assert limiter._tokens.value == 1.0
+    assert limiter.acquire()
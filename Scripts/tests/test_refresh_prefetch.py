@@ -0,0 +1,64 @@
+from datetime import date
+
+import pytest
+
+import send_reports_configured as m
+
+RUN = date(2026, 3, 2)
+
+
+class EventsCursor:
+    """GROUP BY over in-memory Refresh OK events: (file_path, rundate, method)."""
+
+    def __init__(self, events, use_keys):
+        self.events, self.use_keys = events, use_keys
+        self.queries = []
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params):
+        check_date, *wanted = params
+        self.queries.append(wanted)
+        groups = {}
+        for fp, rundate, method in self.events:
+            key = m.path_key(fp) if self.use_keys else fp.lower()
+            if key in wanted:
+                latest, email = groups.get(key, (None, 0))
+                groups[key] = (max(filter(None, (latest, rundate))),
+                               max(email, int(rundate == check_date and method.lower() == "email")))
+        self.rows = [(key, latest, email) for key, (latest, email) in groups.items()]
+
+    def fetchall(self):
+        return self.rows
+
+
+EVENTS = [
+    (r"\\srv\Share\A.xlsx", date(2026, 3, 1), "scheduled"),
+    (r"\\srv\Share\A.xlsx", RUN, "Email"),
+    ("//srv/share/a.xlsx", date(2026, 2, 1), "scheduled"),
+    (r"\\srv\Share\B.xlsx", date(2026, 2, 27), "email"),
+    (r"\\srv\Share\C.xlsx", RUN, "scheduled"),
+]
+PATHS = [r"\\srv\Share\A.xlsx", "//SRV/share/a.xlsx", r"\\srv\Share\B.xlsx", r"\\srv\Share\C.xlsx", r"\\srv\Share\Never.xlsx"]
+
+
+@pytest.mark.parametrize("use_keys", [True, False])
+def test_one_grouped_query_per_chunk_gives_each_files_status(monkeypatch, use_keys):
+    monkeypatch.setattr(m, "has_event_keys", lambda conn: use_keys)
+    monkeypatch.setattr(m, "REFRESH_PREFETCH_CHUNK", 2)
+    cur = EventsCursor(EVENTS, use_keys)
+    conn = type("Conn", (), {"cursor": lambda self: cur})()
+
+    lookup = m.db_prefetch_refresh_status(conn, PATHS, RUN)
+
+    # Chunks of 2: 4 distinct path keys, or 5 lowercased legacy spellings (both forms of A fold into one entry)
+    assert len(cur.queries) == (2 if use_keys else 3)
+    assert lookup[m.refresh_key(PATHS[0])] == m.RefreshStatus(RUN, True)
+    assert lookup[m.refresh_key(PATHS[2])] == m.RefreshStatus(date(2026, 2, 27), False)
+    assert lookup[m.refresh_key(PATHS[3])] == m.RefreshStatus(RUN, False)
+    assert m.refresh_key(PATHS[4]) not in lookup
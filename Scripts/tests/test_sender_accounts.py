@@ -0,0 +1,33 @@
+import send_reports_configured as m
+
+
+def accounts(n, sticky=False):
+    return m.SenderAccounts([m.SenderAccount(f"s{i}@x.com", "pw", m.SendRateLimiter(0, 1, 0)) for i in range(n)], sticky)
+
+
+def users(order):
+    return [a.user for a in order]
+
+
+def test_round_robin_rotates_the_first_account():
+    accts = accounts(3)
+    firsts = [users(accts.order("a@x.com"))[0] for _ in range(4)]
+    assert firsts == ["s0@x.com", "s1@x.com", "s2@x.com", "s0@x.com"]
+
+
+def test_sticky_keeps_recipients_on_one_account():
+    accts = accounts(3, sticky=True)
+    assert users(accts.order("A@x.com; b@x.com")) == users(accts.order("a@x.com,b@x.com"))
+
+
+def test_throttled_accounts_go_last():
+    accts = accounts(3)
+    accts.accounts[0].pause(60)
+    assert users(accts.order("a@x.com")) == ["s1@x.com", "s2@x.com", "s0@x.com"]
+
+
+def test_specs_fall_back_to_from_user(monkeypatch):
+    monkeypatch.setitem(m.CONFIG, "SENDER_ACCOUNTS", [])
+    assert m.sender_account_specs() == [{"user": m.CONFIG["FROM_USER"], "password": m.CONFIG["APP_PASSWORD"]}]
+    monkeypatch.setitem(m.CONFIG, "SENDER_ACCOUNTS", [{"user": "a", "password": "p"}, {"user": "b", "password": "q"}])
+    assert [s["user"] for s in m.sender_account_specs()] == ["a", "b"]
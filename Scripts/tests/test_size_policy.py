@@ -0,0 +1,57 @@
+import pytest
+
+import send_reports_configured as m
+
+
+@pytest.fixture
+def files(tmp_path):
+    small = tmp_path / "small.csv"
+    small.write_bytes(b"a,b\n" * 100)
+    medium = tmp_path / "medium.csv"
+    medium.write_bytes(b"x,y,z\n" * 5000)
+    large = tmp_path / "large.bin"
+    large.write_bytes(bytes(range(256)) * 400)
+    return small, medium, large
+
+
+def test_auto_mode_attaches_zips_or_links_by_size(files):
+    small, medium, large = files
+    config = dict(m.CONFIG, ATTACH_ZIP_OVER_BYTES=1000, ATTACH_LINK_OVER_BYTES=50_000, ATTACH_MAX_MESSAGE_BYTES=0)
+    plan = {item.path.name: item for item in m.plan_attachments(config, [small, medium, large])}
+    assert [plan[p.name].action for p in files] == ["attach", "zip", "link"]
+    assert plan["medium.csv"].sent < plan["medium.csv"].size
+    assert plan["large.bin"].sent == 0
+    assert m.describe_plan(list(plan.values()))[0] == "Email+Zip+Link"
+
+
+def test_explicit_mode_applies_to_every_file(files):
+    config = dict(m.CONFIG, ATTACH_ZIP_OVER_BYTES=1000, ATTACH_LINK_OVER_BYTES=50_000)
+    assert {item.action for item in m.plan_attachments(config, list(files), "attach")} == {"attach"}
+
+
+def send_row(path, config):
+    row = {"Receiver": "a@x.com", "CC": "", "BCC": "", "Subject": "Daily", "Attachement Path": str(path)}
+    return m.process_single_email((row, 0), config, "run-1", "EmailBatch7", m.date(2026, 1, 2), "master.xlsx",
+                                  False, False, 18, True)
+
+
+def test_policy_stats_count_delivered_messages_only(files, smtp_stub, monkeypatch):
+    small, medium, _ = files
+    monkeypatch.setattr(m, "_SENDER_ACCOUNTS", None)
+    monkeypatch.setattr(m, "_POLICY_STATS", dict.fromkeys(m._POLICY_STATS, 0))
+    config = dict(m.CONFIG, ATTACH_ZIP_OVER_BYTES=1000, ATTACH_LINK_OVER_BYTES=0, ATTACH_MAX_MESSAGE_BYTES=0)
+
+    # Planning alone (retries and failover rebuild the plan) counts nothing
+    m.plan_attachments(config, [medium])
+    m.plan_attachments(config, [medium])
+    assert m._POLICY_STATS["zipped"] == 0
+
+    smtp_stub.script("MAIL", "550 5.7.1 Rejected")
+    assert send_row(medium, config)["status"] == "FAIL"
+    assert m._POLICY_STATS == {"attached": 0, "zipped": 0, "linked": 0, "bytes_avoided": 0}
+
+    assert send_row(medium, config)["status"] == "OK"
+    assert send_row(small, config)["status"] == "OK"
+    assert m._POLICY_STATS["zipped"] == 1
+    assert m._POLICY_STATS["attached"] == 1
+    assert 0 < m._POLICY_STATS["bytes_avoided"] < medium.stat().st_size
@@ -0,0 +1,80 @@
+from email.message import EmailMessage
+
+import pytest
+
+import send_reports_configured as m
+from smtp_stub import SmtpStub
+
+
+@pytest.fixture
+def stub():
+    stub = SmtpStub()
+    yield stub
+    stub.close()
+
+
+def make_pool(stub, **kw):
+    return m.SmtpSessionPool("sender@x.com", "pw", False, "127.0.0.1", 0, stub.port, timeout=10, **kw)
+
+
+def send(pool, n):
+    for i in range(n):
+        msg = EmailMessage()
+        msg["Subject"] = f"S{i}"
+        msg.set_content("body")
+        pool.send_message(msg, "sender@x.com", [f"r{i}@x.com"])
+
+
+def test_one_session_is_reset_and_reused(stub):
+    pool = make_pool(stub)
+    send(pool, 3)
+    pool.close_all()
+
+    assert pool.stats == {"connects": 1, "logins": 1, "sends": 3, "reconnects": 0, "recycles": 0}
+    assert [msg["conn"] for msg in stub.messages] == [1, 1, 1]
+    assert stub.verbs(1).count("RSET") == 2
+    assert stub.verbs(1)[-1] == "QUIT"
+
+
+def test_failed_rset_drops_the_session(stub):
+    pool = make_pool(stub)
+    send(pool, 1)
+    stub.script("RSET", "421 4.4.2 Idle too long")
+    send(pool, 1)
+
+    assert [msg["conn"] for msg in stub.messages] == [1, 2]
+    assert pool.stats["reconnects"] == 1 and pool.stats["connects"] == 2
+
+
+def test_421_during_send_reconnects_and_resends_once(stub):
+    pool = make_pool(stub)
+    stub.script("DATA", "421 4.7.0 Try again later, closing connection")
+    send(pool, 1)
+
+    assert [msg["conn"] for msg in stub.messages] == [2]
+    assert pool.stats["reconnects"] == 1 and pool.stats["sends"] == 1
+
+
+def test_421_twice_in_a_row_is_raised(stub):
+    pool = make_pool(stub)
+    stub.script("DATA", "421 4.7.0 Try again later", "421 4.7.0 Try again later")
+    with pytest.raises(m.smtplib.SMTPResponseException) as exc:
+        send(pool, 1)
+    assert exc.value.smtp_code == 421
+    assert stub.messages == []
+
+
+def test_session_is_recycled_after_max_messages(stub):
+    pool = make_pool(stub, max_messages=2)
+    send(pool, 5)
+
+    assert [msg["conn"] for msg in stub.messages] == [1, 1, 2, 2, 3]
+    assert pool.stats["recycles"] == 2 and pool.stats["connects"] == 3
+
+
+def test_idle_session_is_recycled(stub):
+    pool = make_pool(stub, idle_timeout=0)
+    send(pool, 2)
+
+    assert [msg["conn"] for msg in stub.messages] == [1, 2]
+    assert pool.stats["recycles"] == 1
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+import send_reports_configured as m
+
+
+@pytest.fixture
+def share(tmp_path):
+    """Two report folders; B has a sub-folder named like a file."""
+    a, b = tmp_path / "A", tmp_path / "B"
+    a.mkdir()
+    b.mkdir()
+    (a / "r1.xlsx").write_bytes(b"1" * 10)
+    (a / "r2.xlsx").write_bytes(b"2" * 20)
+    (a / "other.xlsx").write_bytes(b"")
+    (b / "r3.xlsx").write_bytes(b"3" * 30)
+    (b / "sub.xlsx").mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def listings(monkeypatch):
+    """Folders listed by _scan_dir, in call order."""
+    seen = []
+    real = m._scan_dir
+
+    def scan(parent, names):
+        seen.append(parent)
+        return real(parent, names)
+
+    monkeypatch.setattr(m, "_scan_dir", scan)
+    return seen
+
+
+def test_each_folder_is_listed_once_for_all_rows(share, listings):
+    paths = [share / "A" / "r1.xlsx", share / "A" / "r2.xlsx", share / "A" / "gone.xlsx",
+             share / "B" / "r3.xlsx", share / "B" / "sub.xlsx", share / "A" / "r1.xlsx"]
+    cache = m.StatCache(4)
+
+    got = cache.get_many(paths)
+
+    assert sorted(listings) == [str(share / "A"), str(share / "B")]
+    assert got[str(share / "A" / "r1.xlsx")] == m.stat_file(share / "A" / "r1.xlsx")
+    assert got[str(share / "B" / "r3.xlsx")].size == 30
+    assert got[str(share / "A" / "gone.xlsx")] is None
+    assert got[str(share / "B" / "sub.xlsx")] is None  # a folder is not an attachment
+    assert cache.stats == {"dirs": 2, "files": 5, "missing": 2, "fallbacks": 0}
+
+    # Later rows and the size policy read the cache; forget() makes a file be looked at again
+    cache.get_many(paths[:2])
+    assert len(listings) == 2
+    cache.forget([paths[0]])
+    cache.get_many(paths[:2])
+    assert listings[2:] == [str(share / "A")]
+
+
+def test_missing_or_unlistable_folders(share, monkeypatch):
+    cache = m.StatCache(2)
+    assert cache.get_many([share / "nope" / "r.xlsx"]) == {str(share / "nope" / "r.xlsx"): None}
+
+    def denied(parent, names):
+        raise PermissionError(parent)
+
+    monkeypatch.setattr(m, "_scan_dir", denied)
+    got = cache.get_many([share / "A" / "r2.xlsx", share / "A" / "gone.xlsx"])
+    assert got[str(share / "A" / "r2.xlsx")].size == 20  # stat'ed one by one instead
+    assert got[str(share / "A" / "gone.xlsx")] is None
+    assert cache.stats["fallbacks"] == 1
+
+
+def test_prefetched_stats_spare_the_worker_its_own_stat(share, smtp_stub, monkeypatch):
+    report = share / "A" / "r1.xlsx"
+    file_stats = m.StatCache(1).get_many([report])
+    real_stat = os.stat
+
+    def no_stat_of_report(path, *a, **kw):
+        if os.fspath(path) == str(report):
+            pytest.fail("attachment stat'ed again in the worker")
+        return real_stat(path, *a, **kw)
+
+    monkeypatch.setattr(m, "_SENDER_ACCOUNTS", None)
+    monkeypatch.setattr(m, "_ATTACHMENT_CACHE", None)
+    monkeypatch.setattr(m.os, "stat", no_stat_of_report)
+    row = {"Receiver": "a@x.com", "CC": "", "BCC": "", "Subject": "Daily", "Attachement Path": str(report)}
+    result = m.process_single_email((row, 0), m.CONFIG, "run-1", "7", m.date(2026, 1, 2),
+                                    "master.xlsx", False, False, 18, True, file_stats=file_stats)
+
+    assert result["status"] == "OK"
+    assert b'filename="r1.xlsx"' in smtp_stub.messages[0]["data"]
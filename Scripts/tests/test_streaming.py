@@ -0,0 +1,106 @@
+import email
+import email.policy
+import io
+import os
+from email.message import EmailMessage
+
+import pytest
+
+import send_reports_configured as m
+
+
+def make_msg():
+    msg = EmailMessage()
+    msg["From"] = "report@example.com"
+    msg["To"] = "a@example.com"
+    msg["Subject"] = "Daily report"
+    msg.set_content("Dear Sir,\n.leading dot line\nRegards")
+    return msg
+
+
+def stream(msg, atts) -> bytes:
+    out = io.BytesIO()
+    written = m.write_streamed_message(out, msg, atts)
+    data = out.getvalue()
+    assert written == len(data)
+    return data
+
+
+def parse(data: bytes):
+    # What the server stores after DATA: dot-stuffing undone
+    return email.message_from_bytes(data.replace(b"\r\n..", b"\r\n."), policy=email.policy.default)
+
+
+def test_round_trip(tmp_path):
+    big = tmp_path / "big.xlsb"
+    big.write_bytes(os.urandom(m.STREAM_READ_CHUNK * 3 + 17))
+    small = tmp_path / "notes.txt"
+    small.write_bytes(b"line one\r\n.line two\r\n")
+
+    parsed = parse(stream(make_msg(), [big, small]))
+
+    files = {p.get_filename(): p.get_payload(decode=True) for p in parsed.iter_attachments()}
+    assert files == {"big.xlsb": big.read_bytes(), "notes.txt": small.read_bytes()}
+    assert ".leading dot line" in parsed.get_body(("plain",)).get_content()
+
+
+def test_lines_are_crlf_and_dot_stuffed(tmp_path):
+    att = tmp_path / "a.bin"
+    att.write_bytes(os.urandom(5000))
+    data = stream(make_msg(), [att])
+    assert b"\n" not in data.replace(b"\r\n", b"")
+    assert b"\r\n.leading" not in data
+    assert b"\r\n..leading" in data
+
+
+def test_msg_is_not_modified_and_can_be_streamed_again(tmp_path):
+    # A failover to another sender account streams the same msg a second time
+    att = tmp_path / "report.xlsx"
+    att.write_bytes(os.urandom(2000))
+    msg = make_msg()
+    before = msg.as_bytes()
+
+    first = parse(stream(msg, [att]))
+    assert msg.as_bytes() == before
+    second = parse(stream(msg, [att]))
+
+    for parsed in (first, second):
+        parts = list(parsed.iter_attachments())
+        assert [p.get_filename() for p in parts] == ["report.xlsx"]
+        assert parts[0].get_payload(decode=True) == att.read_bytes()
+        assert b"@@ATTACHMENT-" not in parsed.as_bytes()
+
+
+def test_parts_are_shared_not_copied(tmp_path, monkeypatch):
+    # build_message layout: text + html alternative, a zipped report already attached
+    msg = make_msg()
+    msg.add_alternative("<pre>Dear Sir</pre>", subtype="html")
+    zipped = m.MIMEPart()
+    zipped.set_content(b"PK\x03\x04zip", maintype="application", subtype="zip", filename="big.zip")
+    m.attach_part(msg, zipped)
+    parts_before = list(msg.get_payload())
+    att = tmp_path / "plain.csv"
+    att.write_bytes(b"a,b\r\n1,2\r\n")
+    monkeypatch.setattr("copy.deepcopy", lambda *a, **k: pytest.fail("message deep-copied"))
+
+    parsed = parse(stream(msg, [att]))
+
+    assert msg.get_payload() == parts_before
+    assert all(a is b for a, b in zip(msg.get_payload(), parts_before))
+    assert [p.get_filename() for p in parsed.iter_attachments()] == ["big.zip", "plain.csv"]
+    assert parsed.get_body(("html",)).get_content().strip() == "<pre>Dear Sir</pre>"
+
+
+def test_single_part_message_gets_a_mixed_shell(tmp_path):
+    msg = make_msg()
+    before = msg.as_bytes()
+    att = tmp_path / "r.bin"
+    att.write_bytes(os.urandom(300))
+
+    parsed = parse(stream(msg, [att]))
+
+    assert msg.as_bytes() == before
+    assert parsed.get_content_type() == "multipart/mixed"
+    assert parsed["Subject"] == "Daily report"
+    assert ".leading dot line" in parsed.get_body(("plain",)).get_content()
+    assert [p.get_payload(decode=True) for p in parsed.iter_attachments()] == [att.read_bytes()]